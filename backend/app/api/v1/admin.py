@@ -0,0 +1,88 @@
+"""Admin-only diagnostics: sampling CPU profiles and tracemalloc snapshots.
+
+Every route requires the ``X-Admin-Token`` header to match the
+``admin_token`` setting; with no token configured the routes answer 404.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import secrets
+import tracemalloc
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import get_settings
+from app.core.profiling import memory_top, profiler
+
+_settings = get_settings()
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    expected = _settings.admin_token
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.post("/profile/cpu/start")
+async def start_cpu_profile(
+    seconds: float = Query(10.0, gt=0, le=300),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+) -> dict:
+    """Sample every thread's stack for up to ``seconds`` (stops by itself)."""
+    try:
+        profiler.start(seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return profiler.status()
+
+
+@router.get("/profile/cpu")
+async def get_cpu_profile_status() -> dict:
+    """Whether a profile is running, and how many samples and stacks it has."""
+    return profiler.status()
+
+
+@router.post("/profile/cpu/stop", response_class=PlainTextResponse)
+async def stop_cpu_profile() -> PlainTextResponse:
+    """Stop the profile if still running and return its collapsed stacks.
+
+    One ``thread;module:function;... count`` line per distinct stack, ready
+    for flamegraph.pl or speedscope.
+    """
+    if not profiler.started_at:
+        raise HTTPException(status_code=404, detail="no profile recorded")
+    await asyncio.to_thread(profiler.stop)
+    return PlainTextResponse(profiler.collapsed())
+
+
+@router.post("/memory/start")
+async def start_memory_tracing(frames: int = Query(1, ge=1, le=50)) -> dict:
+    """Start tracemalloc; only allocations made from now on are traced."""
+    if tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc already tracing")
+    tracemalloc.start(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@router.get("/memory")
+async def get_memory_top(limit: int = Query(20, ge=1, le=200)) -> dict:
+    """Live traced allocations grouped by module, largest first."""
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not tracing")
+    return await asyncio.to_thread(memory_top, limit)
+
+
+@router.post("/memory/stop")
+async def stop_memory_tracing() -> dict:
+    """Stop tracemalloc and free its traces."""
+    was_tracing = tracemalloc.is_tracing()
+    tracemalloc.stop()
+    return {"tracing": False, "was_tracing": was_tracing}
@@ -2,12 +2,17 @@
 
 from __future__ import annotations
 
+import asyncio
 import re
+import uuid
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 from app.core.config import get_settings
+from app.core.exceptions import AgentOverloadedException
+from app.core.offload import run_cpu
+from app.core.rate_limit import check_rate_limit, client_key
 from app.schemas.agent import (
     ClientSyncRequest,
     ClientSyncResponse,
@@ -17,13 +22,19 @@ from app.schemas.agent import (
     SendMessageRequest,
     StopResponse,
 )
+from app.services.agent.scheduler import SlotLease, get_scheduler
 from app.services.agent.service import AgentService
-from app.services.agent.session import get_session_manager
-from app.services.streaming import create_agent_sse_stream
+from app.services.agent.session import MessageQueueFull, PendingTurn, get_session_manager
+from app.services.streaming import create_agent_sse_stream, create_sequenced_sse_stream
 
 router = APIRouter()
 _settings = get_settings()
 
+# How often an event stream checks whether its SSE client has gone away.
+_DISCONNECT_POLL_INTERVAL = 0.5
+
+_BUDGET_EXHAUSTED = "会话 token 预算已用完，请新建会话"
+
 
 def _safe_fence(content: str) -> str:
     """Return a backtick fence at least one tick longer than any run in content.
@@ -105,6 +116,153 @@ def _append_history(sess, user_message: str, assistant_text: str) -> None:
     sess.message_history.append(ModelResponse(parts=[TextPart(content=assistant_text)]))
 
 
+async def _detach_on_disconnect(request: Request, detach) -> None:
+    """Detach this stream from its session as soon as the client disconnects.
+
+    Starlette may not close the response generator promptly after a dropped
+    connection; polling lets the session start its grace timer (or drop a
+    viewer's queue) right away.
+    """
+    while True:
+        if await request.is_disconnected():
+            detach()
+            return
+        await asyncio.sleep(_DISCONNECT_POLL_INTERVAL)
+
+
+async def _run_turn(
+    sess,
+    service: AgentService,
+    req: SendMessageRequest,
+    turn_id: str,
+    lease: SlotLease | None = None,
+) -> None:
+    """Execute one agent turn into ``sess.events`` (run by the session runner).
+
+    Owned by the session rather than an HTTP response, so a dropped stream
+    neither cancels the turn nor loses its events. Always ends the turn's
+    events with ``done``, after the session status is final.
+
+    ``lease`` is the provider slot admitted at request time; turns that
+    waited in the session queue acquire theirs here instead.
+    """
+    fan_out = req.mode == "fan_out"
+    was_stopped = False
+    ran = False
+    try:
+        if sess.stop_event.is_set():
+            # /stop arrived before the turn got to run.
+            sess.status = "stopped"
+            sess.publish({"type": "stopped", "content": "", "turn_id": turn_id})
+            return
+        # Expanded when the turn starts, so a queued message's @document sees
+        # the edits of the turns before it.
+        user_message = await _build_user_message(sess, req)
+        if lease is None:
+            lease = await get_scheduler().acquire(req.provider)
+        remaining = sess.token_budget_remaining()
+        if remaining == 0:
+            # Spent by the turns queued ahead of this one.
+            sess.status = "failed"
+            sess.publish({"type": "error", "error": _BUDGET_EXHAUSTED})
+            return
+        if fan_out:
+            # Each part takes a provider slot of its own (see _invoke_fan_out).
+            lease.release()
+        ran = True
+        async for evt in service.run(
+            user_message,
+            message_history=sess.message_history,
+            fan_out=fan_out,
+            trace=req.trace,
+            token_limit=remaining,
+        ):
+            if evt.get("type") == "stopped":
+                was_stopped = True
+            if evt.get("type") != "done":
+                sess.publish(evt)
+        # Persist this turn into history for multi-turn continuity.
+        # (Only when not cancelled, so we don't remember half-finished turns.)
+        if not was_stopped:
+            _append_history(sess, user_message, service.last_assistant_text)
+        sess.status = "stopped" if was_stopped else "done"
+    except AgentOverloadedException as e:
+        sess.status = "failed"
+        sess.publish({"type": "error", "error": e.message, "retry_after": e.retry_after})
+    except Exception as e:  # noqa: BLE001 — reported to readers, not the event loop
+        sess.status = "failed"
+        sess.publish({"type": "error", "error": str(e)})
+    finally:
+        if lease is not None:
+            lease.release()
+        if ran:
+            sess.record_usage(service.usage)
+        if sess.is_running():  # cancelled
+            sess.status = "stopped"
+        sess.publish({"type": "done", "content": "", "turn_id": turn_id})
+
+
+def _turn_filter(turn_id: str):
+    """Predicate keeping only one turn's events (plus its queue updates)."""
+    inside = False
+
+    def keep(evt: dict) -> bool:
+        nonlocal inside
+        if evt.get("type") == "turn_started":
+            inside = evt["turn_id"] == turn_id
+        tagged = evt.get("turn_id")
+        return tagged == turn_id if tagged is not None else inside
+
+    return keep
+
+
+async def _session_events(request: Request, sess, after: int, turn_id: str | None = None):
+    """Yield ``(seq, event)`` after ``after``; follow a live run up to its ``done``.
+
+    With ``turn_id`` only that turn's events are yielded, ending at its
+    ``done``; otherwise everything up to the ``done`` of the last running
+    turn. With no run in progress only the retained backlog is replayed.
+    While the stream is open it counts as an attached reader of the session.
+    """
+    keep = _turn_filter(turn_id) if turn_id else (lambda _evt: True)
+    detach = sess.attach()
+    watcher = asyncio.create_task(_detach_on_disconnect(request, detach))
+    try:
+        if not sess.is_running():
+            for seq, evt in sess.events.since(after):
+                if keep(evt):
+                    yield seq, evt
+            return
+        async for seq, evt in sess.events.subscribe(after):
+            if not keep(evt):
+                continue
+            yield seq, evt
+            if evt.get("type") != "done":
+                continue
+            if turn_id is not None:
+                if evt.get("turn_id") == turn_id:
+                    return
+            # An earlier turn's ``done`` may be replayed first; keep following
+            # until the current turn has finished.
+            elif not sess.is_running():
+                return
+    finally:
+        watcher.cancel()
+        detach()
+
+
+def _sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        create_sequenced_sse_stream(stream),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 def _provider_credentials(provider: str) -> tuple[str, str]:
     """Resolve (api_key, base_url) for a provider from settings.
 
@@ -120,6 +278,17 @@ def _provider_credentials(provider: str) -> tuple[str, str]:
     raise HTTPException(status_code=400, detail=f"unsupported provider: {provider}")
 
 
+@router.get("/scheduler")
+async def get_scheduler_stats() -> dict:
+    """Provider slot usage and wait-queue depth of the agent run scheduler."""
+    scheduler = get_scheduler()
+    return {
+        "max_waiting": scheduler.max_waiting,
+        "max_wait_seconds": scheduler.max_wait,
+        "providers": scheduler.stats(),
+    }
+
+
 @router.post("/sessions", response_model=CreateSessionResponse)
 async def create_session(req: CreateSessionRequest) -> CreateSessionResponse:
     """Create a new agent session with initial document content."""
@@ -132,15 +301,38 @@ async def create_session(req: CreateSessionRequest) -> CreateSessionResponse:
     )
 
 
-@router.post("/sessions/{session_id}/messages")
-async def send_message(session_id: str, req: SendMessageRequest) -> StreamingResponse:
-    """Send a user message and stream agent events back via SSE."""
-    mgr = get_session_manager()
-    sess = mgr.get(session_id)
-    if sess is None:
-        raise HTTPException(status_code=404, detail="session not found")
-    if sess.status == "running":
+async def _build_user_message(sess, req: SendMessageRequest) -> str:
+    """Expand @<ref> mentions and @document, append any unreferenced attached
+    contexts (legacy selection kept for compatibility).
+
+    Expansion scans and copies the whole document for ``@document``, so on
+    large inputs it runs in the offload worker pool.
+    """
+    if req.contexts is not None:
+        document = sess.workspace.content
+        size = len(req.message) + len(document) + sum(len(c.content) for c in req.contexts)
+        user_message, _referenced = await run_cpu(
+            size, expand_context_references, req.message, req.contexts, document
+        )
+        return user_message
+    if req.selection:
+        return f"{req.message}\n\n[Selected text context]\n```\n{req.selection}\n```"
+    return req.message
+
+
+async def _start_turn(sess, req: SendMessageRequest) -> tuple[int, str, int]:
+    """Submit an agent turn to ``sess``'s runner.
+
+    Returns ``(start_seq, turn_id, queue_position)``: the last seq before the
+    turn's events, its id, and 0 if it started immediately. Shared by the SSE
+    and WebSocket transports. Raises HTTPException when the turn cannot be
+    accepted, and AgentOverloadedException (429/503 with Retry-After) when
+    the provider has no slot for a turn that would start now.
+    """
+    if sess.is_running() and _settings.agent_max_queued_messages <= 0:
         raise HTTPException(status_code=409, detail="session already running")
+    if sess.token_budget_remaining() == 0:
+        raise HTTPException(status_code=429, detail=_BUDGET_EXHAUSTED)
 
     api_key, base_url = _provider_credentials(req.provider)
     if req.provider.lower() == "deepseek" and not api_key:
@@ -155,34 +347,120 @@ async def send_message(session_id: str, req: SendMessageRequest) -> StreamingRes
         # Share the session's stop event so /stop can interrupt this run.
         stop_event=sess.stop_event,
     )
+    lease = None
+    if not sess.is_running():
+        lease = await get_scheduler().acquire(req.provider)
+        if sess.is_running():
+            # Another turn started while we waited; ours will queue behind it
+            # and acquire again when it runs.
+            lease.release()
+            lease = None
+    turn_id = str(uuid.uuid4())
+    start_seq = sess.events.last_seq
+    try:
+        position = sess.submit(
+            PendingTurn(
+                turn_id=turn_id, run=lambda: _run_turn(sess, service, req, turn_id, lease)
+            )
+        )
+    except MessageQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"message queue full: {e}") from e
+    return start_seq, turn_id, position
 
-    # Build the user message: expand @<ref> mentions and @document, append any
-    # unreferenced attached contexts (legacy selection kept for compatibility).
-    user_message = req.message
-    if req.contexts is not None:
-        user_message, _referenced = expand_context_references(
-            req.message, req.contexts, sess.workspace.content
+
+async def _apply_sync(sess, req: ClientSyncRequest) -> dict:
+    """Apply a full or delta client edit; shared by /sync and the WebSocket."""
+    if sess.status == "running":
+        raise HTTPException(status_code=409, detail="cannot sync while agent is running")
+    if req.edits is None:
+        return await sess.workspace.apply_client_edit(req.base_version, req.content)
+    try:
+        return await sess.workspace.apply_client_delta(
+            req.base_version, [(e.start, e.end, e.text) for e in req.edits]
         )
-    elif req.selection:
-        user_message = f"{user_message}\n\n[Selected text context]\n```\n{req.selection}\n```"
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@router.post("/sessions/{session_id}/messages")
+async def send_message(
+    session_id: str, req: SendMessageRequest, request: Request
+) -> StreamingResponse:
+    """Send a user message and stream its turn's events back via SSE.
+
+    If a turn is already running the message waits in the session's queue
+    (``queued`` events report its position; 429 when the queue is full).
+    ``X-Turn-Id`` / ``X-Queue-Position`` headers identify the turn.
+    Rate limited per client and provider (429 with Retry-After).
+    """
+    mgr = get_session_manager()
+    sess = mgr.get(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    await check_rate_limit(client_key(request), req.provider)
+    start_seq, turn_id, position = await _start_turn(sess, req)
+    response = _sse_response(_session_events(request, sess, start_seq, turn_id))
+    response.headers["X-Turn-Id"] = turn_id
+    response.headers["X-Queue-Position"] = str(position)
+    return response
+
+
+@router.get("/sessions/{session_id}/events")
+async def stream_session_events(
+    session_id: str, request: Request, after: int = 0
+) -> StreamingResponse:
+    """Resume a session's event stream after sequence id ``after``.
+
+    Frames carry ``id:`` lines; a ``Last-Event-ID`` header (sent by
+    EventSource on reconnect) takes precedence over the query parameter.
+    Replays retained events and follows the running turn, if any, to its
+    ``done``. Events older than the buffer size are gone; a client that fell
+    that far behind should refetch the document.
+    """
+    mgr = get_session_manager()
+    sess = mgr.get(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+    return _sse_response(_session_events(request, sess, after))
+
+
+@router.get("/sessions/{session_id}/subscribe")
+async def subscribe_session(session_id: str, request: Request) -> StreamingResponse:
+    """Follow a session live without driving it (other tabs, collaborators).
 
-    # Reset the stop flag from any previous run on this session, then mark running.
-    sess.stop_event.clear()
-    sess.status = "running"
+    Starts with a ``snapshot`` of the current document state, then streams
+    every run event and a ``document_patch`` per edit from any source until
+    the session is deleted. Slow readers get compacted events and a
+    ``lagged`` notice instead of stalling the run; on ``lagged`` a client
+    should refetch the document.
+    """
+    mgr = get_session_manager()
+    sess = mgr.get(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    sub = sess.broadcaster.subscribe()
+
+    def unsubscribe() -> None:
+        sess.broadcaster.unsubscribe(sub)
+        sub.close()
 
     async def event_gen():
-        was_stopped = False
+        watcher = asyncio.create_task(_detach_on_disconnect(request, unsubscribe))
         try:
-            async for evt in service.run(user_message, message_history=sess.message_history):
-                if evt.get("type") == "stopped":
-                    was_stopped = True
+            yield {
+                "type": "snapshot",
+                "version": sess.workspace.version,
+                "title": sess.workspace.title,
+                "status": sess.status,
+            }
+            async for evt in sub:
                 yield evt
-            # Persist this turn into history for multi-turn continuity.
-            # (Only when not cancelled, so we don't remember half-finished turns.)
-            if not was_stopped:
-                _append_history(sess, user_message, service.last_assistant_text)
         finally:
-            sess.status = "stopped" if was_stopped else "done"
+            watcher.cancel()
+            sess.broadcaster.unsubscribe(sub)
 
     return StreamingResponse(
         create_agent_sse_stream(event_gen()),
@@ -197,14 +475,12 @@ async def send_message(session_id: str, req: SendMessageRequest) -> StreamingRes
 
 @router.post("/sessions/{session_id}/sync", response_model=ClientSyncResponse)
 async def sync_document(session_id: str, req: ClientSyncRequest) -> ClientSyncResponse:
-    """Apply a client-side edit with optimistic locking."""
+    """Apply a client-side edit (full content or splices) with optimistic locking."""
     mgr = get_session_manager()
     sess = mgr.get(session_id)
     if sess is None:
         raise HTTPException(status_code=404, detail="session not found")
-    if sess.status == "running":
-        raise HTTPException(status_code=409, detail="cannot sync while agent is running")
-    result = await sess.workspace.apply_client_edit(req.base_version, req.content)
+    result = await _apply_sync(sess, req)
     return ClientSyncResponse(
         status=result["status"],
         version=result["version"],
@@ -217,9 +493,9 @@ async def sync_document(session_id: str, req: ClientSyncRequest) -> ClientSyncRe
 async def stop_session(session_id: str) -> StopResponse:
     """Interrupt a running agent as soon as possible.
 
-    Sets the session's stop event so the running AgentService loop terminates
-    cooperatively at the next event boundary (rather than running to completion
-    in the background). The SSE stream then emits a `stopped` terminal event.
+    Sets the session's stop event; the running AgentService cancels its run
+    task immediately, aborting any in-flight model request rather than waiting
+    for the next event. The SSE stream then emits a `stopped` terminal event.
     """
     mgr = get_session_manager()
     sess = mgr.get(session_id)
@@ -243,6 +519,30 @@ async def get_session_document(session_id: str) -> dict:
     }
 
 
+@router.get("/sessions/{session_id}/stats")
+async def get_session_stats(session_id: str) -> dict:
+    """Token usage of the session's finished turns and what it holds in memory.
+
+    ``token_budget`` / ``token_budget_remaining`` are null when no
+    ``agent_session_token_budget`` is configured.
+    """
+    mgr = get_session_manager()
+    sess = mgr.get(session_id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    return {
+        "status": sess.status,
+        "turns": sess.turns,
+        "queued": len(sess.pending),
+        "usage": sess.usage.as_dict(),
+        "token_budget": _settings.agent_session_token_budget or None,
+        "token_budget_remaining": sess.token_budget_remaining(),
+        "message_history_messages": len(sess.message_history),
+        "workspace_version": sess.workspace.version,
+        "workspace_bytes": sess.workspace.memory_bytes(),
+    }
+
+
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str) -> dict:
     """Delete a session."""
@@ -0,0 +1,165 @@
+"""Agent WebSocket channel — one long-lived connection per active editor.
+
+Multiplexes what the HTTP API spreads over separate requests: sending
+messages, stopping a run, syncing client edits and receiving run events.
+It reuses the same session runner as the SSE endpoints, so both transports
+can be mixed on one session.
+
+Client → server frames (JSON objects, an optional ``id`` is echoed back as
+``reply_to``):
+  - ``{"type": "message", ...SendMessageRequest}`` → ``accepted``
+  - ``{"type": "stop"}`` → ``stopping``
+  - ``{"type": "sync", "base_version": n, "content": ...}`` or with
+    ``"edits": [{"start", "end", "text"}]`` → ``sync_result`` (``content``
+    only on conflict)
+  - ``{"type": "ping"}`` → ``pong``
+
+Server → client: every run event of the session with its ``seq`` added, plus
+the replies above; a rejected frame gets ``request_error`` with an HTTP-like
+``status``. Connect with ``?after=N`` to replay events after seq N.
+
+A ``message`` frame may wait for a provider slot; it is admitted in a task of
+its own (in arrival order with other messages) so ``stop``, ``sync`` and
+``ping`` frames sent meanwhile are answered right away.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.api.v1.agent import _apply_sync, _start_turn
+from app.core.exceptions import AgentOverloadedException, RateLimitException
+from app.core.rate_limit import check_rate_limit, client_key
+from app.schemas.agent import ClientSyncRequest, SendMessageRequest
+from app.services.agent.session import get_session_manager
+from app.services.streaming import dumps_json
+
+router = APIRouter()
+
+# Close code for an unknown session (4000-4999 are application-defined).
+_CLOSE_SESSION_NOT_FOUND = 4404
+
+
+class _Channel:
+    """Serializes sends from the event forwarder and the frame handler."""
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.websocket = websocket
+        self._lock = asyncio.Lock()
+
+    async def send(self, data: dict) -> None:
+        text = dumps_json(data)
+        async with self._lock:
+            await self.websocket.send_text(text)
+
+
+async def _forward_events(channel: _Channel, sess, after: int) -> None:
+    async for seq, evt in sess.events.subscribe(after):
+        await channel.send({**evt, "seq": seq})
+
+
+async def _handle_frame(websocket: WebSocket, sess, frame: dict) -> dict:
+    kind = frame.get("type")
+    if kind == "message":
+        req = SendMessageRequest.model_validate(frame)
+        await check_rate_limit(client_key(websocket), req.provider)
+        start_seq, turn_id, position = await _start_turn(sess, req)
+        return {"type": "accepted", "after": start_seq, "turn_id": turn_id, "position": position}
+    if kind == "stop":
+        sess.stop()
+        return {"type": "stopping"}
+    if kind == "sync":
+        result = await _apply_sync(sess, ClientSyncRequest.model_validate(frame))
+        reply = {
+            "type": "sync_result",
+            "status": result["status"],
+            "version": result["version"],
+            "title": sess.workspace.title,
+        }
+        if result["status"] == "conflict":
+            reply["content"] = result["content"]
+        return reply
+    if kind == "ping":
+        return {"type": "pong"}
+    raise HTTPException(status_code=400, detail=f"unknown frame type: {kind}")
+
+
+async def _respond(channel: _Channel, websocket: WebSocket, sess, frame) -> None:
+    """Handle one decoded frame and send its reply (or ``request_error``)."""
+    try:
+        if not isinstance(frame, dict):
+            raise HTTPException(status_code=400, detail="frame must be a JSON object")
+        reply = await _handle_frame(websocket, sess, frame)
+    except ValidationError as e:
+        reply = {"type": "request_error", "status": 422, "error": str(e)}
+    except HTTPException as e:
+        reply = {"type": "request_error", "status": e.status_code, "error": e.detail}
+    except (AgentOverloadedException, RateLimitException) as e:
+        reply = {
+            "type": "request_error",
+            "status": e.status_code,
+            "error": e.message,
+            "retry_after": e.retry_after,
+        }
+    if isinstance(frame, dict) and "id" in frame:
+        reply["reply_to"] = frame["id"]
+    await channel.send(reply)
+
+
+async def _admit_message(
+    channel: _Channel, websocket: WebSocket, sess, frame: dict, admission: asyncio.Lock
+) -> None:
+    # asyncio.Lock is FIFO: messages are admitted in the order they arrived.
+    async with admission:
+        await _respond(channel, websocket, sess, frame)
+
+
+@router.websocket("/sessions/{session_id}/ws")
+async def agent_channel(
+    websocket: WebSocket, session_id: str, after: Optional[int] = None
+) -> None:
+    """Bidirectional agent channel for one session (see module docstring)."""
+    sess = get_session_manager().get(session_id)
+    if sess is None:
+        await websocket.close(code=_CLOSE_SESSION_NOT_FOUND, reason="session not found")
+        return
+    await websocket.accept()
+    channel = _Channel(websocket)
+    # An open channel counts as an attached reader, like an SSE stream.
+    detach = sess.attach()
+    forwarder = asyncio.create_task(
+        _forward_events(channel, sess, sess.events.last_seq if after is None else after)
+    )
+    admission = asyncio.Lock()
+    admitting: set[asyncio.Task] = set()
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                frame = json.loads(raw)
+            except json.JSONDecodeError as e:
+                await channel.send(
+                    {"type": "request_error", "status": 400, "error": f"invalid JSON: {e}"}
+                )
+                continue
+            if isinstance(frame, dict) and frame.get("type") == "message":
+                task = asyncio.create_task(
+                    _admit_message(channel, websocket, sess, frame, admission)
+                )
+                admitting.add(task)
+                task.add_done_callback(admitting.discard)
+            else:
+                await _respond(channel, websocket, sess, frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        forwarder.cancel()
+        for task in admitting:
+            task.cancel()
+        await asyncio.gather(*admitting, return_exceptions=True)
+        detach()
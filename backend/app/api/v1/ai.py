@@ -1,25 +1,26 @@
 """AI chat API routes."""
 from typing import AsyncGenerator
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 
+from app.core.rate_limit import check_rate_limit, client_key
 from app.schemas.ai import ChatRequest, ConfigStatusResponse, ProvidersResponse
 from app.services.ai.factory import get_ai_service, get_available_providers
 from app.services.streaming import create_sse_stream
 
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
 
 
 @router.post("/chat", description="Send message to AI with streaming response")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """Send chat message to AI provider.
 
     This endpoint streams responses using Server-Sent Events (SSE).
+    Rate limited per client and provider (429 with Retry-After).
     """
+    await check_rate_limit(client_key(http_request), request.provider)
+
     # Get AI service for the requested provider
     service = get_ai_service(request.provider)
 
@@ -0,0 +1,115 @@
+"""Batch agent job routes — one instruction over many stored documents."""
+
+from __future__ import annotations
+
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+
+from app.api.v1.agent import _provider_credentials
+from app.api.v1.documents import _documents
+from app.core.rate_limit import check_rate_limit, client_key
+from app.schemas.agent import (
+    BatchDocumentFilter,
+    BatchItemStatus,
+    BatchJobRequest,
+    BatchJobResponse,
+)
+from app.services.agent.batch import BatchJob, get_batch_manager, run_batch_job
+from app.services.streaming import create_sequenced_sse_stream
+
+router = APIRouter()
+
+
+def _select_documents(store: dict, flt: BatchDocumentFilter) -> list[tuple[str, str]]:
+    """Return ``(id, title)`` of stored documents matching every given criterion."""
+    ids = set(flt.document_ids) if flt.document_ids is not None else None
+    title = flt.title_contains.casefold() if flt.title_contains else None
+    selected = []
+    for doc in store.values():
+        if ids is not None and doc["id"] not in ids:
+            continue
+        if title is not None and title not in doc["title"].casefold():
+            continue
+        if flt.content_contains and flt.content_contains not in doc["content"]:
+            continue
+        selected.append((doc["id"], doc["title"]))
+    return selected
+
+
+def _job_response(job: BatchJob) -> BatchJobResponse:
+    return BatchJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        instruction=job.instruction,
+        provider=job.provider,
+        model=job.model,
+        counts=job.counts(),
+        items=[
+            BatchItemStatus(
+                document_id=i.document_id, title=i.title, status=i.status, error=i.error
+            )
+            for i in job.items
+        ],
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
+
+
+def _get_job(job_id: str) -> BatchJob:
+    job = get_batch_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="batch job not found")
+    return job
+
+
+@router.post("", response_model=BatchJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_batch_job(req: BatchJobRequest, request: Request) -> BatchJobResponse:
+    """Start applying ``instruction`` to every stored document matching ``filter``.
+
+    Creating a job takes one token of the client's rate limit.
+    """
+    await check_rate_limit(client_key(request), req.provider)
+    api_key, base_url = _provider_credentials(req.provider)
+    if req.provider.lower() == "deepseek" and not api_key:
+        raise HTTPException(status_code=400, detail="DeepSeek API key not configured")
+    documents = _select_documents(_documents, req.filter)
+    if not documents:
+        raise HTTPException(status_code=404, detail="no documents match the filter")
+
+    job = get_batch_manager().create(req.instruction, req.provider, req.model, documents)
+    job.task = asyncio.create_task(run_batch_job(job, _documents, api_key, base_url))
+    return _job_response(job)
+
+
+@router.get("/{job_id}", response_model=BatchJobResponse)
+async def get_batch_job(job_id: str) -> BatchJobResponse:
+    """Poll a batch job's status and per-document results."""
+    return _job_response(_get_job(job_id))
+
+
+@router.get("/{job_id}/events")
+async def stream_batch_job(job_id: str, after: int = 0) -> StreamingResponse:
+    """Stream the job's progress events (SSE), replaying those after ``after``.
+
+    Frames carry ``id:`` lines, so ``after`` is the last id a client saw.
+    """
+    job = _get_job(job_id)
+    return StreamingResponse(
+        create_sequenced_sse_stream(job.events.subscribe(after)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@router.post("/{job_id}/cancel", response_model=BatchJobResponse)
+async def cancel_batch_job(job_id: str) -> BatchJobResponse:
+    """Stop the job: running turns are cancelled, pending documents skipped."""
+    job = _get_job(job_id)
+    job.cancel()
+    return _job_response(job)
@@ -1,14 +1,22 @@
 """Custom exceptions for the application."""
-from typing import Any
+import math
+from typing import Any, Optional
 
 
 class AppException(Exception):
     """Base exception for application errors."""
 
-    def __init__(self, message: str, status_code: int = 500, details: Any = None):
+    def __init__(
+        self,
+        message: str,
+        status_code: int = 500,
+        details: Any = None,
+        headers: Optional[dict[str, str]] = None,
+    ):
         self.message = message
         self.status_code = status_code
         self.details = details
+        self.headers = headers
         super().__init__(self.message)
 
 
@@ -45,6 +53,26 @@ class DocumentNotFoundException(AppException):
 class RateLimitException(AppException):
     """Exception raised when rate limit is exceeded."""
 
-    def __init__(self):
+    def __init__(self, retry_after: Optional[int] = None):
         message = "Rate limit exceeded, please try again later"
-        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+        headers = {"Retry-After": str(retry_after)} if retry_after else None
+        details = {"retry_after": retry_after} if retry_after else None
+        super().__init__(message, status_code=429, details=details, headers=headers)
+
+
+class AgentOverloadedException(AppException):
+    """Exception raised when agent run admission is refused or times out.
+
+    429 when the provider's wait queue is full, 503 when the wait for a slot
+    timed out. ``retry_after`` (seconds) is sent as a Retry-After header.
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            message,
+            status_code=status_code,
+            details={"retry_after": self.retry_after},
+            headers={"Retry-After": str(self.retry_after)},
+        )
@@ -0,0 +1,59 @@
+"""Application logging — records are handed off to a background thread.
+
+Loggers under ``mdmaker`` write to a QueueHandler; a QueueListener thread
+does the formatting and the (blocking) stream I/O, so logging from request
+handlers never waits on stderr.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+ROOT_LOGGER = "mdmaker"
+
+_listener: Optional[QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return ``mdmaker.<name>``, routed through the logging queue."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def configure_logging() -> None:
+    """Attach the queue handler and start the listener thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(_settings.log_level.upper())
+    root.addHandler(QueueHandler(log_queue))
+    root.propagate = False
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
@@ -0,0 +1,106 @@
+"""Event-loop lag monitor and blocked-loop detector.
+
+Everything (every session's SSE stream, every agent run) shares one event
+loop, so a CPU-heavy callback stalls all of them. Two probes find those:
+
+  - a ticker task sleeps ``interval`` seconds and records how late it woke
+    up in the ``mdmaker_event_loop_lag_seconds`` histogram;
+  - a watchdog thread checks the ticker's heartbeat. When the loop has not
+    come back for ``threshold`` seconds it samples the loop thread's stack
+    (``sys._current_frames``) while the blocking call is still running and
+    logs it, so the offending code path shows up in the logs.
+
+Started and stopped from the application lifespan.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from app.core import metrics
+from app.core.config import get_settings
+from app.core.log import get_logger
+
+_settings = get_settings()
+
+logger = get_logger("loop")
+
+# Innermost frames of the loop thread kept in a stall report.
+_STACK_LIMIT = 30
+
+
+class LoopMonitor:
+    """Measures event-loop lag and reports stalls with a stack sample."""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread_id = 0
+        # When the ticker is next due to run; the watchdog's heartbeat.
+        self._due = 0.0
+        self._reported_due = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "LoopMonitor":
+        return cls(_settings.loop_monitor_interval, _settings.loop_block_threshold)
+
+    def start(self) -> None:
+        """Start the ticker and watchdog; call from the loop's thread. No-op if disabled."""
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def _tick(self) -> None:
+        while True:
+            self._due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._due)
+            metrics.EVENT_LOOP_LAG.observe(lag)
+
+    def _watch(self) -> None:
+        check_every = min(self.interval, self.threshold / 2)
+        while not self._stopping.wait(check_every):
+            due = self._due
+            blocked = time.monotonic() - due
+            if blocked < self.threshold or due == self._reported_due:
+                continue
+            # One report per stall, taken while the blocking code still runs.
+            self._reported_due = due
+            self.stalls += 1
+            metrics.EVENT_LOOP_STALLS.inc()
+            logger.warning(
+                "event loop blocked for %.3fs (threshold %.3fs); loop thread stack:\n%s",
+                blocked,
+                self.threshold,
+                self._sample_stack(),
+            )
+
+    def _sample_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "  <loop thread not found>"
+        return "".join(traceback.format_stack(frame, limit=_STACK_LIMIT))
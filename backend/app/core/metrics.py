@@ -0,0 +1,325 @@
+"""Process-local metrics in the Prometheus text exposition format.
+
+A deliberately small subset of what prometheus_client offers: counters,
+gauges and histograms with labels, rendered by ``GET /metrics``. Nothing is
+pushed anywhere; a scraper (or curl) reads the current values.
+
+Gauges whose value lives elsewhere (sessions, scheduler queues) are computed
+at scrape time from a callback instead of being updated on every change. The
+instruments shared across modules are defined at the bottom of this file.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable, Iterable, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; suits HTTP requests and model/tool latencies alike.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, either set directly or read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], dict[LabelValues, float]]) -> None:
+        """Compute the samples at scrape time: ``{label_values: value}``.
+
+        For an unlabelled gauge return ``{(): value}``.
+        """
+        self._function = function
+
+    def _samples(self) -> list[str]:
+        if self._function is not None:
+            values = dict(self._function())
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative ``le`` buckets, plus sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), t[0])) for k, (c, t) in self._series.items())
+        lines: list[str] = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Ordered collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --- Shared instruments ------------------------------------------------------
+
+HTTP_REQUEST_DURATION = histogram(
+    "mdmaker_http_request_duration_seconds",
+    "HTTP request duration until the last body chunk (full length for streams).",
+    ("method", "route", "status"),
+)
+
+EVENT_LOOP_LAG = histogram(
+    "mdmaker_event_loop_lag_seconds",
+    "How late the loop monitor's periodic tick ran (time the loop was busy).",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_STALLS = counter(
+    "mdmaker_event_loop_stalls_total",
+    "Times the event loop stayed blocked past loop_block_threshold.",
+)
+
+AGENT_RUNS = counter(
+    "mdmaker_agent_runs_total",
+    "Agent runs by provider and outcome (final, error, stopped).",
+    ("provider", "outcome"),
+)
+AGENT_RUN_DURATION = histogram(
+    "mdmaker_agent_run_duration_seconds",
+    "Wall-clock duration of an agent run.",
+    ("provider",),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+LLM_TIME_TO_FIRST_TOKEN = histogram(
+    "mdmaker_llm_time_to_first_token_seconds",
+    "Time from sending a model request to its first streamed part.",
+    ("provider",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0),
+)
+AGENT_ITERATIONS = histogram(
+    "mdmaker_agent_iterations_per_run",
+    "Model responses per agent run.",
+    ("provider",),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+AGENT_EVENTS = histogram(
+    "mdmaker_agent_events_per_run",
+    "SSE events emitted per agent run, terminal events included.",
+    ("provider",),
+    buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+LLM_TOKENS = counter(
+    "mdmaker_llm_tokens_total",
+    "Tokens reported by providers, by kind (input, output, cache_read, cache_write).",
+    ("provider", "kind"),
+)
+AGENT_RUN_INPUT_TOKENS = histogram(
+    "mdmaker_agent_input_tokens_per_run",
+    "Input tokens per agent run (history + document context + tool results).",
+    ("provider",),
+    buckets=(1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000),
+)
+TOOL_DURATION = histogram(
+    "mdmaker_tool_duration_seconds",
+    "Agent tool execution time, from the call to its result.",
+    ("tool",),
+)
+TOOL_CALLS = counter(
+    "mdmaker_tool_calls_total",
+    "Agent tool calls by tool name and outcome (ok, failed).",
+    ("tool", "outcome"),
+)
+
+OFFLOAD_DURATION = histogram(
+    "mdmaker_offload_duration_seconds",
+    "Document work sent to the worker pool, by function (queueing included).",
+    ("function",),
+)
+
+SESSIONS = gauge("mdmaker_sessions", "Live agent sessions by status.", ("status",))
+SESSION_QUEUED_TURNS = gauge(
+    "mdmaker_session_queued_turns", "Turns waiting in session message queues."
+)
+WORKSPACE_BYTES = gauge(
+    "mdmaker_workspace_bytes",
+    "Memory held by workspace documents and their undo snapshots (distinct strings).",
+)
+SESSION_TOKENS = gauge(
+    "mdmaker_session_tokens", "Tokens used so far by live sessions (input + output)."
+)
+HISTORY_MESSAGES = gauge(
+    "mdmaker_message_history_messages", "Model messages kept in session histories."
+)
+EVENT_BUFFER_EVENTS = gauge(
+    "mdmaker_event_buffer_events", "Events retained in session replay buffers."
+)
+SCHEDULER_ACTIVE = gauge(
+    "mdmaker_scheduler_active_runs", "Agent runs holding a provider slot.", ("provider",)
+)
+SCHEDULER_WAITING = gauge(
+    "mdmaker_scheduler_waiting_runs", "Agent runs queued for a provider slot.", ("provider",)
+)
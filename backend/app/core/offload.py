@@ -0,0 +1,76 @@
+"""Run CPU-heavy document work off the event loop.
+
+Outline parsing, regex find/replace, search and context expansion are pure
+functions of the document text. On a small document they take microseconds
+and run inline; on a multi-MB one they take long enough to stall every
+stream sharing the loop. ``run_cpu`` sends calls whose input is at least
+``offload_threshold_chars`` characters to a worker pool instead.
+
+The default "thread" pool keeps the loop responsive (the interpreter hands
+the GIL back to it every few milliseconds) at no copying cost. "process"
+runs the work truly in parallel but pickles the arguments and result for
+every call, so it only pays off for the largest documents; the function and
+its arguments must then be picklable (module-level functions, plain data).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from app.core import metrics
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+T = TypeVar("T")
+
+_executor: Optional[Executor] = None
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        workers = max(1, _settings.offload_workers)
+        if _settings.offload_executor == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offload")
+    return _executor
+
+
+def should_offload(size: int) -> bool:
+    """Whether an input of ``size`` characters goes to the worker pool."""
+    threshold = _settings.offload_threshold_chars
+    return threshold > 0 and size >= threshold
+
+
+async def run_cpu(size: int, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Call ``fn(*args, **kwargs)``, in the worker pool when ``size`` is large.
+
+    ``size`` is the length of the text the call works on. Exceptions raised
+    by ``fn`` propagate to the caller either way.
+    """
+    if not should_offload(size):
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    try:
+        return await loop.run_in_executor(
+            _get_executor(), functools.partial(fn, *args, **kwargs)
+        )
+    finally:
+        metrics.OFFLOAD_DURATION.observe(
+            time.monotonic() - started, function=getattr(fn, "__name__", "unknown")
+        )
+
+
+def shutdown() -> None:
+    """Stop the worker pool (idempotent); a later call starts a new one."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,160 @@
+"""On-demand CPU and memory profiling of the running server.
+
+``SamplingProfiler`` is a statistical profiler in a background thread: every
+``interval`` seconds it reads the current stack of every other thread
+(``sys._current_frames``) and counts identical stacks. The result is in the
+collapsed-stack format ("frame;frame;frame count" per line) read by
+flamegraph.pl, speedscope and inferno. Nothing is instrumented, so the
+overhead is one stack walk per thread per sample and vanishes when stopped.
+
+Memory snapshots use ``tracemalloc``, which only sees allocations made after
+it was started; its own bookkeeping costs memory and time, so it is started
+and stopped explicitly.
+
+Both are driven by the admin endpoints in app.api.v1.admin.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+# Deeper stacks are truncated at the root end; the leaf frames are kept.
+_MAX_DEPTH = 128
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_qualname}"
+
+
+def _collapse(frame: Optional[FrameType]) -> list[str]:
+    labels: list[str] = []
+    while frame is not None and len(labels) < _MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """Samples all thread stacks for a bounded time, then stops by itself."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.interval = 0.0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005) -> None:
+        """Begin a profile of up to ``seconds``; discards the previous result."""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("profiler already running")
+            self._stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.monotonic()
+            self.stopped_at = 0.0
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._sample, args=(seconds,), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """End the profile early (no-op when it already finished)."""
+        thread = self._thread
+        if thread is not None:
+            self._stopping.set()
+            thread.join()
+
+    def _sample(self, seconds: float) -> None:
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stopping.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = ";".join([names.get(ident, f"thread-{ident}"), *_collapse(frame)])
+                self._stacks[stack] += 1
+            self.samples += 1
+        self.stopped_at = time.monotonic()
+
+    def collapsed(self) -> str:
+        """The profile so far in collapsed-stack format, hottest stacks first."""
+        stacks = list(self._stacks.items())
+        stacks.sort(key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self) -> dict:
+        end = self.stopped_at or (time.monotonic() if self.running else self.started_at)
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 3),
+            "duration_s": round(max(0.0, end - self.started_at), 3),
+            "stacks": len(self._stacks),
+        }
+
+
+def _module_of(filename: str, modules: dict[str, str]) -> str:
+    """Module name for a source file, falling back to the file's basename."""
+    return modules.get(filename) or os.path.basename(filename)
+
+
+def _module_files() -> dict[str, str]:
+    files: dict[str, str] = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path:
+            files[os.path.abspath(path)] = name
+    return files
+
+
+def memory_top(limit: int = 20) -> dict:
+    """Live allocations traced since ``tracemalloc.start()``, grouped by module.
+
+    Returns the traced totals and the ``limit`` modules holding the most
+    memory, each with its allocation count and the line allocating the most.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing")
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        )
+    )
+    modules = _module_files()
+    groups: dict[str, dict] = {}
+    for stat in snapshot.statistics("lineno"):
+        frame = stat.traceback[0]
+        name = _module_of(os.path.abspath(frame.filename), modules)
+        group = groups.setdefault(name, {"module": name, "size": 0, "count": 0, "top_line": None})
+        group["size"] += stat.size
+        group["count"] += stat.count
+        if group["top_line"] is None:  # statistics() is sorted by size
+            group["top_line"] = {"line": frame.lineno, "size": stat.size}
+    current, peak = tracemalloc.get_traced_memory()
+    top = sorted(groups.values(), key=lambda g: g["size"], reverse=True)[:limit]
+    return {"traced_bytes": current, "peak_bytes": peak, "modules": top}
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,219 @@
+"""Request rate limiting — token buckets keyed by client and provider.
+
+Each key owns a bucket holding up to ``burst`` tokens that refills at
+``rate_per_minute``; a request takes one token or is refused with the time
+until the next token is available (sent as Retry-After).
+
+Two backends share that interface:
+  - MemoryTokenBucket: a dict in this process, O(1) per check, no I/O.
+    Limits are per worker, so N workers allow N times the rate.
+  - SQLiteTokenBucket: one row per key in a SQLite file shared by all
+    workers on the host, updated in a short ``BEGIN IMMEDIATE`` transaction.
+    Taking the write lock can wait on other workers, so ``check_rate_limit``
+    runs it in a thread; past a short busy timeout the request is let
+    through (fail open) rather than held.
+
+``check_rate_limit`` applies the client bucket and, when configured, an
+aggregate bucket per provider across all clients.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from typing import Optional, Protocol
+
+from starlette.requests import HTTPConnection
+
+from app.core.config import get_settings
+from app.core.exceptions import RateLimitException
+from app.core.log import get_logger
+
+_settings = get_settings()
+logger = get_logger("rate_limit")
+
+# Memory backend: once this many keys exist, forget buckets that are full
+# again (they behave exactly like brand-new ones).
+_MAX_MEMORY_KEYS = 10_000
+
+
+class TokenBucket(Protocol):
+    # True when ``take`` may wait on I/O and must not run on the event loop.
+    blocking: bool
+
+    def take(self, key: str) -> float:
+        """Consume a token for ``key``; return 0 or seconds until one is available."""
+        ...
+
+    def refund(self, key: str) -> None:
+        """Give back a token taken for a request that was refused elsewhere."""
+        ...
+
+
+class MemoryTokenBucket:
+    """In-process token buckets."""
+
+    blocking = False
+
+    def __init__(self, rate_per_minute: float, burst: int) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def take(self, key: str) -> float:
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        if len(self._buckets) >= _MAX_MEMORY_KEYS and key not in self._buckets:
+            self._prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def refund(self, key: str) -> None:
+        if key in self._buckets:
+            tokens, last = self._buckets[key]
+            self._buckets[key] = (min(self.burst, tokens + 1), last)
+
+    def _prune(self, now: float) -> None:
+        full_after = self.burst / self.rate
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < full_after}
+
+
+class SQLiteTokenBucket:
+    """Token buckets in a SQLite file, shared by every worker on the host.
+
+    Uses wall-clock time since monotonic clocks are per process. ``take`` is
+    synchronous and may wait up to ``busy_timeout`` seconds for another
+    worker's transaction; if the lock is still held it returns 0 (fail open).
+    """
+
+    blocking = True
+
+    def __init__(
+        self, path: str, rate_per_minute: float, burst: int, busy_timeout: float = 0.25
+    ) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self._conn = sqlite3.connect(
+            path, timeout=busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        with self._lock:
+            now = time.time()
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                logger.warning("rate limit store busy, request not limited: %s", e)
+                return 0.0
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, last = row if row else (self.burst, now)
+                tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if not wait:
+                    tokens -= 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return wait
+
+    def refund(self, key: str) -> None:
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "UPDATE rate_limit_buckets SET tokens = MIN(?, tokens + 1) WHERE key = ?",
+                    (self.burst, key),
+                )
+            except sqlite3.OperationalError as e:
+                logger.warning("rate limit store busy, token not refunded: %s", e)
+
+
+def _make_bucket(rate_per_minute: int) -> Optional[TokenBucket]:
+    if rate_per_minute <= 0:
+        return None
+    burst = _settings.rate_limit_burst or rate_per_minute
+    if _settings.rate_limit_backend == "sqlite":
+        return SQLiteTokenBucket(_settings.rate_limit_sqlite_path, rate_per_minute, burst)
+    return MemoryTokenBucket(rate_per_minute, burst)
+
+
+_client_bucket: Optional[TokenBucket] = None
+_provider_bucket: Optional[TokenBucket] = None
+_initialized = False
+
+
+def _buckets() -> tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+    # Built on first use so importing this module never touches the filesystem.
+    global _client_bucket, _provider_bucket, _initialized
+    if not _initialized:
+        _client_bucket = _make_bucket(_settings.rate_limit_per_minute)
+        _provider_bucket = _make_bucket(_settings.rate_limit_provider_per_minute)
+        _initialized = True
+    return _client_bucket, _provider_bucket
+
+
+def client_key(conn: HTTPConnection) -> str:
+    """Identify the caller of a request or WebSocket by address.
+
+    ``X-Forwarded-For`` is only honoured when ``rate_limit_trust_forwarded``
+    is set (i.e. behind a proxy that overwrites it).
+    """
+    if _settings.rate_limit_trust_forwarded:
+        forwarded = conn.headers.get("x-forwarded-for", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return conn.client.host if conn.client else "unknown"
+
+
+async def _take(bucket: Optional[TokenBucket], key: str) -> float:
+    if bucket is None:
+        return 0.0
+    if bucket.blocking:
+        return await asyncio.to_thread(bucket.take, key)
+    return bucket.take(key)
+
+
+async def _refund(bucket: TokenBucket, key: str) -> None:
+    if bucket.blocking:
+        await asyncio.to_thread(bucket.refund, key)
+    else:
+        bucket.refund(key)
+
+
+async def check_rate_limit(client: str, provider: str) -> None:
+    """Take a token for ``client`` on ``provider``; raise RateLimitException if out.
+
+    A request the provider-wide bucket refuses gets its client token back, so
+    retries while the provider is saturated don't throttle the client further.
+    """
+    client_bucket, provider_bucket = _buckets()
+    provider = provider.lower()
+    own_key = f"client:{client}:{provider}"
+    wait = await _take(client_bucket, own_key)
+    if not wait:
+        wait = await _take(provider_bucket, f"provider:{provider}")
+        if wait and client_bucket is not None:
+            await _refund(client_bucket, own_key)
+    if wait:
+        raise RateLimitException(retry_after=math.ceil(wait))
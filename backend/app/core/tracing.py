@@ -0,0 +1,222 @@
+"""Per-run span timelines for agent turns.
+
+A RunTrace records where one agent run spent its time: each model request
+(with time to first token and token counts), each tool call (duration and
+payload sizes) and each contended wait for a Workspace lock. It is cheap
+enough to keep for every run; the run can return it on its ``final`` event
+and, when ``agent_trace_file`` is set, it is appended to that file in the
+OTLP/JSON format (one ``ExportTraceServiceRequest`` per line, as written by
+the OpenTelemetry Collector's file exporter) for loading into any
+OpenTelemetry-compatible viewer.
+
+``current_trace`` holds the trace of the run in progress for code that has
+no reference to it (the Workspace); tasks started by the run inherit it.
+
+A fan-out run adopts the traces of its sub-runs: their spans become children
+of the span covering each part, so one turn is one trace.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import queue
+import secrets
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from logging.handlers import QueueListener
+from typing import Any, Optional
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+current_trace: ContextVar[Optional["RunTrace"]] = ContextVar("current_trace", default=None)
+
+# OTLP SpanKind values.
+_KIND_INTERNAL = 1
+_KIND_CLIENT = 3
+
+
+@dataclass
+class Span:
+    """One timed operation; ``start``/``end`` are seconds since the trace began."""
+
+    name: str
+    kind: str
+    start: float
+    end: Optional[float] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    # None for children of the root span.
+    parent_id: Optional[str] = None
+
+
+class RunTrace:
+    """Span timeline of one agent run, rooted at a span covering the whole run."""
+
+    def __init__(self, name: str = "agent.run", **attributes: Any) -> None:
+        self.trace_id = secrets.token_hex(16)
+        self._started_mono = time.monotonic()
+        self._started_ns = time.time_ns()
+        self.root = Span(name, "run", 0.0, attributes=dict(attributes))
+        self.spans: list[Span] = []
+
+    def _now(self) -> float:
+        return time.monotonic() - self._started_mono
+
+    def start_span(
+        self, name: str, kind: str, at: Optional[float] = None, **attributes: Any
+    ) -> Span:
+        """Open a span now, or at ``at`` (a ``time.monotonic()`` value)."""
+        start = self._now() if at is None else at - self._started_mono
+        span = Span(name, kind, start, attributes=dict(attributes))
+        self.spans.append(span)
+        return span
+
+    def end_span(self, span: Span, **attributes: Any) -> None:
+        span.end = self._now()
+        span.attributes.update(attributes)
+
+    def adopt(self, other: "RunTrace", parent: Span) -> None:
+        """Add ``other``'s spans (and its root, as a child of ``parent``) to this trace."""
+        other.finish()
+        shift = other._started_mono - self._started_mono
+        for span in other.spans:
+            if span.parent_id is None:
+                span.parent_id = other.root.span_id
+        other.root.parent_id = parent.span_id
+        adopted = [other.root, *other.spans]
+        for span in adopted:
+            span.start += shift
+            span.end += shift
+        self.spans.extend(adopted)
+
+    def finish(self, **attributes: Any) -> None:
+        """End the root span and any span still open (e.g. on cancellation)."""
+        now = self._now()
+        for span in self.spans:
+            if span.end is None:
+                span.end = now
+        if self.root.end is None:
+            self.root.end = now
+        self.root.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        """Compact timeline for clients: offsets and durations in milliseconds."""
+        now = self._now()
+
+        def ms(value: float) -> float:
+            return round(value * 1000, 3)
+
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": ms(self.root.end if self.root.end is not None else now),
+            "spans": [
+                {
+                    "name": s.name,
+                    "kind": s.kind,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "start_ms": ms(s.start),
+                    "duration_ms": ms((s.end if s.end is not None else now) - s.start),
+                    "attributes": s.attributes,
+                }
+                for s in self.spans
+            ],
+        }
+
+    def to_otlp(self) -> dict:
+        """The trace as an OTLP/JSON ``ExportTraceServiceRequest``."""
+
+        def nanos(offset: Optional[float]) -> str:
+            return str(self._started_ns + int((offset or 0.0) * 1e9))
+
+        def otlp_span(span: Span, parent: Optional[str]) -> dict:
+            out = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": _KIND_CLIENT if span.kind == "model" else _KIND_INTERNAL,
+                "startTimeUnixNano": nanos(span.start),
+                "endTimeUnixNano": nanos(span.end if span.end is not None else span.start),
+                "attributes": _otlp_attributes(
+                    {"mdmaker.span_kind": span.kind, **span.attributes}
+                ),
+            }
+            if parent:
+                out["parentSpanId"] = parent
+            return out
+
+        spans = [otlp_span(self.root, None)]
+        spans += [otlp_span(s, s.parent_id or self.root.span_id) for s in self.spans]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": "mdmaker-backend"})
+                    },
+                    "scopeSpans": [{"scope": {"name": "mdmaker.agent"}, "spans": spans}],
+                }
+            ]
+        }
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+class FileSpanExporter:
+    """Appends traces to a file as OTLP/JSON lines from a background thread.
+
+    Reuses the logging queue machinery (see app.core.log) so the file I/O
+    never runs on the event loop.
+    """
+
+    def __init__(self, path: str) -> None:
+        handler = logging.FileHandler(path, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+        self._running = True
+
+    def export(self, trace: RunTrace) -> None:
+        line = json.dumps(trace.to_otlp(), ensure_ascii=False, separators=(",", ":"))
+        self._queue.put(logging.makeLogRecord({"msg": line}))
+
+    def shutdown(self) -> None:
+        """Write what is queued and stop the thread (idempotent)."""
+        if self._running:
+            self._running = False
+            self._listener.stop()
+
+
+_exporter: Optional[FileSpanExporter] = None
+
+
+def export_trace(trace: RunTrace) -> None:
+    """Queue ``trace`` for the trace file; a no-op unless ``agent_trace_file`` is set."""
+    global _exporter
+    if not _settings.agent_trace_file:
+        return
+    if _exporter is None:
+        _exporter = FileSpanExporter(_settings.agent_trace_file)
+        atexit.register(_exporter.shutdown)
+    _exporter.export(trace)
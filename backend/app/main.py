@@ -3,24 +3,33 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
+from app.core import metrics, offload
 from app.core.config import get_settings
 from app.core.exceptions import AppException
+from app.core.log import configure_logging, get_logger
+from app.core.loop_monitor import LoopMonitor
 from app.middleware.error_handler import add_exception_handlers
 from app.middleware.logging import LoggingMiddleware
 
 settings = get_settings()
+configure_logging()
+logger = get_logger("app")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
     # Startup
-    print(f"Starting MdMaker Backend API in {settings.environment} mode...")
+    logger.info("Starting MdMaker Backend API in %s mode...", settings.environment)
+    loop_monitor = LoopMonitor.from_settings()
+    loop_monitor.start()
     yield
     # Shutdown
-    print("Shutting down MdMaker Backend API...")
+    await loop_monitor.stop()
+    offload.shutdown()
+    logger.info("Shutting down MdMaker Backend API...")
 
 
 # Create FastAPI application
@@ -58,13 +67,22 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # Include API routers
-from app.api.v1 import agent, ai, config, documents
+from app.api.v1 import admin, agent, agent_ws, ai, batch, config, documents
 
 app.include_router(ai.router, prefix="/api/v1/ai", tags=["AI"])
 app.include_router(config.router, prefix="/api/v1/config", tags=["Config"])
 app.include_router(documents.router, prefix="/api/v1/documents", tags=["Documents"])
 app.include_router(agent.router, prefix="/api/v1/agent", tags=["Agent"])
+app.include_router(agent_ws.router, prefix="/api/v1/agent", tags=["Agent"])
+app.include_router(batch.router, prefix="/api/v1/agent/batch", tags=["Agent"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin"])
 
 
 @app.get("/")
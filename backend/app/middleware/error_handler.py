@@ -15,6 +15,7 @@ async def app_exception_handler(request: Request, exc: AppException) -> JSONResp
                 "details": exc.details,
             }
         },
+        headers=exc.headers,
     )
 
 
@@ -1,31 +1,78 @@
 """Logging middleware."""
 import time
-from typing import Callable
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core import metrics
+from app.core.log import get_logger
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware to log HTTP requests."""
+logger = get_logger("access")
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        """Process request and log details."""
-        start_time = time.time()
 
-        # Log request
-        print(f"[{request.method}] {request.url.path}")
+def _route_label(scope: Scope) -> str:
+    """The request path with path parameter values put back as ``{name}``.
 
-        # Process request
-        response = await call_next(request)
+    Rebuilt from ``path_params`` because the matched route's own ``path`` is
+    relative to the router it was declared on. Unrouted requests (404s) share
+    one label so scanners can't grow the series without bound.
+    """
+    if "route" not in scope:
+        return "unmatched"
+    params = {str(v): k for k, v in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{params[seg]}}}" if seg in params else seg for seg in scope["path"].split("/")
+    )
 
-        # Calculate duration
-        duration = time.time() - start_time
 
-        # Add custom header
-        response.headers["X-Process-Time"] = str(duration)
+class LoggingMiddleware:
+    """Pure ASGI middleware to log HTTP requests.
 
-        # Log response
-        print(f"[{request.method}] {request.url.path} - {response.status_code} - {duration:.3f}s")
+    Unlike BaseHTTPMiddleware it passes messages straight through, so
+    streaming (SSE) responses are never buffered or run in an extra task.
+    Logs the time to the response start (TTFB) and the total time until the
+    last body chunk, which for a stream is its full duration. The TTFB is
+    also sent as ``X-Process-Time`` since headers go out before the body.
+    The total is also recorded in the request duration histogram, labelled
+    by route template so path parameters don't explode the label set.
+    """
 
-        return response
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        ttfb = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, ttfb
+            if message["type"] == "http.response.start":
+                ttfb = time.perf_counter() - start_time
+                status_code = message["status"]
+                # Add custom header
+                MutableHeaders(scope=message).append("X-Process-Time", f"{ttfb:.6f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+            logger.info(
+                "[%s] %s - %s - ttfb %.3fs - total %.3fs",
+                scope["method"],
+                scope["path"],
+                status_code,
+                ttfb if ttfb is not None else duration,
+                duration,
+            )
+            metrics.HTTP_REQUEST_DURATION.observe(
+                duration,
+                method=scope["method"],
+                route=_route_label(scope),
+                status=str(status_code),
+            )
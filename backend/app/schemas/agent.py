@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class CreateSessionRequest(BaseModel):
@@ -49,11 +50,37 @@ class SendMessageRequest(BaseModel):
         default=None,
         description="Named context snippets referenced in the message via @<ref>",
     )
+    mode: Literal["default", "fan_out"] = Field(
+        default="default",
+        description="fan_out applies the message to each top-level section in parallel",
+    )
+    trace: bool = Field(
+        default=False, description="Attach the run's span timeline to its final event"
+    )
+
+
+class TextEdit(BaseModel):
+    """One splice of a delta sync: replace ``[start, end)`` of the base version."""
+
+    start: int = Field(..., ge=0)
+    end: int = Field(..., ge=0)
+    text: str = ""
 
 
 class ClientSyncRequest(BaseModel):
     base_version: int = Field(..., description="Version the client's edit is based on")
-    content: str = Field(..., description="Full new document content from the client")
+    content: Optional[str] = Field(
+        default=None, description="Full new document content from the client"
+    )
+    edits: Optional[List[TextEdit]] = Field(
+        default=None, description="Splices against base_version, instead of full content"
+    )
+
+    @model_validator(mode="after")
+    def _content_or_edits(self) -> "ClientSyncRequest":
+        if (self.content is None) == (self.edits is None):
+            raise ValueError("exactly one of content or edits is required")
+        return self
 
 
 class ClientSyncResponse(BaseModel):
@@ -65,3 +92,37 @@ class ClientSyncResponse(BaseModel):
 
 class StopResponse(BaseModel):
     stopped: bool
+
+
+class BatchDocumentFilter(BaseModel):
+    """Selects stored documents for a batch job. Criteria are ANDed; empty = all."""
+
+    document_ids: Optional[List[str]] = Field(default=None, description="Explicit document ids")
+    title_contains: Optional[str] = Field(default=None, description="Case-insensitive title match")
+    content_contains: Optional[str] = Field(default=None, description="Substring of the content")
+
+
+class BatchJobRequest(BaseModel):
+    instruction: str = Field(..., min_length=1, description="Instruction applied to each document")
+    provider: str = Field(default="deepseek", description="AI provider")
+    model: str = Field(..., description="Model name")
+    filter: BatchDocumentFilter = Field(default_factory=BatchDocumentFilter)
+
+
+class BatchItemStatus(BaseModel):
+    document_id: str
+    title: str
+    status: str = Field(..., description="pending | running | done | unchanged | failed | cancelled")
+    error: Optional[str] = None
+
+
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="running | done | cancelled")
+    instruction: str
+    provider: str
+    model: str
+    counts: Dict[str, int]
+    items: List[BatchItemStatus]
+    created_at: datetime
+    finished_at: Optional[datetime] = None
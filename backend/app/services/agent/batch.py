@@ -0,0 +1,222 @@
+"""Batch agent jobs — apply one instruction to many stored documents.
+
+A job runs one agent turn per document over a private Workspace, with at
+most ``agent_batch_workers`` turns in flight per job. Each turn also takes a
+provider slot from the AgentScheduler at batch priority, so batch work never
+gets ahead of interactive turns. Results are written
+back to the document store when the turn succeeds and the stored document was
+not modified in the meantime. Progress is recorded in the job's EventBuffer.
+
+Jobs are in-memory like agent sessions; a restart loses them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Literal, Optional
+
+from app.core.config import get_settings
+from app.services.agent.events import EventBuffer
+from app.services.agent.scheduler import (
+    PRIORITY_BATCH,
+    AgentScheduler,
+    SlotLease,
+    get_scheduler,
+)
+from app.services.agent.service import AgentService
+from app.services.workspace.workspace import Workspace
+
+_settings = get_settings()
+
+JobStatus = Literal["running", "done", "cancelled"]
+ItemStatus = Literal["pending", "running", "done", "unchanged", "failed", "cancelled"]
+
+# Finished jobs kept for status polling before the oldest are evicted.
+_MAX_FINISHED_JOBS = 100
+
+
+@dataclass
+class BatchItem:
+    document_id: str
+    title: str = ""
+    status: ItemStatus = "pending"
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchJob:
+    job_id: str
+    instruction: str
+    provider: str
+    model: str
+    items: list[BatchItem]
+    status: JobStatus = "running"
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    events: EventBuffer = field(default_factory=EventBuffer)
+    stop_event: asyncio.Event = field(default_factory=asyncio.Event)
+    task: Optional[asyncio.Task] = None
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    def cancel(self) -> None:
+        """Stop running turns and skip documents not yet started."""
+        self.stop_event.set()
+
+
+def _revision(doc: dict) -> tuple:
+    """Snapshot of the fields a document update changes.
+
+    A rename alone leaves the content untouched but still bumps updated_at.
+    Comparing snapshots is cheap while the content is the same object.
+    """
+    return (doc["content"], doc["title"], doc.get("updated_at"))
+
+
+async def _run_item(
+    job: BatchJob, item: BatchItem, store: dict, api_key: str, base_url: str
+) -> None:
+    doc = store.get(item.document_id)
+    if doc is None:
+        item.status, item.error = "failed", "document not found"
+        return
+    revision = _revision(doc)
+    workspace = Workspace(content=doc["content"], title=doc["title"])
+    service = AgentService(
+        workspace=workspace,
+        provider=job.provider,
+        model=job.model,
+        api_key=api_key,
+        base_url=base_url,
+        stop_event=job.stop_event,
+    )
+    terminal: dict = {}
+    async for evt in service.run(job.instruction):
+        if evt["type"] in ("final", "error", "stopped"):
+            terminal = evt
+
+    if terminal.get("type") == "stopped":
+        item.status = "cancelled"
+    elif terminal.get("type") != "final":
+        item.status, item.error = "failed", terminal.get("error", "no result")
+    elif workspace.version == 0:
+        item.status = "unchanged"
+    elif store.get(item.document_id) is not doc or _revision(doc) != revision:
+        item.status, item.error = "failed", "document was modified during the job"
+    else:
+        doc["content"] = workspace.content
+        doc["title"] = workspace.title
+        doc["updated_at"] = datetime.utcnow()
+        item.status = "done"
+
+
+async def _batch_slot(job: BatchJob, scheduler: AgentScheduler) -> Optional[SlotLease]:
+    """Wait for a batch-priority slot; None as soon as the job is cancelled."""
+    if job.stop_event.is_set():
+        return None
+    acquire = asyncio.ensure_future(
+        scheduler.acquire(job.provider, priority=PRIORITY_BATCH, wait=False)
+    )
+    stopped = asyncio.ensure_future(job.stop_event.wait())
+    try:
+        await asyncio.wait({acquire, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopped.cancel()
+        if not acquire.done():
+            acquire.cancel()  # leaves the wait queue (or passes on a just-granted slot)
+            await asyncio.wait({acquire})
+    if acquire.cancelled():
+        return None
+    lease = acquire.result()
+    if job.stop_event.is_set():
+        lease.release()
+        return None
+    return lease
+
+
+async def run_batch_job(job: BatchJob, store: dict, api_key: str, base_url: str) -> None:
+    """Process every item of ``job`` against ``store`` (document id -> dict)."""
+    workers = asyncio.Semaphore(max(1, _settings.agent_batch_workers))
+    scheduler = get_scheduler()
+
+    async def process(index: int, item: BatchItem) -> None:
+        async with workers:
+            lease = await _batch_slot(job, scheduler)
+            if lease is None:
+                item.status = "cancelled"
+            else:
+                async with lease:
+                    item.status = "running"
+                    job.events.append(_item_event(index, item))
+                    try:
+                        await _run_item(job, item, store, api_key, base_url)
+                    except Exception as e:  # noqa: BLE001 — one document must not sink the job
+                        item.status, item.error = "failed", str(e)
+        job.events.append(_item_event(index, item))
+
+    try:
+        await asyncio.gather(*(process(i, item) for i, item in enumerate(job.items)))
+    finally:
+        job.status = "cancelled" if job.stop_event.is_set() else "done"
+        job.finished_at = datetime.utcnow()
+        job.events.append({"type": "batch_done", "status": job.status, "counts": job.counts()})
+        job.events.close()
+
+
+def _item_event(index: int, item: BatchItem) -> dict:
+    evt = {
+        "type": "batch_item",
+        "index": index,
+        "document_id": item.document_id,
+        "title": item.title,
+        "status": item.status,
+    }
+    if item.error:
+        evt["error"] = item.error
+    return evt
+
+
+class BatchJobManager:
+    """Process-local registry of batch jobs."""
+
+    def __init__(self) -> None:
+        self._jobs: dict[str, BatchJob] = {}
+
+    def create(
+        self, instruction: str, provider: str, model: str, documents: list[tuple[str, str]]
+    ) -> BatchJob:
+        """Register a job over ``documents`` given as ``(document_id, title)`` pairs."""
+        self._evict_finished()
+        job = BatchJob(
+            job_id=str(uuid.uuid4()),
+            instruction=instruction,
+            provider=provider,
+            model=model,
+            items=[BatchItem(document_id=doc_id, title=title) for doc_id, title in documents],
+        )
+        self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    def _evict_finished(self) -> None:
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[: max(0, len(finished) - _MAX_FINISHED_JOBS + 1)]:
+            self._jobs.pop(job.job_id, None)
+
+
+# Module-level singleton (in-memory, per process)
+_jobs = BatchJobManager()
+
+
+def get_batch_manager() -> BatchJobManager:
+    return _jobs
@@ -0,0 +1,74 @@
+"""Bounded in-memory event log with sequence ids.
+
+Producers append dicts synchronously; any number of readers replay from a
+sequence id and then follow new events as they arrive. Only the most recent
+``maxlen`` events are kept, so a reader that falls further behind than that
+resumes at the oldest retained event.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import AsyncGenerator
+
+
+class EventBuffer:
+    """Append-only ring buffer of ``(seq, event)`` pairs; seq starts at 1."""
+
+    def __init__(self, maxlen: int = 1000) -> None:
+        self._events: deque[tuple[int, dict]] = deque(maxlen=maxlen)
+        self._last_seq = 0
+        self._closed = False
+        # Replaced on every append/close; readers wait on the instance they saw.
+        self._changed = asyncio.Event()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def append(self, event: dict) -> int:
+        """Record ``event`` and wake readers. Returns its sequence id."""
+        if self._closed:
+            raise RuntimeError("event buffer is closed")
+        self._last_seq += 1
+        self._events.append((self._last_seq, event))
+        self._notify()
+        return self._last_seq
+
+    def close(self) -> None:
+        """Mark the log complete; readers finish after draining it."""
+        self._closed = True
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def since(self, after: int) -> list[tuple[int, dict]]:
+        """Retained events with a sequence id greater than ``after``."""
+        if not self._events or after >= self._last_seq:
+            return []
+        first = self._events[0][0]
+        start = max(0, after + 1 - first)
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[tuple[int, dict], None]:
+        """Yield events after ``after``, then follow live ones until closed."""
+        while True:
+            changed = self._changed
+            items = self.since(after)
+            for seq, event in items:
+                yield seq, event
+                after = seq
+            if self._closed and after >= self._last_seq:
+                return
+            if not items:
+                await changed.wait()
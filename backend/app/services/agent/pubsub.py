@@ -0,0 +1,138 @@
+"""Live fan-out of a session's events to any number of passive subscribers.
+
+Unlike the session EventBuffer (a replayable log for the client driving a
+run), a Broadcaster only pushes what happens from now on: agent run events
+plus a ``document_patch`` for every workspace commit, whoever made it (agent
+tool, client sync, undo). Each subscriber gets its own bounded asyncio.Queue
+so a slow reader never blocks the run or other readers.
+
+When a subscriber's queue is full, its backlog is compacted instead of
+blocking the producer:
+  - consecutive ``thought`` deltas are concatenated;
+  - ``document_patch`` events collapse into the newest one (a viewer only
+    needs the latest version to refetch);
+  - if that is still not enough, the oldest events are dropped and a
+    ``lagged`` event reports how many, so the client knows to resync.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncGenerator
+
+_CLOSED = object()
+
+
+def _compact(events: list[dict]) -> list[dict]:
+    """Merge thought runs and keep only the newest document_patch."""
+    last_patch = max(
+        (i for i, e in enumerate(events) if e.get("type") == "document_patch"), default=-1
+    )
+    out: list[dict] = []
+    for i, evt in enumerate(events):
+        kind = evt.get("type")
+        if kind == "document_patch" and i != last_patch:
+            continue
+        if kind == "document_patch":
+            # Ranges of the newest edit say nothing about the ones folded into it.
+            evt = {k: v for k, v in evt.items() if k != "ranges"}
+        if kind == "thought" and out and out[-1].get("type") == "thought":
+            out[-1] = {**out[-1], "content": out[-1]["content"] + evt["content"]}
+            continue
+        out.append(evt)
+    return out
+
+
+class Subscription:
+    """One reader's bounded queue. Iterate it to receive events."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = max(4, maxsize)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.maxsize)
+        self.dropped = 0
+
+    def offer(self, event: dict) -> None:
+        """Enqueue without blocking, compacting or dropping backlog when full."""
+        if self._queue.full():
+            self._compact_backlog(event)
+        else:
+            self._queue.put_nowait(event)
+
+    def close(self) -> None:
+        """End the subscription once the reader has drained what is queued."""
+        if self._queue.full():
+            self._compact_backlog(_CLOSED)
+        else:
+            self._queue.put_nowait(_CLOSED)
+
+    def _compact_backlog(self, incoming) -> None:
+        pending = [self._queue.get_nowait() for _ in range(self._queue.qsize())]
+        closing = incoming is _CLOSED or _CLOSED in pending
+        pending = [e for e in pending if e is not _CLOSED]
+        # Fold earlier lag notices into one running total.
+        lagged = sum(e["dropped"] for e in pending if e["type"] == "lagged")
+        events = [e for e in pending if e["type"] != "lagged"]
+        if incoming is not _CLOSED:
+            events.append(incoming)
+        events = _compact(events)
+        room = self.maxsize - int(closing)  # the close marker stays last
+        if lagged or len(events) > room:
+            room -= 1  # for the lagged notice
+        if len(events) > room:
+            overflow = len(events) - room
+            self.dropped += overflow
+            lagged += overflow
+            events = events[overflow:]
+        if lagged:
+            events.insert(0, {"type": "lagged", "dropped": lagged})
+        for item in events:
+            self._queue.put_nowait(item)
+        if closing:
+            self._queue.put_nowait(_CLOSED)
+
+    def __aiter__(self) -> AsyncGenerator[dict, None]:
+        return self._iter()
+
+    async def _iter(self) -> AsyncGenerator[dict, None]:
+        while True:
+            item = await self._queue.get()
+            if item is _CLOSED:
+                return
+            yield item
+
+
+class Broadcaster:
+    """Publishes events to every current Subscription without blocking."""
+
+    def __init__(self, queue_size: int = 256) -> None:
+        self.queue_size = queue_size
+        self._subscribers: set[Subscription] = set()
+        self._closed = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self.queue_size)
+        if self._closed:
+            sub.close()
+        else:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
+
+    def publish(self, event: dict) -> None:
+        if self._closed:
+            return
+        for sub in self._subscribers:
+            sub.offer(event)
+
+    def close(self) -> None:
+        """End every subscription; later subscribers end immediately."""
+        self._closed = True
+        for sub in self._subscribers:
+            sub.close()
+        self._subscribers.clear()
@@ -0,0 +1,252 @@
+"""Process-wide admission control for agent runs.
+
+Every agent run (interactive turn or batch item) holds one slot of its
+provider while it talks to the model, so a burst of traffic queues up here
+instead of all runs hammering e.g. a local Ollama at once and slowing down
+together.
+
+Per provider there are ``limit`` slots and a wait queue ordered by priority
+(lower first), then arrival. Interactive requests wait at most
+``max_wait`` seconds and are refused outright once ``max_waiting`` of them
+are queued, so callers can answer 429/503 with a ``Retry-After`` estimate
+right away. Batch work waits without a deadline and does not count toward
+``max_waiting``; it only runs when no interactive request is ahead of it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.core import metrics
+from app.core.config import get_settings
+from app.core.exceptions import AgentOverloadedException
+
+_settings = get_settings()
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Weight of the newest sample in the moving average of slot hold times.
+_HOLD_EWMA_ALPHA = 0.2
+
+
+def parse_provider_limits(spec: str) -> dict[str, int]:
+    """Parse ``"deepseek=8,ollama=2"`` into ``{"deepseek": 8, "ollama": 2}``."""
+    limits: dict[str, int] = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            limits[name.strip().lower()] = max(1, int(value))
+    return limits
+
+
+@dataclass
+class _ProviderState:
+    limit: int
+    active: int = 0
+    # (priority, arrival, future, counts_toward_max_waiting)
+    waiters: list = field(default_factory=list)
+    interactive_waiting: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    avg_hold: float = 0.0
+
+
+class SlotLease:
+    """A held provider slot. Release it exactly once (extra calls are no-ops)."""
+
+    def __init__(self, scheduler: "AgentScheduler", provider: str) -> None:
+        self._scheduler = scheduler
+        self.provider = provider
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self.provider, time.monotonic() - self.acquired_at)
+
+    async def __aenter__(self) -> "SlotLease":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AgentScheduler:
+    """Per-provider concurrency slots with a priority wait queue."""
+
+    def __init__(
+        self,
+        limits: dict[str, int],
+        default_limit: int = 1,
+        max_waiting: int = 20,
+        max_wait: float = 10.0,
+    ) -> None:
+        self._limits = limits
+        self._default_limit = default_limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._providers: dict[str, _ProviderState] = {}
+        self._arrival = itertools.count()
+
+    @classmethod
+    def from_settings(cls) -> "AgentScheduler":
+        return cls(
+            parse_provider_limits(_settings.agent_provider_concurrency),
+            max_waiting=_settings.agent_max_waiting_runs,
+            max_wait=_settings.agent_admission_max_wait,
+        )
+
+    def _state(self, provider: str) -> _ProviderState:
+        provider = provider.lower()
+        if provider not in self._providers:
+            limit = self._limits.get(provider, self._default_limit)
+            self._providers[provider] = _ProviderState(limit=limit)
+        return self._providers[provider]
+
+    def retry_after(self, provider: str) -> int:
+        """Seconds until a newly queued request would likely get a slot."""
+        state = self._state(provider)
+        hold = state.avg_hold or 1.0
+        return max(1, math.ceil(hold * (len(state.waiters) + 1) / state.limit))
+
+    async def acquire(
+        self, provider: str, priority: int = PRIORITY_INTERACTIVE, wait: bool = True
+    ) -> SlotLease:
+        """Wait for a slot of ``provider`` and return its lease.
+
+        Interactive callers (``wait=True``) give up after ``max_wait`` seconds
+        (AgentOverloadedException, 503) and are refused without waiting when
+        the queue already holds ``max_waiting`` of them (429). With
+        ``wait=False`` the caller waits as long as it takes (batch work).
+        """
+        state = self._state(provider)
+        if state.active < state.limit and not state.waiters:
+            return self._admit(provider, state)
+        if wait and state.interactive_waiting >= self.max_waiting:
+            state.rejected += 1
+            raise AgentOverloadedException(
+                f"{provider} 当前排队请求过多，请稍后重试",
+                status_code=429,
+                retry_after=self.retry_after(provider),
+            )
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._arrival), future, wait)
+        heapq.heappush(state.waiters, entry)
+        state.interactive_waiting += int(wait)
+        try:
+            if wait:
+                await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+            else:
+                await future
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: pass the slot on.
+                self._release(provider, 0.0, sample=False)
+            else:
+                future.cancel()
+                self._remove_waiter(state, entry)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            state.timed_out += 1
+            raise AgentOverloadedException(
+                f"{provider} 当前繁忙，等待超时，请稍后重试",
+                status_code=503,
+                retry_after=self.retry_after(provider),
+            ) from None
+        return SlotLease(self, provider)
+
+    def slot(self, provider: str, priority: int = PRIORITY_INTERACTIVE, wait: bool = True):
+        """``async with scheduler.slot(...)`` form of acquire()."""
+        return _SlotContext(self, provider, priority, wait)
+
+    def _admit(self, provider: str, state: _ProviderState) -> SlotLease:
+        state.active += 1
+        state.admitted += 1
+        return SlotLease(self, provider)
+
+    def _remove_waiter(self, state: _ProviderState, entry: tuple) -> None:
+        try:
+            state.waiters.remove(entry)
+        except ValueError:
+            return
+        heapq.heapify(state.waiters)
+        state.interactive_waiting -= int(entry[3])
+
+    def _release(self, provider: str, held: float, sample: bool = True) -> None:
+        state = self._state(provider)
+        if sample:
+            state.avg_hold = (
+                held
+                if not state.avg_hold
+                else (1 - _HOLD_EWMA_ALPHA) * state.avg_hold + _HOLD_EWMA_ALPHA * held
+            )
+        state.active -= 1
+        # Hand the slot straight to the best live waiter.
+        while state.waiters:
+            _priority, _arrival, future, counted = heapq.heappop(state.waiters)
+            state.interactive_waiting -= int(counted)
+            if not future.done():
+                future.set_result(None)
+                state.active += 1
+                state.admitted += 1
+                return
+
+    def stats(self) -> dict[str, dict]:
+        """Per-provider slot usage, queue depth and admission counters."""
+        return {
+            name: {
+                "limit": s.limit,
+                "active": s.active,
+                "waiting": len(s.waiters),
+                "waiting_interactive": s.interactive_waiting,
+                "admitted": s.admitted,
+                "rejected": s.rejected,
+                "timed_out": s.timed_out,
+                "avg_run_seconds": round(s.avg_hold, 3),
+            }
+            for name, s in self._providers.items()
+        }
+
+
+class _SlotContext:
+    def __init__(
+        self, scheduler: AgentScheduler, provider: str, priority: int, wait: bool
+    ) -> None:
+        self._args = (scheduler, provider, priority, wait)
+        self._lease: Optional[SlotLease] = None
+
+    async def __aenter__(self) -> SlotLease:
+        scheduler, provider, priority, wait = self._args
+        self._lease = await scheduler.acquire(provider, priority=priority, wait=wait)
+        return self._lease
+
+    async def __aexit__(self, *exc) -> None:
+        if self._lease is not None:
+            self._lease.release()
+
+
+# Module-level singleton (in-memory, per process)
+_scheduler = AgentScheduler.from_settings()
+
+
+def get_scheduler() -> AgentScheduler:
+    return _scheduler
+
+
+def _scheduler_gauge(key: str):
+    # Reads the current singleton so a replaced scheduler (tests) is reported.
+    return lambda: {(name,): stats[key] for name, stats in get_scheduler().stats().items()}
+
+
+metrics.SCHEDULER_ACTIVE.set_function(_scheduler_gauge("active"))
+metrics.SCHEDULER_WAITING.set_function(_scheduler_gauge("waiting"))
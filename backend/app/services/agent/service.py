@@ -14,30 +14,111 @@ Reliability guarantees implemented here (see docs/AGENT_TESTING_REPORT.md):
     part-index and flushed on PartEndEvent / tool boundaries, so the frontend
     receives a few substantial thought events rather than hundreds of token
     fragments (which caused render storms).
-  - **cooperative cancellation**: the run loop polls `stop_event` between events
-    so an external `/stop` request interrupts the stream promptly.
+  - **cancellation**: the event stream is pumped from its own task, which is
+    cancelled the moment `stop_event` is set — even while the model is still
+    generating or the provider has stalled — so `/stop` (or a client
+    disconnect) aborts the underlying HTTP stream instead of waiting for the
+    next event. The run loop additionally polls `stop_event` between events.
+  - **deadlines**: each turn has a wall-clock budget (`agent_run_timeout`) and
+    each model request an HTTP timeout (`agent_model_request_timeout`). Either
+    one ending the run yields a terminal `error` event carrying timing info.
+    Workspace edits are applied atomically under its lock, so a run cut short
+    never leaves a half-applied edit behind.
+  - **tool-failure budget**: failed tool results are counted per run; after
+    `agent_max_tool_failures` consecutive model responses whose tool calls all
+    failed, the turn is aborted with an `error` event instead of spending the
+    remaining model requests failing. Parallel calls of one response count
+    once, so the model always gets to read their errors. The total failure
+    count is reported on the terminal event.
+
+Fan-out mode (`run(..., fan_out=True)`) splits the document into its
+top-level sections, runs one sub-agent per section concurrently (bounded by
+`agent_fanout_concurrency`), each over a private Workspace holding just that
+section, and merges every changed section back as a single new version.
+
+Every run also feeds the process metrics (app.core.metrics) and records a
+span timeline of model requests, tool calls and lock waits in ``self.trace``
+(app.core.tracing).
 """
 
 from __future__ import annotations
 
 import asyncio
+import json
+import time
+from contextlib import aclosing
 from typing import AsyncGenerator, Optional
 
+import httpx
+import openai
 from pydantic_ai import Agent, RunContext, UsageLimits
 from pydantic_ai.exceptions import UsageLimitExceeded
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
+from pydantic_ai.usage import RunUsage
 
+from app.core import metrics
 from app.core.config import get_settings
+from app.core.tracing import RunTrace, Span, current_trace, export_trace
+from app.services.agent.scheduler import get_scheduler
 from app.services.agent.translator import (
+    TOOL_ERROR_PREFIX,
     make_document_patch,
+    make_section_progress,
     make_thought_delta,
     translate_event,
 )
+from app.services.agent.usage import TokenUsage
+from app.services.workspace import tools as workspace_tools
+from app.services.workspace.outline import parse_outline, top_level_chunks
 from app.services.workspace.workspace import Workspace
 
 _settings = get_settings()
 
+# Upper bound on search_document hits returned to the model in one call.
+_MAX_SEARCH_HITS = 100
+
+# Instruction handed to each fan-out sub-agent; its workspace holds one part.
+_FAN_OUT_PROMPT = (
+    "You are editing ONE part of a larger document: {part} (part {index} of {total}). "
+    "The document you see contains only this part. Apply the instruction below to "
+    "this part alone, editing it with tools; do not add content that belongs to other "
+    "parts. If the instruction does not apply to this part, leave it unchanged.\n\n"
+    "Instruction: {message}"
+)
+
+# Markers for items passed from the pump task to AgentService._drive.
+_EVENT = "event"
+_ERROR = "error"
+_END = "end"
+
+
+class ToolFailureLimitExceeded(Exception):
+    """Raised after ``agent_max_tool_failures`` consecutive responses whose tools all failed."""
+
+    def __init__(self, consecutive: int, last_error: str) -> None:
+        self.consecutive = consecutive
+        self.last_error = last_error
+        super().__init__(last_error)
+
+
+class AgentRunTimeout(Exception):
+    """Raised by AgentService._drive when the run's wall-clock deadline passes."""
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    """True if ``exc`` (or an exception it wraps) is a request timeout.
+
+    PydanticAI wraps provider errors in ``ModelAPIError``, so the underlying
+    openai/httpx timeout is found on the ``__cause__`` chain.
+    """
+    seen: BaseException | None = exc
+    while seen is not None:
+        if isinstance(seen, (openai.APITimeoutError, httpx.TimeoutException, TimeoutError)):
+            return True
+        seen = seen.__cause__
+    return False
+
 
 async def _ok(coro):
     """Await a tool's workspace coroutine, returning its result.
@@ -54,7 +135,63 @@ async def _ok(coro):
     try:
         return await coro
     except Exception as e:  # noqa: BLE001 — a tool error must not crash the run
-        return f"[tool error] {type(e).__name__}: {e}"
+        return f"{TOOL_ERROR_PREFIX} {type(e).__name__}: {e}"
+
+
+def _page(text: str, offset: int, limit: int | None, resume: str) -> str:
+    """Cap a read tool's output at ``agent_tool_output_max_chars``.
+
+    Returns one page of ``text`` starting at ``offset``. If more remains, an
+    explicit truncation notice tells the model how to continue: ``resume`` is a
+    call template with an ``{offset}`` placeholder. This keeps every tool result
+    (and therefore every later prompt in the run) bounded in size. The
+    placeholder is substituted literally, so braces in headings are safe.
+    """
+    cap = _settings.agent_tool_output_max_chars
+    limit = cap if limit is None else max(1, min(limit, cap))
+    try:
+        chunk, next_offset = workspace_tools.page_text(text, offset, limit)
+    except ValueError as e:
+        return f"{TOOL_ERROR_PREFIX} ValueError: {e}"
+    if next_offset is not None:
+        return (
+            f"{chunk}\n[truncated: showing chars {offset}-{next_offset} of {len(text)}; "
+            f"call {resume.replace('{offset}', str(next_offset))} to continue]"
+        )
+    if offset > 0:
+        return f"{chunk}\n[end: showing chars {offset}-{len(text)} of {len(text)}]"
+    return chunk
+
+
+def _payload_size(value) -> int:
+    """Size in bytes of a tool payload (JSON args or result text) for traces."""
+    if value is None:
+        return 0
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return len(value.encode("utf-8"))
+
+
+def _attach_token_usage(model_spans: list[Span], result) -> None:
+    """Copy each model response's token usage onto its span, in order.
+
+    Stream events carry no usage; the finished run's new messages do, one
+    ModelResponse per model request.
+    """
+    try:
+        messages = result.new_messages()
+    except Exception:  # noqa: BLE001 — usage is best-effort trace detail
+        return
+    responses = [m for m in messages if getattr(m, "kind", None) == "response"]
+    for span, response in zip(model_spans, responses):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            continue
+        span.attributes.update(
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cache_read_tokens=usage.cache_read_tokens,
+        )
 
 
 class AgentService:
@@ -78,6 +215,16 @@ class AgentService:
         # the agent stream and yields a terminal `stopped` event.
         self.stop_event: asyncio.Event = stop_event or asyncio.Event()
         self._agent: Agent[Workspace, str] | None = None
+        # Model responses streamed in the current run (for metrics).
+        self.model_responses = 0
+        # Span timeline of the current (or last) run.
+        self.trace = RunTrace()
+        # Tokens used by the current (or last) run, and the cap passed to run().
+        self.usage = TokenUsage()
+        self.token_limit: Optional[int] = None
+        # Set on fan-out parts: their run-level metrics and trace belong to
+        # the parent run (see _sub_service).
+        self._sub_run = False
 
     def build_agent(self) -> Agent[Workspace, str]:
         """Build the PydanticAI agent with workspace tools registered."""
@@ -99,20 +246,71 @@ class AgentService:
         """Register each Workspace operation as an @agent.tool."""
 
         @agent.tool
-        async def get_document_outline(ctx: RunContext[Workspace]) -> str:
-            """Return the document outline: list of headings with line ranges."""
+        async def get_document_outline(ctx: RunContext[Workspace], offset: int = 0) -> str:
+            """Return the document outline: list of headings with line ranges.
+
+            Very long outlines are paged; follow the continuation notice.
+            """
             outline = await _ok(ctx.deps.get_document_outline())
             if isinstance(outline, str):  # error string from _ok
                 return outline
-            return "\n".join(
+            text = "\n".join(
                 f"{'#' * s['level']} {s['heading']} (lines {s['line_start']}-{s['line_end']})"
                 for s in outline
             )
+            return _page(text, offset, None, "get_document_outline(offset={offset})")
 
         @agent.tool
-        async def get_section(ctx: RunContext[Workspace], heading: str) -> str:
-            """Read the full content of a section identified by its heading."""
-            return await _ok(ctx.deps.get_section(heading=heading))
+        async def get_section(
+            ctx: RunContext[Workspace], heading: str, offset: int = 0, limit: int | None = None
+        ) -> str:
+            """Read the content of a section identified by its heading.
+
+            Long sections are returned in pages of at most ``limit`` chars
+            starting at char ``offset`` of the section; a truncation notice
+            says which ``offset`` to pass to read the next page.
+            """
+            text = await _ok(ctx.deps.get_section(heading=heading))
+            if text.startswith(TOOL_ERROR_PREFIX):
+                return text
+            return _page(
+                text, offset, limit, f"get_section(heading={heading!r}, offset={{offset}})"
+            )
+
+        @agent.tool
+        async def search_document(
+            ctx: RunContext[Workspace],
+            query: str,
+            regex: bool = False,
+            max_hits: int = 20,
+            case_sensitive: bool = False,
+        ) -> str:
+            """Locate text in the document without reading it section by section.
+
+            Returns each hit's line number, char offset, enclosing heading and a
+            short snippet. ``query`` is literal unless ``regex`` is true.
+            """
+            max_hits = max(1, min(max_hits, _MAX_SEARCH_HITS))
+            result = await _ok(
+                ctx.deps.search_document(
+                    query=query, regex=regex, max_hits=max_hits, case_sensitive=case_sensitive
+                )
+            )
+            if isinstance(result, str):  # error string from _ok
+                return result
+            total, hits = result["total"], result["hits"]
+            if not total:
+                return f"no matches for {query!r}"
+            lines = [f"{total} match(es) for {query!r}:"]
+            lines += [
+                f"- line {h['line']}, char {h['offset']}"
+                + (f", in {h['heading']!r}" if h["heading"] else "")
+                + f": {h['snippet']}"
+                for h in hits
+            ]
+            if total > len(hits):
+                lines.append(f"(showing {len(hits)} of {total}; narrow the query to see others)")
+            return "\n".join(lines)
 
         @agent.tool
         async def insert_text(
@@ -126,6 +324,25 @@ class AgentService:
             """Replace an entire section (identified by heading) with new text."""
             return await _ok(ctx.deps.replace_section(heading=heading, text=text))
 
+        @agent.tool
+        async def replace_snippet(
+            ctx: RunContext[Workspace],
+            old: str,
+            new: str,
+            occurrence: int | None = None,
+            heading: str | None = None,
+        ) -> str:
+            """Replace one exact quoted snippet ``old`` with ``new``.
+
+            ``old`` must be copied verbatim from the document. It must be unique
+            (within ``heading``'s section, if given) unless ``occurrence``
+            (1-based) says which match to edit. Prefer this for small fixes: no
+            need to read or re-emit the whole section.
+            """
+            return await _ok(
+                ctx.deps.replace_snippet(old=old, new=new, occurrence=occurrence, heading=heading)
+            )
+
         @agent.tool
         async def replace_document(ctx: RunContext[Workspace], text: str) -> str:
             """Replace the ENTIRE document body with the given Markdown ``text``.
@@ -138,12 +355,50 @@ class AgentService:
             return await _ok(ctx.deps.replace_document(text=text))
 
         @agent.tool
-        async def find_replace(ctx: RunContext[Workspace], pattern: str, replacement: str) -> str:
-            """Replace all occurrences of pattern with replacement throughout the document."""
-            result = await _ok(ctx.deps.find_replace(pattern=pattern, replacement=replacement))
+        async def find_replace(
+            ctx: RunContext[Workspace],
+            pattern: str,
+            replacement: str,
+            regex: bool = False,
+            whole_word: bool = False,
+            ignore_case: bool = False,
+            heading: str | None = None,
+            start: int | None = None,
+            end: int | None = None,
+        ) -> str:
+            """Replace all occurrences of pattern with replacement.
+
+            ``pattern`` is literal unless ``regex`` is true (then ``replacement``
+            may use ``\\1`` group references). Limit the edit to one section
+            with ``heading``, or to chars [``start``, ``end``) of the document.
+            """
+            where = ""
+            if heading is not None:
+                # Resolve once up front so the result names the section edited.
+                resolved = await _ok(ctx.deps.resolve_heading(heading))
+                if resolved.startswith(TOOL_ERROR_PREFIX):
+                    return resolved
+                where = f" in section {resolved!r}"
+                if resolved != heading:
+                    where += f" (requested {heading!r})"
+                heading = resolved
+            char_range = None
+            if start is not None or end is not None:
+                char_range = (start or 0, end if end is not None else len(ctx.deps.content))
+            result = await _ok(
+                ctx.deps.find_replace(
+                    pattern=pattern,
+                    replacement=replacement,
+                    regex=regex,
+                    whole_word=whole_word,
+                    ignore_case=ignore_case,
+                    heading=heading,
+                    char_range=char_range,
+                )
+            )
             if isinstance(result, str):  # error string from _ok
                 return result
-            return f"replaced {result} occurrence(s)"
+            return f"replaced {result} occurrence(s){where}"
 
         @agent.tool
         async def set_title(ctx: RunContext[Workspace], title: str) -> str:
@@ -158,7 +413,12 @@ class AgentService:
         Implements reliable document_patch emission, thought aggregation, and
         cooperative cancellation — see class docstring for the guarantees.
         """
-        usage_limits = UsageLimits(request_limit=_settings.agent_max_iterations)
+        usage_limits = UsageLimits(
+            request_limit=_settings.agent_max_iterations, total_tokens_limit=self.token_limit
+        )
+        # Filled in by PydanticAI as responses arrive, so a run that fails or
+        # is cancelled midway still accounts for what it used.
+        run_usage = RunUsage()
 
         # Per-part-index buffer for streamed thought deltas. Flushed on
         # PartEndEvent or when a tool boundary is crossed.
@@ -166,6 +426,20 @@ class AgentService:
         # The last text part the model emitted is the user-facing summary.
         # Captured so the caller (API layer) can persist it into message_history.
         self.last_assistant_text = ""
+        # Tool failure accounting for the tool-failure budget.
+        self.tool_failures = 0
+        consecutive_failures = 0
+        max_failures = _settings.agent_max_tool_failures
+        # Outcome of the current model response's tool calls so far.
+        round_ok = round_failed = False
+        # Latency bookkeeping for metrics and the run trace: when the pending
+        # model request was sent (None once its first part streamed in), the
+        # model response being streamed, and open tool spans by tool_call_id.
+        self.model_responses = 0
+        request_sent: float | None = time.monotonic()
+        model_span: Span | None = None
+        model_spans: list[Span] = []
+        tool_spans: dict[str, Span] = {}
 
         def flush_thought(idx: int) -> Optional[dict]:
             buf = thought_buffers.pop(idx, None)
@@ -177,13 +451,19 @@ class AgentService:
         # every _commit (via a change listener). We drain the queue at each
         # event boundary. This captures every edit even when PydanticAI runs
         # multiple tool calls concurrently within one event-loop tick.
-        pending_patches: list[int] = []
-        remove_listener = self.workspace.add_change_listener(pending_patches.append)
+        # Each entry is (version, ranges) — ranges are read from the workspace
+        # inside the listener, i.e. for exactly the commit being reported.
+        pending_patches: list[tuple[int, list | None]] = []
+        remove_listener = self.workspace.add_change_listener(
+            lambda version: pending_patches.append((version, self.workspace.last_edit_ranges))
+        )
         try:
             async with agent.run_stream_events(
                 message,
                 deps=self.workspace,
                 usage_limits=usage_limits,
+                usage=run_usage,
+                model_settings={"timeout": _settings.agent_model_request_timeout},
                 message_history=message_history or [],
             ) as events:
                 async for event in events:
@@ -193,6 +473,38 @@ class AgentService:
                         return
 
                     kind = type(event).__name__
+                    now = time.monotonic()
+                    if request_sent is not None and kind in ("PartStartEvent", "PartDeltaEvent"):
+                        ttft = now - request_sent
+                        metrics.LLM_TIME_TO_FIRST_TOKEN.observe(ttft, provider=self.provider)
+                        self.model_responses += 1
+                        model_span = self.trace.start_span(
+                            "model.request",
+                            "model",
+                            at=request_sent,
+                            model=self.model,
+                            ttft_ms=round(ttft * 1000, 3),
+                        )
+                        model_spans.append(model_span)
+                        request_sent = None
+                    elif kind in ("FunctionToolCallEvent", "AgentRunResultEvent"):
+                        # The response is complete once tools start or the run ends.
+                        if model_span is not None:
+                            self.trace.end_span(model_span)
+                            model_span = None
+
+                    if kind == "FunctionToolCallEvent":
+                        part = event.part
+                        name = getattr(part, "tool_name", "") or ""
+                        tool_spans[getattr(part, "tool_call_id", "")] = self.trace.start_span(
+                            f"tool {name}",
+                            "tool",
+                            tool=name,
+                            args_bytes=_payload_size(getattr(part, "args", None)),
+                        )
+                    elif kind == "AgentRunResultEvent":
+                        _attach_token_usage(model_spans, event.result)
+                        continue
 
                     # On tool-result boundaries (and any part-end), flush buffered
                     # thought text first so it isn't interleaved with tool output.
@@ -208,7 +520,8 @@ class AgentService:
 
                     # Drain any edits the workspace recorded since the last event.
                     while pending_patches:
-                        yield make_document_patch(pending_patches.pop(0), "document edited")
+                        version, ranges = pending_patches.pop(0)
+                        yield make_document_patch(version, "document edited", ranges)
 
                     if kind == "PartDeltaEvent":
                         # Buffer the delta; only the index for this delta carries
@@ -236,6 +549,39 @@ class AgentService:
                     if translated is not None:
                         yield translated
 
+                    if translated is not None and translated["type"] == "tool_result":
+                        # The next model request goes out once the last result is in.
+                        request_sent = now
+                        tool_span = tool_spans.pop(getattr(event.part, "tool_call_id", ""), None)
+                        if tool_span is not None:
+                            self.trace.end_span(
+                                tool_span,
+                                ok=translated["ok"],
+                                result_bytes=_payload_size(translated["summary"]),
+                            )
+                            metrics.TOOL_DURATION.observe(
+                                tool_span.end - tool_span.start, tool=translated["name"]
+                            )
+                        metrics.TOOL_CALLS.inc(
+                            tool=translated["name"], outcome="ok" if translated["ok"] else "failed"
+                        )
+                        if translated["ok"]:
+                            round_ok = True
+                        else:
+                            self.tool_failures += 1
+                            round_failed = True
+                        # A response counts once, when all of its calls are answered.
+                        if not tool_spans:
+                            if round_ok:
+                                consecutive_failures = 0
+                            elif round_failed:
+                                consecutive_failures += 1
+                                if 0 < max_failures <= consecutive_failures:
+                                    raise ToolFailureLimitExceeded(
+                                        consecutive_failures, translated["summary"]
+                                    )
+                            round_ok = round_failed = False
+
                 # Flush any trailing thought text after the stream ends.
                 for idx in list(thought_buffers.keys()):
                     flushed = flush_thought(idx)
@@ -243,38 +589,341 @@ class AgentService:
                         yield flushed
                 # Drain any final edits recorded after the last event.
                 while pending_patches:
-                    yield make_document_patch(pending_patches.pop(0), "document edited")
+                    version, ranges = pending_patches.pop(0)
+                    yield make_document_patch(version, "document edited", ranges)
         finally:
             remove_listener()
+            self.usage = TokenUsage.from_run_usage(run_usage)
+
+    async def _drive(
+        self, source: AsyncGenerator[dict, None], deadline: float | None = None
+    ) -> AsyncGenerator[dict, None]:
+        """Re-yield ``source``'s events while consuming it in a separate task.
+
+        Awaiting ``source`` directly would leave us blind to ``stop_event``
+        until the provider produces its next event. Instead, a pump task feeds
+        a queue and we wait on *either* the queue or ``stop_event``; when the
+        stop wins, the pump task is cancelled, which unwinds PydanticAI's
+        ``run_stream_events`` context and closes the in-flight HTTP request.
+        Exceptions raised by ``source`` are re-raised here. If ``deadline``
+        (a ``time.monotonic()`` value) passes first, the pump task is cancelled
+        the same way and ``AgentRunTimeout`` is raised.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump() -> None:
+            # Tasks the run starts (tool calls) inherit this, so the Workspace
+            # can add its lock waits to this run's trace.
+            current_trace.set(self.trace)
+            try:
+                async for evt in source:
+                    await queue.put((_EVENT, evt))
+            except Exception as e:  # noqa: BLE001 — re-raised by the consumer
+                await queue.put((_ERROR, e))
+            else:
+                await queue.put((_END, None))
+
+        task = asyncio.create_task(pump())
+        stop_wait = asyncio.create_task(self.stop_event.wait())
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(
+                    {get, stop_wait}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if get not in done:
+                    get.cancel()
+                    task.cancel()
+                    await asyncio.wait({task})
+                    if stop_wait in done:
+                        yield {"type": "stopped", "content": ""}
+                        return
+                    raise AgentRunTimeout()
+                kind, payload = get.result()
+                if kind == _END:
+                    return
+                if kind == _ERROR:
+                    raise payload
+                yield payload
+        finally:
+            stop_wait.cancel()
+            if not task.done():
+                task.cancel()
+            # Let the cancelled run unwind (listener removal, stream close)
+            # before the caller releases the session.
+            await asyncio.wait({task})
+
+    def _sub_service(self, workspace: Workspace) -> "AgentService":
+        """An AgentService for a fan-out part, sharing provider and stop signal."""
+        sub = AgentService(
+            workspace=workspace,
+            provider=self.provider,
+            model=self.model,
+            api_key=self.api_key,
+            base_url=self.base_url,
+            stop_event=self.stop_event,
+        )
+        sub._sub_run = True
+        return sub
+
+    async def _invoke_fan_out(self, message: str) -> AsyncGenerator[dict, None]:
+        """Apply ``message`` to every top-level section with concurrent sub-agents.
+
+        Each part runs a full sub-agent turn over its own Workspace. Progress is
+        reported per part as ``section_progress`` events; once every part has
+        finished, all changed parts are merged into the shared workspace with
+        one ``apply_batch`` call (one version, one ``document_patch``). Parts
+        whose sub-run failed are left untouched and reported.
+
+        Each part holds a provider slot of its own while it runs (waiting
+        without a deadline, since the turn was already admitted), so the
+        provider's concurrency limit bounds fan-out like any other runs.
+
+        A ``token_limit`` is shared out as parts start: each gets an equal
+        slice of what is neither spent by finished parts nor reserved by
+        running ones, so the parts together stay within it and budget a part
+        leaves unused goes to the parts after it.
+        """
+        base_version = self.workspace.version
+        base_content = self.workspace.content
+        chunks = top_level_chunks(base_content, parse_outline(base_content))
+        total = len(chunks)
+        semaphore = asyncio.Semaphore(max(1, _settings.agent_fanout_concurrency))
+        progress: asyncio.Queue = asyncio.Queue()
+        results: dict[int, str] = {}
+        failures: dict[int, str] = {}
+        self.tool_failures = 0
+        not_started = total
+        reserved = 0  # token limits held by running parts
+
+        async def run_part(index: int, start: int, end: int, heading: str | None) -> None:
+            nonlocal not_started, reserved
+            async with semaphore, get_scheduler().slot(self.provider, wait=False):
+                limit = None
+                if self.token_limit is not None:
+                    spent = self.usage.total_tokens
+                    limit = (self.token_limit - spent - reserved) // not_started
+                not_started -= 1
+                if limit is not None and limit <= 0:
+                    failures[index] = f"超出会话 token 预算（本轮上限 {self.token_limit}），未处理"
+                    await progress.put(
+                        make_section_progress(index, total, heading, "failed", failures[index])
+                    )
+                    return
+                await progress.put(make_section_progress(index, total, heading, "running"))
+                sub = self._sub_service(Workspace(content=base_content[start:end]))
+                part = f"section {heading!r}" if heading else "the text before the first heading"
+                prompt = _FAN_OUT_PROMPT.format(
+                    part=part,
+                    index=index + 1,
+                    total=total,
+                    message=message,
+                )
+                terminal: dict = {}
+                reserved += limit or 0
+                span = self.trace.start_span(
+                    f"fan_out.part {index + 1}", "part", heading=heading, token_limit=limit
+                )
+                try:
+                    async for evt in sub.run(prompt, token_limit=limit):
+                        if evt["type"] in ("final", "error", "stopped"):
+                            terminal = evt
+                finally:
+                    reserved -= limit or 0
+                    self.usage.add(sub.usage)
+                    self.model_responses += sub.model_responses
+                    self.trace.end_span(span, outcome=terminal.get("type", "stopped"))
+                    self.trace.adopt(sub.trace, span)
+                self.tool_failures += sub.tool_failures
+                if terminal.get("type") == "final":
+                    results[index] = sub.workspace.content
+                    changed = sub.workspace.content != base_content[start:end]
+                    status = "done" if changed else "unchanged"
+                    await progress.put(make_section_progress(index, total, heading, status))
+                else:
+                    failures[index] = terminal.get("error") or terminal.get("type", "no result")
+                    await progress.put(
+                        make_section_progress(index, total, heading, "failed", failures[index])
+                    )
+
+        tasks = [asyncio.create_task(run_part(i, *chunk)) for i, chunk in enumerate(chunks)]
+        try:
+            pending = set(tasks)
+            while pending or not progress.empty():
+                getter = asyncio.ensure_future(progress.get())
+                done, _ = await asyncio.wait(
+                    pending | {getter}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter in done:
+                    yield getter.result()
+                else:
+                    getter.cancel()
+                pending = {t for t in pending if not t.done()}
+            for t in tasks:
+                t.result()  # surface unexpected exceptions from a part
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        edits = [
+            (start, end, results[i])
+            for i, (start, end, _) in enumerate(chunks)
+            if i in results and results[i] != base_content[start:end]
+        ]
+        if edits:
+            await self.workspace.apply_batch(base_version, edits, summary="fan-out")
+            yield make_document_patch(
+                self.workspace.version,
+                f"fan-out edited {len(edits)} section(s)",
+                self.workspace.last_edit_ranges,
+            )
+        if failures and len(failures) == total:
+            raise RuntimeError(f"all {total} part(s) failed: {next(iter(failures.values()))}")
+        self.last_assistant_text = (
+            f"已并行处理 {total} 个部分：{len(edits)} 个已修改，"
+            f"{total - len(edits) - len(failures)} 个无需修改，{len(failures)} 个失败。"
+        )
 
     async def run(
-        self, message: str, message_history: list | None = None
+        self,
+        message: str,
+        message_history: list | None = None,
+        fan_out: bool = False,
+        trace: bool = False,
+        token_limit: Optional[int] = None,
     ) -> AsyncGenerator[dict, None]:
         """Run the agent and yield SSE dicts. Always ends with {'type':'done'}.
 
         Emits a terminal event: ``final`` on success, ``stopped`` on external
-        cancellation, or ``error`` on exception — followed by ``done``.
+        cancellation, or ``error`` on exception — followed by ``done``. With
+        ``fan_out`` the message is applied section by section in parallel (see
+        ``_invoke_fan_out``); message_history is not used in that mode.
+
+        Every run records a span timeline in ``self.trace`` (exported when
+        ``agent_trace_file`` is set); with ``trace`` it is also attached to
+        the ``final`` event.
+
+        Token counts end up in ``self.usage`` and on the ``final`` event.
+        ``token_limit`` caps the run's total tokens (an ``error`` once
+        exceeded); in fan-out mode it is shared out among the parts.
         """
+        self.trace = RunTrace(provider=self.provider, model=self.model, fan_out=fan_out)
+        self.token_limit = token_limit
+        started = time.monotonic()
+        emitted = 0
+        # A run closed by its consumer before a terminal event was cancelled.
+        outcome = "stopped"
+        try:
+            async with aclosing(self._run(message, message_history, fan_out)) as events:
+                async for evt in events:
+                    emitted += 1
+                    if evt["type"] in ("final", "error", "stopped"):
+                        outcome = evt["type"]
+                    if evt["type"] == "final" and trace:
+                        evt = {**evt, "trace": self.trace.to_dict()}
+                    yield evt
+        finally:
+            self.trace.finish(outcome=outcome, events=emitted, **self.usage.as_dict())
+            # A fan-out run's usage is the sum of its sub-runs, which count their own.
+            if not fan_out:
+                for kind in ("input", "output", "cache_read", "cache_write"):
+                    tokens = getattr(self.usage, f"{kind}_tokens")
+                    if tokens:
+                        metrics.LLM_TOKENS.inc(tokens, provider=self.provider, kind=kind)
+            # Sub-runs are parts of their parent's run, which records it once.
+            if not self._sub_run:
+                export_trace(self.trace)
+                metrics.AGENT_RUN_INPUT_TOKENS.observe(
+                    self.usage.input_tokens, provider=self.provider
+                )
+                metrics.AGENT_RUNS.inc(provider=self.provider, outcome=outcome)
+                metrics.AGENT_RUN_DURATION.observe(
+                    time.monotonic() - started, provider=self.provider
+                )
+                metrics.AGENT_EVENTS.observe(emitted, provider=self.provider)
+                metrics.AGENT_ITERATIONS.observe(self.model_responses, provider=self.provider)
+
+    async def _run(
+        self, message: str, message_history: list | None, fan_out: bool
+    ) -> AsyncGenerator[dict, None]:
+        """The events of ``run``, without the per-run metrics bookkeeping."""
         # Initialise here too so callers that monkeypatch _invoke_agent_run
-        # (and thus skip its own initialisation) still see a defined attribute.
+        # (and thus skip its own initialisation) still see defined attributes.
         self.last_assistant_text = ""
-        agent = self._agent or self.build_agent()
+        self.tool_failures = 0
+        self.model_responses = 0
+        self.usage = TokenUsage()
+        started = time.monotonic()
+        run_timeout = _settings.agent_run_timeout
+        deadline = started + run_timeout if run_timeout > 0 else None
         try:
-            async for evt in self._invoke_agent_run(agent, message, message_history):
-                yield evt
-                if evt.get("type") == "stopped":
-                    return
+            if fan_out:
+                source = self._invoke_fan_out(message)
+            else:
+                agent = self._agent or self.build_agent()
+                source = self._invoke_agent_run(agent, message, message_history)
+            async with aclosing(self._drive(source, deadline)) as events:
+                async for evt in events:
+                    yield evt
+                    if evt.get("type") == "stopped":
+                        return
             # The model's user-facing answer was captured during the stream
             # (last text PartEndEvent). Surface it as the final event so the
             # frontend shows the actual summary rather than a placeholder.
-            yield {"type": "final", "content": self.last_assistant_text or "done"}
+            yield {
+                "type": "final",
+                "content": self.last_assistant_text or "done",
+                "tool_failures": self.tool_failures,
+                "usage": self.usage.as_dict(),
+            }
         except UsageLimitExceeded as e:
-            # Reached agent_max_iterations. Surface as an explicit, user-facing
-            # error instead of letting the stream end silently.
+            if self.token_limit is not None and "tokens_limit" in str(e):
+                # The session's token budget ran out mid-run.
+                yield {
+                    "type": "error",
+                    "error": f"超出会话 token 预算（本轮上限 {self.token_limit}），任务未完成",
+                    "usage": self.usage.as_dict(),
+                }
+            else:
+                # Reached agent_max_iterations. Surface as an explicit, user-facing
+                # error instead of letting the stream end silently.
+                yield {
+                    "type": "error",
+                    "error": (
+                        f"达到最大迭代次数（{_settings.agent_max_iterations}），任务未完成：{e}"
+                    ),
+                }
+        except ToolFailureLimitExceeded as e:
+            # The model keeps feeding tools bad arguments; further requests
+            # would most likely fail the same way.
+            yield {
+                "type": "error",
+                "error": f"连续 {e.consecutive} 轮工具调用全部失败，已提前终止：{e.last_error}",
+                "tool_failures": self.tool_failures,
+            }
+        except AgentRunTimeout:
+            elapsed = time.monotonic() - started
             yield {
                 "type": "error",
-                "error": f"达到最大迭代次数（{_settings.agent_max_iterations}），任务未完成：{e}",
+                "error": f"运行超时（已用 {elapsed:.1f}s，上限 {run_timeout:g}s），任务未完成",
+                "elapsed": round(elapsed, 3),
+                "timeout": run_timeout,
             }
         except Exception as e:  # noqa: BLE001 — surface to client
-            yield {"type": "error", "error": str(e)}
+            elapsed = time.monotonic() - started
+            if _is_timeout(e):
+                request_timeout = _settings.agent_model_request_timeout
+                yield {
+                    "type": "error",
+                    "error": (
+                        f"模型请求超时（单次上限 {request_timeout:g}s，"
+                        f"本轮已用 {elapsed:.1f}s）：{e}"
+                    ),
+                    "elapsed": round(elapsed, 3),
+                    "timeout": request_timeout,
+                }
+            else:
+                yield {"type": "error", "error": str(e)}
         yield {"type": "done", "content": ""}
@@ -2,20 +2,62 @@
 
 No persistence — sessions live in a process-local dict. Restart loses state.
 This matches the design decision (内存会话状态, no DB).
+
+A session owns its agent run: the run executes as a background task and
+appends its events to the session's EventBuffer, so HTTP streams are only
+readers. A client that drops its connection can reattach and resume from the
+last sequence id it saw; a run nobody is watching is stopped after
+``agent_detach_grace_seconds``.
+
+Messages sent while a turn is running wait in a bounded per-session FIFO and
+run in order; ``queued`` events report their position. Every turn's events
+start with ``turn_started`` and end with a ``done`` carrying its ``turn_id``.
+
+Passive viewers (other tabs, collaborators) follow the session through its
+Broadcaster instead, which also reports edits made outside agent runs.
 """
 
 from __future__ import annotations
 
 import asyncio
 import uuid
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Literal, Optional
-
+from typing import Awaitable, Callable, Literal, Optional
+
+from app.core import metrics
+from app.core.config import get_settings
+from app.services.agent.events import EventBuffer
+from app.services.agent.pubsub import Broadcaster
+from app.services.agent.translator import make_document_patch
+from app.services.agent.usage import TokenUsage
 from app.services.workspace.workspace import Workspace
 
+_settings = get_settings()
+
 SessionStatus = Literal["idle", "running", "stopped", "done", "failed"]
 
 
+class MessageQueueFull(Exception):
+    """Raised by AgentSession.submit when no more turns may wait."""
+
+
+@dataclass
+class PendingTurn:
+    """A submitted agent turn; ``run`` executes it and publishes its events."""
+
+    turn_id: str
+    run: Callable[[], Awaitable[None]]
+
+
+def _new_event_buffer() -> EventBuffer:
+    return EventBuffer(maxlen=_settings.agent_event_buffer_size)
+
+
+def _new_broadcaster() -> Broadcaster:
+    return Broadcaster(queue_size=_settings.agent_subscriber_queue_size)
+
+
 @dataclass
 class AgentSession:
     session_id: str
@@ -23,9 +65,32 @@ class AgentSession:
     status: SessionStatus = "idle"
     message_history: list = field(default_factory=list)
     # Cancellation signal shared with the running AgentService. Set by
-    # `stop()` so the agent loop can terminate cooperatively instead of
-    # running to completion in the background.
+    # `stop()` (or when a detached run outlives its grace period); the service
+    # then cancels its run task, aborting the in-flight model request.
     stop_event: asyncio.Event = field(default_factory=asyncio.Event)
+    # Every event of every run, with sequence ids for resuming streams.
+    events: EventBuffer = field(default_factory=_new_event_buffer)
+    run_task: Optional[asyncio.Task] = None
+    # Open event streams; when this drops to 0 during a run, the grace timer starts.
+    subscribers: int = 0
+    _reaper: Optional[asyncio.Task] = field(default=None, repr=False)
+    # Live fan-out to subscribe-only viewers.
+    broadcaster: Broadcaster = field(default_factory=_new_broadcaster)
+    # Turns submitted while another one runs, in arrival order.
+    pending: deque = field(default_factory=deque)
+    # Tokens used by all finished turns, and how many turns have run.
+    usage: TokenUsage = field(default_factory=TokenUsage)
+    turns: int = 0
+
+    def __post_init__(self) -> None:
+        # Every commit reaches viewers as a patch, whoever made the edit; run
+        # events carry their own patches, so publish() skips those.
+        self.workspace.add_change_listener(self._broadcast_change)
+
+    def _broadcast_change(self, version: int) -> None:
+        self.broadcaster.publish(
+            make_document_patch(version, "document edited", self.workspace.last_edit_ranges)
+        )
 
     @classmethod
     def create(cls, document: str = "", title: str = "Untitled") -> "AgentSession":
@@ -34,9 +99,110 @@ class AgentSession:
             workspace=Workspace(content=document, title=title),
         )
 
+    def publish(self, event: dict) -> int:
+        """Record a run event for resumable streams and push it to viewers."""
+        seq = self.events.append(event)
+        if event.get("type") != "document_patch":
+            self.broadcaster.publish(event)
+        return seq
+
+    def is_running(self) -> bool:
+        return self.status == "running"
+
+    def record_usage(self, usage: TokenUsage) -> None:
+        """Add one finished turn's token usage to the session totals."""
+        self.usage.add(usage)
+        self.turns += 1
+
+    def token_budget_remaining(self) -> Optional[int]:
+        """Tokens left under ``agent_session_token_budget``; None when unlimited."""
+        budget = _settings.agent_session_token_budget
+        if budget <= 0:
+            return None
+        return max(0, budget - self.usage.total_tokens)
+
     def stop(self) -> None:
-        """Signal the running agent (if any) to cancel as soon as possible."""
+        """Signal the running agent (if any) to cancel as soon as possible.
+
+        Queued turns are dropped too: each reports ``stopped`` and ``done``.
+        """
         self.stop_event.set()
+        while self.pending:
+            turn = self.pending.popleft()
+            self.publish({"type": "stopped", "content": "", "turn_id": turn.turn_id})
+            self.publish({"type": "done", "content": "", "turn_id": turn.turn_id})
+
+    def submit(self, turn: PendingTurn) -> int:
+        """Start ``turn`` now or queue it behind the running one.
+
+        Returns its queue position (0 = started immediately). Raises
+        MessageQueueFull when ``agent_max_queued_messages`` turns already wait.
+        """
+        if not self.is_running():
+            self.status = "running"
+            # The stop flag belongs to this turn from here on, so a /stop that
+            # lands before its task gets to run still stops it.
+            self.stop_event.clear()
+            self.run_task = asyncio.create_task(self._run_turns(turn))
+            return 0
+        if len(self.pending) >= _settings.agent_max_queued_messages:
+            raise MessageQueueFull(f"{len(self.pending)} messages already queued")
+        self.pending.append(turn)
+        position = len(self.pending)
+        self.publish({"type": "queued", "turn_id": turn.turn_id, "position": position})
+        return position
+
+    async def _run_turns(self, turn: Optional[PendingTurn]) -> None:
+        """Session runner: execute ``turn``, then queued turns in order."""
+        try:
+            while turn is not None:
+                self.status = "running"
+                self.publish({"type": "turn_started", "turn_id": turn.turn_id})
+                await turn.run()
+                turn = self.pending.popleft() if self.pending else None
+                if turn is not None:
+                    # Dequeued after any earlier /stop, which emptied the queue
+                    # when it came; a /stop from now on applies to this turn.
+                    self.stop_event.clear()
+                for position, waiting in enumerate(self.pending, start=1):
+                    self.publish(
+                        {"type": "queued", "turn_id": waiting.turn_id, "position": position}
+                    )
+        except asyncio.CancelledError:
+            self.stop()
+            raise
+
+    def attach(self) -> Callable[[], None]:
+        """Register an event stream reader; returns an idempotent detach callback."""
+        self.subscribers += 1
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        detached = False
+
+        def detach() -> None:
+            nonlocal detached
+            if detached:
+                return
+            detached = True
+            self.subscribers -= 1
+            if self.subscribers == 0 and self.is_running():
+                self._schedule_orphan_stop()
+
+        return detach
+
+    def _schedule_orphan_stop(self) -> None:
+        grace = _settings.agent_detach_grace_seconds
+        if grace <= 0:
+            self.stop()
+            return
+
+        async def reap() -> None:
+            await asyncio.sleep(grace)
+            if self.subscribers == 0 and self.is_running():
+                self.stop()
+
+        self._reaper = asyncio.create_task(reap())
 
 
 class SessionManager:
@@ -54,7 +220,11 @@ class SessionManager:
         return self._sessions.get(session_id)
 
     def delete(self, session_id: str) -> None:
-        self._sessions.pop(session_id, None)
+        sess = self._sessions.pop(session_id, None)
+        if sess is not None:
+            # A deleted session's run has no one left to report to.
+            sess.stop()
+            sess.broadcaster.close()
 
 
 # Module-level singleton (in-memory, per process)
@@ -63,3 +233,22 @@ _sessions = SessionManager()
 
 def get_session_manager() -> SessionManager:
     return _sessions
+
+
+def _session_counts() -> dict[tuple[str, ...], float]:
+    counts: dict[tuple[str, ...], float] = {}
+    for sess in list(_sessions._sessions.values()):
+        counts[(sess.status,)] = counts.get((sess.status,), 0) + 1
+    return counts
+
+
+def _sum_over_sessions(value: Callable[[AgentSession], int]) -> Callable[[], dict]:
+    return lambda: {(): sum(value(s) for s in list(_sessions._sessions.values()))}
+
+
+metrics.SESSIONS.set_function(_session_counts)
+metrics.SESSION_QUEUED_TURNS.set_function(_sum_over_sessions(lambda s: len(s.pending)))
+metrics.WORKSPACE_BYTES.set_function(_sum_over_sessions(lambda s: s.workspace.memory_bytes()))
+metrics.SESSION_TOKENS.set_function(_sum_over_sessions(lambda s: s.usage.total_tokens))
+metrics.HISTORY_MESSAGES.set_function(_sum_over_sessions(lambda s: len(s.message_history)))
+metrics.EVENT_BUFFER_EVENTS.set_function(_sum_over_sessions(lambda s: len(s.events)))
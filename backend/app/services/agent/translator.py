@@ -21,6 +21,7 @@ WRITE_TOOLS: frozenset[str] = frozenset(
     {
         "insert_text",
         "replace_section",
+        "replace_snippet",
         "replace_range",
         "delete_range",
         "find_replace",
@@ -30,9 +31,24 @@ WRITE_TOOLS: frozenset[str] = frozenset(
 )
 
 
-def make_document_patch(version: int, summary: str) -> dict:
-    """Construct a document_patch SSE event."""
-    return {"type": "document_patch", "version": version, "summary": summary}
+# Prefix AgentService puts on tool results that failed inside the tool body.
+# Such results still have outcome == "success" from PydanticAI's point of view
+# (the tool returned normally), so the translator checks for it explicitly.
+TOOL_ERROR_PREFIX = "[tool error]"
+
+
+def make_document_patch(
+    version: int, summary: str, ranges: list[tuple[int, int]] | None = None
+) -> dict:
+    """Construct a document_patch SSE event.
+
+    ``ranges`` (when known) lists the [start, end) char ranges the edit wrote
+    in the new version, so clients can highlight or sync just those spans.
+    """
+    patch: dict = {"type": "document_patch", "version": version, "summary": summary}
+    if ranges is not None:
+        patch["ranges"] = [list(r) for r in ranges]
+    return patch
 
 
 def make_thought_delta(text: str) -> dict:
@@ -40,6 +56,25 @@ def make_thought_delta(text: str) -> dict:
     return {"type": "thought", "content": text}
 
 
+def make_section_progress(
+    index: int, total: int, heading: str | None, status: str, error: str | None = None
+) -> dict:
+    """Construct a fan-out progress event for one document part.
+
+    ``status`` is one of running | done | unchanged | failed.
+    """
+    evt = {
+        "type": "section_progress",
+        "index": index,
+        "total": total,
+        "heading": heading,
+        "status": status,
+    }
+    if error is not None:
+        evt["error"] = error
+    return evt
+
+
 def make_tool_call(name: str, args: Any) -> dict:
     return {"type": "tool_call", "name": name, "args": args or {}}
 
@@ -82,6 +117,8 @@ def translate_event(event: Any) -> dict | None:
             ok = not (text.lower().startswith("error") or "not found" in text.lower())
         content = getattr(event, "content", "") or getattr(part, "content", "") or ""
         summary = content if isinstance(content, str) else str(content)
+        if summary.startswith(TOOL_ERROR_PREFIX):
+            ok = False
         return make_tool_result(name, bool(ok), summary)
 
     if kind == "PartStartEvent":
@@ -0,0 +1,33 @@
+"""Token accounting for agent runs and sessions."""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, fields
+from typing import Any
+
+
+@dataclass
+class TokenUsage:
+    """Model requests and token counts as reported by the provider."""
+
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    @classmethod
+    def from_run_usage(cls, usage: Any) -> "TokenUsage":
+        """Convert a PydanticAI ``RunUsage`` (read by attribute, missing ones count 0)."""
+        return cls(**{f.name: getattr(usage, f.name, 0) or 0 for f in fields(cls)})
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: "TokenUsage") -> None:
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "total_tokens": self.total_tokens}
@@ -1,47 +1,161 @@
 """SSE (Server-Sent Events) streaming service."""
+import asyncio
 import json
+from contextlib import aclosing
 from typing import AsyncGenerator
 
-from app.schemas.ai import ChatChunk
+from app.core.config import get_settings
+
+try:  # a declared dependency; the stdlib fallback covers platforms without a wheel
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is absent
+    orjson = None
+
+_settings = get_settings()
+
+# Relay markers: end of the source, and an exception raised by it.
+_END = object()
+
+# SSE comment line; ignored by clients but keeps proxies from timing out.
+HEARTBEAT_FRAME = ": ping\n\n"
+
+
+class _Failed:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+def dumps_json(data: dict) -> str:
+    """Serialize ``data`` compactly as UTF-8 JSON text (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _chat_chunk(type_: str, content: str = "", error: str | None = None) -> dict:
+    # Same shape as ChatChunk.model_dump(), without building a model per token.
+    return {"type": type_, "content": content, "error": error}
+
+
+async def _relay(
+    source: AsyncGenerator, window: float = 0.0
+) -> AsyncGenerator[list | None, None]:
+    """Decouple ``source`` from the HTTP writer through a bounded queue.
+
+    A producer task reads ``source`` into a queue of ``sse_stream_queue_size``
+    items and blocks when it is full, so a slow client holds at most that
+    much per stream. Yields every item available at once as a list (a lagging
+    writer gets bigger batches to coalesce), or None after
+    ``sse_heartbeat_interval`` seconds without items. With ``window`` > 0 the
+    writer waits that long after the first item to gather more. Re-raises an
+    exception from ``source`` after the items produced before it.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, _settings.sse_stream_queue_size))
+    heartbeat = _settings.sse_heartbeat_interval or None
+
+    async def pump() -> None:
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:  # noqa: BLE001 — re-raised in the writer
+            await queue.put(_Failed(e))
+        else:
+            await queue.put(_END)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if window > 0 and item is not _END and not isinstance(item, _Failed):
+                await asyncio.sleep(window)
+            batch = [item]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            for i, item in enumerate(batch):
+                if item is _END or isinstance(item, _Failed):
+                    if i:
+                        yield batch[:i]
+                    if item is _END:
+                        return
+                    raise item.error
+            yield batch
+    finally:
+        task.cancel()
+
+
+def _merge_thoughts(batch: list[tuple]) -> list[tuple]:
+    """Join consecutive ``thought`` deltas of ``(seq, event)`` pairs.
+
+    The merged event keeps the last seq, so resuming after it is exact.
+    """
+    out: list[tuple] = []
+    for seq, event in batch:
+        if event.get("type") == "thought" and out and out[-1][1].get("type") == "thought":
+            prev = out[-1][1]
+            out[-1] = (seq, {**prev, "content": prev["content"] + event["content"]})
+        else:
+            out.append((seq, event))
+    return out
 
 
 async def create_sse_stream(
     content_generator: AsyncGenerator[str, None],
+    coalesce_window: float | None = None,
 ) -> AsyncGenerator[str, None]:
     """Create SSE stream from content generator.
 
+    Chunks that arrive while the previous frame is being written, or within
+    ``coalesce_window`` seconds after a chunk (default
+    ``sse_coalesce_window_ms``), are joined into a single content frame, so a
+    fast token stream becomes fewer, larger writes. 0 only merges chunks
+    that are already waiting. Idle periods (e.g. a reasoning model thinking)
+    are filled with heartbeat comments.
+
     Args:
         content_generator: Async generator yielding content chunks
+        coalesce_window: Seconds to gather chunks into one frame
 
     Yields:
         SSE formatted strings
     """
+    if coalesce_window is None:
+        coalesce_window = _settings.sse_coalesce_window_ms / 1000
     try:
-        async for content in content_generator:
-            # Send content chunk
-            chunk = ChatChunk(type="content", content=content)
-            yield format_sse_chunk(chunk.model_dump())
+        async with aclosing(_relay(content_generator, window=coalesce_window)) as batches:
+            async for batch in batches:
+                if batch is None:
+                    yield HEARTBEAT_FRAME
+                else:
+                    # Send content chunk
+                    yield format_sse_chunk(_chat_chunk("content", "".join(batch)))
 
         # Send done signal
-        done_chunk = ChatChunk(type="done", content="")
-        yield format_sse_chunk(done_chunk.model_dump())
+        yield format_sse_chunk(_chat_chunk("done"))
 
     except Exception as e:
         # Send error chunk
-        error_chunk = ChatChunk(type="error", content="", error=str(e))
-        yield format_sse_chunk(error_chunk.model_dump())
+        yield format_sse_chunk(_chat_chunk("error", error=str(e)))
 
 
-def format_sse_chunk(data: dict) -> str:
+def format_sse_chunk(data: dict, event_id: int | None = None) -> str:
     """Format data as SSE chunk.
 
     Args:
         data: Data to send as JSON
+        event_id: Optional SSE ``id:`` field, echoed back by reconnecting
+            clients in the ``Last-Event-ID`` header
 
     Returns:
         SSE formatted string
     """
-    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    payload = f"data: {dumps_json(data)}\n\n"
+    if event_id is None:
+        return payload
+    return f"id: {event_id}\n{payload}"
 
 
 async def aiter_chunks(content: str, chunk_size: int = 10) -> AsyncGenerator[str, None]:
@@ -65,14 +179,41 @@ async def create_agent_sse_stream(
 
     Unlike create_sse_stream (which wraps strings into ChatChunk), this yields
     each dict as-is: data: {json}\n\n. Always emits a terminal 'done' if the
-    generator didn't already.
+    generator didn't already. Sends heartbeats while idle and merges thought
+    deltas that queued up behind a slow client.
+    """
+
+    async def pairs():
+        async for event in event_generator:
+            yield None, event
+
+    async with aclosing(create_sequenced_sse_stream(pairs())) as frames:
+        async for frame in frames:
+            yield frame
+
+
+async def create_sequenced_sse_stream(
+    event_generator: AsyncGenerator[tuple[int | None, dict], None],
+) -> AsyncGenerator[str, None]:
+    """SSE stream for ``(seq, event)`` pairs read from an EventBuffer.
+
+    Same contract as create_agent_sse_stream, but every frame carries its
+    sequence id so a client can resume with ``Last-Event-ID`` / ``?after=``.
     """
     saw_done = False
     try:
-        async for event in event_generator:
-            yield format_sse_chunk(event)
-            if event.get("type") == "done":
-                saw_done = True
+        async with aclosing(_relay(event_generator)) as batches:
+            async for batch in batches:
+                if batch is None:
+                    yield HEARTBEAT_FRAME
+                    continue
+                frames = []
+                for seq, event in _merge_thoughts(batch):
+                    frames.append(format_sse_chunk(event, event_id=seq))
+                    if event.get("type") == "done":
+                        saw_done = True
+                # One write for everything the client was behind on.
+                yield "".join(frames)
     except Exception as e:  # noqa: BLE001
         yield format_sse_chunk({"type": "error", "error": str(e)})
     if not saw_done:
@@ -1,11 +1,29 @@
 """Document outline parsing — heading tree with line/char ranges."""
 from __future__ import annotations
 
+import difflib
 import re
+import unicodedata
 from dataclasses import dataclass
 
 _HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*$", re.MULTILINE)
 
+# Pieces stripped when comparing headings loosely (see normalize_heading).
+_LEADING_MARKS_RE = re.compile(r"^\s*#{1,6}\s*")
+_TRAILING_MARKS_RE = re.compile(r"\s+#+\s*$")
+_INLINE_MARKUP_RE = re.compile(r"[*_`~]+")
+_NUMBER_RE = re.compile(r"\d+")
+_TRAILING_PUNCT = ".,:;!?。，、：；！？…"
+
+# A fuzzy (non-normalized-equal) match is accepted only above this ratio,
+# only if it beats the runner-up and only if both headings contain the same
+# numbers ("Week 1" must not resolve to "Week 2"); other candidates are
+# offered as suggestions.
+_FUZZY_ACCEPT = 0.8
+_FUZZY_SUGGEST = 0.5
+_MAX_SUGGESTIONS = 3
+_MAX_LISTED_HEADINGS = 10
+
 
 @dataclass
 class OutlineSection:
@@ -60,3 +78,103 @@ def parse_outline(document: str) -> list[OutlineSection]:
             )
         )
     return sections
+
+
+def top_level_chunks(
+    document: str, sections: list[OutlineSection]
+) -> list[tuple[int, int, str | None]]:
+    """Partition ``document`` into contiguous ``(char_start, char_end, heading)`` chunks.
+
+    Chunks are the sections at the shallowest heading level present, plus a
+    leading preamble chunk (heading ``None``) when text precedes the first
+    such heading. When that level has a single section with subsections (one
+    ``# Title`` over ``##`` sections, the common shape), the split moves one
+    level deeper: the title and its intro become a chunk of their own and the
+    subsections are chunked the same way. Together the chunks cover the whole
+    document with no overlap.
+    """
+    if not sections:
+        return [(0, len(document), None)] if document else []
+    chunks: list[tuple[int, int, str | None]] = []
+    # Text from ``lo`` up to the first chunk found in ``scope`` is headed ``lead``.
+    lo, lead, scope = 0, None, sections
+    while True:
+        top = min(s.level for s in scope)
+        tops = [s for s in scope if s.level == top]
+        first = tops[0]
+        if first.char_start > lo:
+            chunks.append((lo, first.char_start, lead))
+        children = [s for s in scope if s.level > top and s.char_start > first.char_start]
+        if len(tops) > 1 or not children:
+            chunks.extend((s.char_start, s.char_end, s.heading) for s in tops)
+            return chunks
+        lo, lead, scope = first.char_start, first.heading, children
+
+
+def normalize_heading(text: str) -> str:
+    """Canonical form of a heading for loose comparison.
+
+    Folds full-width characters to half-width (NFKC), drops leading/closing
+    ``#`` marks and inline emphasis/code markup, trims trailing punctuation,
+    collapses whitespace and case-folds. ``"## 下周计划："`` and ``"下周计划"``
+    normalize to the same string.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _LEADING_MARKS_RE.sub("", text)
+    text = _TRAILING_MARKS_RE.sub("", text)
+    text = _INLINE_MARKUP_RE.sub("", text)
+    text = " ".join(text.split())
+    text = text.rstrip(_TRAILING_PUNCT + " ")
+    return text.casefold()
+
+
+def resolve_heading(sections: list[OutlineSection], heading: str) -> OutlineSection:
+    """Find the section a (possibly sloppy) heading argument refers to.
+
+    Resolution order: exact text match (first wins, as before), then a unique
+    match after :func:`normalize_heading`, then a unique clearly-best fuzzy
+    match with the same numbers in it. Otherwise raise ValueError naming the closest candidates (or the
+    available headings) so the caller can retry without re-reading the outline.
+    """
+    for s in sections:
+        if s.heading == heading:
+            return s
+
+    wanted = normalize_heading(heading)
+    normalized = [normalize_heading(s.heading) for s in sections]
+    equal = [s for s, n in zip(sections, normalized) if n == wanted]
+    if len(equal) == 1:
+        return equal[0]
+    if len(equal) > 1:
+        lines = ", ".join(f"{s.heading!r} (line {s.line_start})" for s in equal)
+        raise ValueError(f"heading ambiguous: {heading!r} matches {lines}")
+
+    scored = sorted(
+        (
+            (difflib.SequenceMatcher(None, wanted, n).ratio(), i)
+            for i, n in enumerate(normalized)
+        ),
+        reverse=True,
+    )
+    if scored:
+        best_ratio, best_i = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if (
+            best_ratio >= _FUZZY_ACCEPT
+            and best_ratio > runner_up
+            and _NUMBER_RE.findall(normalized[best_i]) == _NUMBER_RE.findall(wanted)
+        ):
+            return sections[best_i]
+
+    suggestions = [
+        sections[i].heading for ratio, i in scored[:_MAX_SUGGESTIONS] if ratio >= _FUZZY_SUGGEST
+    ]
+    if suggestions:
+        hint = "did you mean: " + ", ".join(repr(h) for h in suggestions)
+    elif sections:
+        listed = [s.heading for s in sections[:_MAX_LISTED_HEADINGS]]
+        more = " …" if len(sections) > _MAX_LISTED_HEADINGS else ""
+        hint = "available headings: " + ", ".join(repr(h) for h in listed) + more
+    else:
+        hint = "the document has no headings"
+    raise ValueError(f"heading not found: {heading!r}; {hint}")
@@ -0,0 +1,100 @@
+"""Document text search — per-version index of line and section boundaries.
+
+An index is built once per document version (Workspace caches it until the
+content changes) and answers "where is X" queries with small, self-describing
+hits: offset, line number, enclosing heading and a one-line snippet.
+
+The match scan itself uses ``str.find`` / a compiled regex: CPython's fast
+substring search over the flat string outperforms a Python-level n-gram
+postings index and needs no extra memory. What the index saves is the per-hit
+work — line numbers and enclosing headings are binary searches instead of
+re-counting newlines and re-parsing the outline for every query.
+"""
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from app.services.workspace.outline import OutlineSection
+
+_SNIPPET_CONTEXT = 40
+
+
+@dataclass
+class SearchHit:
+    """One match: char offset, 0-indexed line, innermost heading, snippet."""
+
+    offset: int
+    line: int
+    heading: str | None
+    snippet: str
+
+
+class DocumentIndex:
+    """Search structures for one immutable document version."""
+
+    def __init__(self, content: str, sections: list[OutlineSection]) -> None:
+        self.content = content
+        self._line_starts = [0]
+        pos = content.find("\n")
+        while pos != -1:
+            self._line_starts.append(pos + 1)
+            pos = content.find("\n", pos + 1)
+        self._sections = sections
+        self._section_starts = [s.char_start for s in sections]
+
+    def line_of(self, offset: int) -> int:
+        return bisect_right(self._line_starts, offset) - 1
+
+    def heading_at(self, offset: int) -> str | None:
+        """Heading of the innermost section containing ``offset``.
+
+        The nearest heading at or before ``offset`` always governs it: its
+        section only ends at a later heading of the same or higher level.
+        """
+        i = bisect_right(self._section_starts, offset) - 1
+        return self._sections[i].heading if i >= 0 else None
+
+    def _snippet(self, start: int, end: int) -> str:
+        lo = max(0, start - _SNIPPET_CONTEXT)
+        hi = min(len(self.content), end + _SNIPPET_CONTEXT)
+        text = self.content[lo:hi].replace("\n", " ")
+        return ("…" if lo > 0 else "") + text + ("…" if hi < len(self.content) else "")
+
+    def _spans(self, query: str, regex: bool, case_sensitive: bool):
+        if not regex and case_sensitive:
+            pos = self.content.find(query)
+            while pos != -1:
+                yield pos, pos + len(query)
+                pos = self.content.find(query, pos + len(query))
+            return
+        flags = 0 if case_sensitive else re.IGNORECASE
+        try:
+            pattern = re.compile(query if regex else re.escape(query), flags)
+        except re.error as e:
+            raise ValueError(f"invalid regex {query!r}: {e}") from e
+        for m in pattern.finditer(self.content):
+            if m.end() > m.start():  # skip empty matches
+                yield m.start(), m.end()
+
+    def search(
+        self, query: str, regex: bool = False, max_hits: int = 20, case_sensitive: bool = False
+    ) -> tuple[list[SearchHit], int]:
+        """Return up to ``max_hits`` hits plus the total number of matches."""
+        if not query:
+            raise ValueError("query must be non-empty")
+        hits: list[SearchHit] = []
+        total = 0
+        for start, end in self._spans(query, regex, case_sensitive):
+            total += 1
+            if len(hits) < max_hits:
+                hits.append(
+                    SearchHit(
+                        offset=start,
+                        line=self.line_of(start),
+                        heading=self.heading_at(start),
+                        snippet=self._snippet(start, end),
+                    )
+                )
+        return hits, total
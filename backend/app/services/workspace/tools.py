@@ -3,14 +3,24 @@
 Each function takes the current content and returns new content plus the
 affected character range. They raise ValueError on invalid arguments so
 callers (Workspace) can convert to tool-error results.
+
+Heading arguments are resolved loosely via ``resolve_heading``. Functions that
+need the outline accept an optional pre-parsed ``sections`` list so callers
+holding a cached outline (Workspace) skip re-parsing the document.
 """
 from __future__ import annotations
 
-from app.services.workspace.outline import parse_outline
+import re
+from functools import lru_cache
+
+from app.services.workspace.outline import OutlineSection, parse_outline, resolve_heading
 
 
 def get_section(
-    content: str, heading: str | None = None, line_range: tuple[int, int] | None = None
+    content: str,
+    heading: str | None = None,
+    line_range: tuple[int, int] | None = None,
+    sections: list[OutlineSection] | None = None,
 ) -> str:
     """Read a section by heading name or [start,end) line range (0-indexed)."""
     if line_range is not None:
@@ -23,11 +33,30 @@ def get_section(
         return "".join(lines[start:end])
     if heading is None:
         raise ValueError("either heading or line_range is required")
-    sections = parse_outline(content)
-    for s in sections:
-        if s.heading == heading:
-            return content[s.char_start:s.char_end]
-    raise ValueError(f"heading not found: {heading!r}")
+    if sections is None:
+        sections = parse_outline(content)
+    s = resolve_heading(sections, heading)
+    return content[s.char_start:s.char_end]
+
+
+def page_text(text: str, offset: int = 0, limit: int | None = None) -> tuple[str, int | None]:
+    """Return ``(chunk, next_offset)`` for a window of at most ``limit`` chars.
+
+    ``next_offset`` is None once the window reaches the end of ``text``. When
+    the window is cut short it ends after the last newline inside it (if that
+    keeps at least half the window), so pages don't split lines.
+    """
+    if offset < 0 or offset > len(text):
+        raise ValueError(f"offset out of bounds: {offset}, len={len(text)}")
+    if limit is None or offset + limit >= len(text):
+        return text[offset:], None
+    if limit < 1:
+        raise ValueError(f"limit must be >= 1, got {limit}")
+    end = offset + limit
+    newline = text.rfind("\n", offset, end)
+    if newline >= offset + limit // 2:
+        end = newline + 1
+    return text[offset:end], end
 
 
 def insert_text(
@@ -35,6 +64,7 @@ def insert_text(
     text: str,
     position: int | None = None,
     after_heading: str | None = None,
+    sections: list[OutlineSection] | None = None,
 ) -> tuple[str, int, int]:
     """Insert text; return (new_content, start, end) of inserted range."""
     if position is None and after_heading is None:
@@ -45,13 +75,11 @@ def insert_text(
         new = content[:position] + text + content[position:]
         return new, position, position + len(text)
     # after_heading path
-    sections = parse_outline(content)
-    for s in sections:
-        if s.heading == after_heading:
-            insert_at = s.char_end
-            new = content[:insert_at] + text + content[insert_at:]
-            return new, insert_at, insert_at + len(text)
-    raise ValueError(f"heading not found: {after_heading!r}")
+    if sections is None:
+        sections = parse_outline(content)
+    insert_at = resolve_heading(sections, after_heading).char_end
+    new = content[:insert_at] + text + content[insert_at:]
+    return new, insert_at, insert_at + len(text)
 
 
 def replace_range(content: str, start: int, end: int, text: str) -> tuple[str, int, int]:
@@ -62,6 +90,32 @@ def replace_range(content: str, start: int, end: int, text: str) -> tuple[str, i
     return new, start, start + len(text)
 
 
+def apply_edits(
+    content: str, edits: list[tuple[int, int, str]]
+) -> tuple[str, list[tuple[int, int]]]:
+    """Apply non-overlapping ``(start, end, text)`` splices in one pass.
+
+    Offsets refer to ``content``; edits may come in any order. Returns
+    (new_content, ranges) where ranges are the written spans in the NEW
+    content, in document order.
+    """
+    pieces: list[str] = []
+    ranges: list[tuple[int, int]] = []
+    last = 0
+    length = 0
+    for start, end, text in sorted(edits, key=lambda e: (e[0], e[1])):
+        if start < last or end > len(content) or start > end:
+            raise ValueError(f"edit range out of bounds or overlapping: [{start},{end})")
+        pieces.append(content[last:start])
+        length += start - last
+        pieces.append(text)
+        ranges.append((length, length + len(text)))
+        length += len(text)
+        last = end
+    pieces.append(content[last:])
+    return "".join(pieces), ranges
+
+
 def delete_range(content: str, start: int, end: int) -> tuple[str, int, int]:
     """Delete content[start:end]."""
     if start < 0 or end > len(content) or start > end:
@@ -70,25 +124,140 @@ def delete_range(content: str, start: int, end: int) -> tuple[str, int, int]:
     return new, start, start
 
 
+@lru_cache(maxsize=128)
+def compile_pattern(
+    pattern: str, regex: bool = False, whole_word: bool = False, ignore_case: bool = False
+) -> re.Pattern[str]:
+    """Compile a find pattern, memoized so repeated tool calls skip re.compile.
+
+    Literal patterns are escaped. ``whole_word`` uses lookarounds rather than
+    ``\\b`` so it also works for patterns that start or end with punctuation.
+    """
+    source = pattern if regex else re.escape(pattern)
+    if whole_word:
+        source = rf"(?<!\w)(?:{source})(?!\w)"
+    try:
+        return re.compile(source, re.IGNORECASE if ignore_case else 0)
+    except re.error as e:
+        raise ValueError(f"invalid regex {pattern!r}: {e}") from e
+
+
 def find_replace(
-    content: str, pattern: str, replacement: str, count: int = 0
-) -> tuple[str, int]:
-    """Replace occurrences of pattern. count=0 means all. Return (new, num_replaced)."""
+    content: str,
+    pattern: str,
+    replacement: str,
+    count: int = 0,
+    regex: bool = False,
+    whole_word: bool = False,
+    ignore_case: bool = False,
+    heading: str | None = None,
+    char_range: tuple[int, int] | None = None,
+    sections: list[OutlineSection] | None = None,
+) -> tuple[str, list[tuple[int, int]]]:
+    """Replace occurrences of pattern in one pass. count=0 means all.
+
+    The search can be limited to `heading`'s section or to `char_range`
+    ([start, end) chars). In regex mode `replacement` may use group references
+    (``\\1``, ``\\g<name>``). Returns (new_content, spans) where spans are the
+    replaced ranges in the NEW content, in document order.
+    """
     if not pattern:
         raise ValueError("pattern must be non-empty")
-    if count == 0:
-        return content.replace(pattern, replacement), content.count(pattern)
-    return content.replace(pattern, replacement, count), min(count, content.count(pattern))
+    lo, hi = 0, len(content)
+    if heading is not None:
+        if sections is None:
+            sections = parse_outline(content)
+        s = resolve_heading(sections, heading)
+        lo, hi = s.char_start, s.char_end
+    if char_range is not None:
+        start, end = char_range
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"char_range out of bounds: {char_range}, scope is [{lo},{hi}]")
+        lo, hi = start, end
+
+    compiled = compile_pattern(pattern, regex, whole_word, ignore_case)
+    pieces: list[str] = []
+    spans: list[tuple[int, int]] = []
+    last = lo
+    shift = 0
+    for m in compiled.finditer(content, lo, hi):
+        if m.start() == m.end():  # a regex that can match empty would loop on every char
+            continue
+        try:
+            rep = m.expand(replacement) if regex else replacement
+        except (re.error, IndexError) as e:
+            raise ValueError(f"invalid replacement {replacement!r}: {e}") from e
+        pieces.append(content[last : m.start()])
+        pieces.append(rep)
+        new_start = m.start() + shift
+        spans.append((new_start, new_start + len(rep)))
+        shift += len(rep) - (m.end() - m.start())
+        last = m.end()
+        if count and len(spans) == count:
+            break
+    if not spans:
+        return content, []
+    return content[:lo] + "".join(pieces) + content[last:], spans
 
 
-def replace_section(content: str, heading: str, text: str) -> tuple[str, int, int]:
+def replace_section(
+    content: str, heading: str, text: str, sections: list[OutlineSection] | None = None
+) -> tuple[str, int, int]:
     """Replace the section governed by `heading` with `text`."""
-    sections = parse_outline(content)
-    for s in sections:
-        if s.heading == heading:
-            new = content[: s.char_start] + text + content[s.char_end :]
-            return new, s.char_start, s.char_start + len(text)
-    raise ValueError(f"heading not found: {heading!r}")
+    if sections is None:
+        sections = parse_outline(content)
+    s = resolve_heading(sections, heading)
+    new = content[: s.char_start] + text + content[s.char_end :]
+    return new, s.char_start, s.char_start + len(text)
+
+
+def replace_snippet(
+    content: str,
+    old: str,
+    new: str,
+    occurrence: int | None = None,
+    heading: str | None = None,
+    sections: list[OutlineSection] | None = None,
+) -> tuple[str, int, int]:
+    """Replace one exact occurrence of `old` with `new`.
+
+    The search is limited to the section governed by `heading` when given.
+    Without `occurrence`, `old` must occur exactly once in that scope;
+    otherwise `occurrence` (1-based, non-overlapping) picks which one.
+    """
+    if not old:
+        raise ValueError("snippet must be non-empty")
+    lo, hi = 0, len(content)
+    if heading is not None:
+        if sections is None:
+            sections = parse_outline(content)
+        s = resolve_heading(sections, heading)
+        lo, hi = s.char_start, s.char_end
+    scope = f" in section {heading!r}" if heading is not None else ""
+
+    if occurrence is None:
+        start = content.find(old, lo, hi)
+        if start == -1:
+            raise ValueError(f"snippet not found{scope}: {old[:80]!r}")
+        if content.find(old, start + len(old), hi) != -1:
+            total = content.count(old, lo, hi)
+            raise ValueError(
+                f"snippet occurs {total} times{scope}; pass occurrence=1..{total} "
+                "or quote more surrounding text"
+            )
+    else:
+        if occurrence < 1:
+            raise ValueError(f"occurrence must be >= 1, got {occurrence}")
+        start = lo - len(old)
+        for _ in range(occurrence):
+            start = content.find(old, start + len(old), hi)
+            if start == -1:
+                total = content.count(old, lo, hi)
+                raise ValueError(
+                    f"occurrence {occurrence} out of range: snippet occurs {total} times{scope}"
+                )
+    end = start + len(old)
+    return content[:start] + new + content[end:], start, start + len(new)
 
 
 def replace_document(content: str, text: str) -> tuple[str, int, int]:
@@ -0,0 +1,61 @@
+"""Fake PydanticAI agent pieces for driving the real AgentService run loop.
+
+The service dispatches on event class names and reads plain attributes, so
+these stand-ins only need the right names and fields.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+
+class FakePart:
+    """Attribute bag standing in for parts, deltas, results and usages."""
+
+    def __init__(self, **kw: Any) -> None:
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+
+class FakeEvent:
+    """Stand-in for a PydanticAI AgentStreamEvent. Subclass and name it to
+    match the kind the translator dispatches on."""
+
+    def __init__(self, part=None, delta=None, result=None, index=0) -> None:
+        self.part = part
+        self.delta = delta
+        self.result = result
+        self.index = index
+
+
+def event(kind: str, **kw: Any) -> FakeEvent:
+    """Create a FakeEvent whose class name equals `kind`."""
+    cls = type(kind, (FakeEvent,), {})
+    return cls(**kw)
+
+
+class FakeEventStream:
+    """Async context manager + async iterator mimicking agent.run_stream_events."""
+
+    def __init__(self, events: list) -> None:
+        self._events = events
+
+    async def __aenter__(self):
+        return self._iter()
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+    async def _iter(self):
+        for e in self._events:
+            yield e
+
+
+class FakeAgent:
+    """Captures the call and returns the scripted event stream."""
+
+    def __init__(self, events: list) -> None:
+        self._events = events
+
+    def run_stream_events(self, message, **kw):  # sync: returns an async ctx mgr
+        return FakeEventStream(self._events)
@@ -1 +1,46 @@
 """Shared pytest fixtures."""
+
+import logging
+
+import pytest
+
+from app.core import rate_limit as rate_limit_mod
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Give every test fresh rate-limit buckets."""
+    rate_limit_mod._initialized = False
+    yield
+    rate_limit_mod._initialized = False
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+@pytest.fixture
+def capture_log():
+    """Return a function that collects a logger's records (INFO and up).
+
+    App loggers stop propagating once configure_logging() has run, so
+    caplog's root handler can't be relied on; attach to the logger itself.
+    """
+    attached: list[tuple[logging.Logger, logging.Handler, int]] = []
+
+    def capture(logger: logging.Logger) -> list[logging.LogRecord]:
+        handler = _ListHandler()
+        attached.append((logger, handler, logger.level))
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        return handler.records
+
+    yield capture
+    for logger, handler, level in reversed(attached):
+        logger.removeHandler(handler)
+        logger.setLevel(level)
@@ -0,0 +1,89 @@
+"""Tests for the admin profiling endpoints."""
+
+import threading
+import time
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.v1 import admin
+from app.core import profiling
+from app.main import app
+
+HEADERS = {"X-Admin-Token": "s3cret"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin._settings, "admin_token", "s3cret")
+    monkeypatch.setattr(admin, "profiler", profiling.SamplingProfiler())
+    yield TestClient(app)
+    tracemalloc.stop()
+
+
+def test_routes_are_hidden_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(admin._settings, "admin_token", "")
+    resp = TestClient(app).get("/api/v1/admin/profile/cpu", headers=HEADERS)
+    assert resp.status_code == 404
+
+
+def test_wrong_or_missing_token_is_rejected(client):
+    assert client.get("/api/v1/admin/profile/cpu").status_code == 403
+    resp = client.get("/api/v1/admin/profile/cpu", headers={"X-Admin-Token": "nope"})
+    assert resp.status_code == 403
+
+
+def _busy_until(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_cpu_profile_returns_collapsed_stacks(client):
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_until, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        resp = client.post(
+            "/api/v1/admin/profile/cpu/start",
+            params={"seconds": 5, "interval_ms": 1},
+            headers=HEADERS,
+        )
+        assert resp.status_code == 200 and resp.json()["running"] is True
+        again = client.post("/api/v1/admin/profile/cpu/start", headers=HEADERS)
+        assert again.status_code == 409
+        time.sleep(0.1)
+        resp = client.post("/api/v1/admin/profile/cpu/stop", headers=HEADERS)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert resp.status_code == 200
+    lines = resp.text.splitlines()
+    busy = [line for line in lines if line.startswith("busy-worker;")]
+    assert busy and any(f"{__name__}:_busy_until" in line for line in busy)
+    stack, count = busy[0].rsplit(" ", 1)
+    assert int(count) >= 1 and "threading:Thread.run" in stack
+    status = client.get("/api/v1/admin/profile/cpu", headers=HEADERS).json()
+    assert status["running"] is False and status["samples"] >= 1
+
+
+def test_stop_without_a_profile_is_404(client):
+    assert client.post("/api/v1/admin/profile/cpu/stop", headers=HEADERS).status_code == 404
+
+
+def test_memory_snapshot_groups_allocations_by_module(client):
+    assert client.get("/api/v1/admin/memory", headers=HEADERS).status_code == 409
+    assert client.post("/api/v1/admin/memory/start", headers=HEADERS).json()["tracing"]
+
+    blob = [str(i) * 10 for i in range(20000)]
+    resp = client.get("/api/v1/admin/memory", params={"limit": 200}, headers=HEADERS)
+    stopped = client.post("/api/v1/admin/memory/stop", headers=HEADERS).json()
+
+    assert resp.status_code == 200
+    body = resp.json()
+    ours = next(m for m in body["modules"] if m["module"] == __name__)
+    assert ours["size"] >= 20000 * 40 and ours["top_line"]["line"] > 0
+    assert body["traced_bytes"] >= ours["size"]
+    assert stopped == {"tracing": False, "was_tracing": True}
+    del blob
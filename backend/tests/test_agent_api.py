@@ -77,3 +77,201 @@ def test_sync_conflict(client):
     data = resp.json()
     assert data["status"] == "conflict"
     assert data["content"] == "agent-changed"
+
+
+def _stub_agent_run(monkeypatch) -> None:
+    from app.services.agent import service as service_mod
+
+    async def fake_invoke(self, agent, message, message_history):  # type: ignore[no-untyped-def]
+        yield {"type": "thought", "content": "thinking"}
+        yield {"type": "final", "content": "ok"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+
+
+def _sse_frames(text: str) -> list[tuple[str | None, dict]]:
+    import json
+
+    frames = []
+    for block in text.strip().split("\n\n"):
+        event_id, data = None, None
+        for line in block.splitlines():
+            if line.startswith("id: "):
+                event_id = line[4:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+        frames.append((event_id, data))
+    return frames
+
+
+def test_message_stream_frames_carry_sequence_ids(client, monkeypatch):
+    _stub_agent_run(monkeypatch)
+    sid = client.post("/api/v1/agent/sessions", json={"document": "x"}).json()["session_id"]
+    resp = client.post(
+        f"/api/v1/agent/sessions/{sid}/messages",
+        json={"message": "hi", "provider": "deepseek", "model": "deepseek-chat"},
+    )
+    frames = _sse_frames(resp.text)
+    assert frames[0][1] == {"type": "turn_started", "turn_id": resp.headers["X-Turn-Id"]}
+    assert frames[1][1]["type"] == "thought"
+    assert frames[-1][1]["type"] == "done"
+    assert [f[0] for f in frames] == [str(i) for i in range(1, len(frames) + 1)]
+    assert session_mod._sessions.get(sid).status == "done"
+
+
+def test_events_endpoint_replays_after_sequence_id(client, monkeypatch):
+    _stub_agent_run(monkeypatch)
+    sid = client.post("/api/v1/agent/sessions", json={"document": "x"}).json()["session_id"]
+    live = _sse_frames(
+        client.post(
+            f"/api/v1/agent/sessions/{sid}/messages",
+            json={"message": "hi", "provider": "deepseek", "model": "deepseek-chat"},
+        ).text
+    )
+    replay = _sse_frames(client.get(f"/api/v1/agent/sessions/{sid}/events?after=1").text)
+    assert replay == live[1:]
+
+    # Last-Event-ID (EventSource reconnect) wins over the query parameter.
+    last_but_one = live[-2][0]
+    resp = client.get(
+        f"/api/v1/agent/sessions/{sid}/events?after=0", headers={"Last-Event-ID": last_but_one}
+    )
+    assert [f[1]["type"] for f in _sse_frames(resp.text)] == ["done"]
+
+
+def test_events_endpoint_unknown_session_returns_404(client):
+    assert client.get("/api/v1/agent/sessions/nope/events").status_code == 404
+
+
+def test_turn_filter_keeps_only_that_turns_events():
+    from app.api.v1.agent import _turn_filter
+
+    events = [
+        {"type": "turn_started", "turn_id": "a"},
+        {"type": "queued", "turn_id": "b", "position": 1},
+        {"type": "thought", "content": "for a"},
+        {"type": "done", "content": "", "turn_id": "a"},
+        {"type": "turn_started", "turn_id": "b"},
+        {"type": "thought", "content": "for b"},
+        {"type": "done", "content": "", "turn_id": "b"},
+    ]
+    keep = _turn_filter("b")
+    assert [e for e in events if keep(e)] == [events[1]] + events[4:]
+
+
+def test_overloaded_provider_returns_retry_after(client, monkeypatch):
+    from app.core.exceptions import AgentOverloadedException
+    from app.services.agent.scheduler import AgentScheduler
+
+    async def refuse(self, provider, priority=0, wait=True):
+        raise AgentOverloadedException("busy", status_code=429, retry_after=7)
+
+    monkeypatch.setattr(AgentScheduler, "acquire", refuse)
+    sid = client.post("/api/v1/agent/sessions", json={}).json()["session_id"]
+    resp = client.post(
+        f"/api/v1/agent/sessions/{sid}/messages",
+        json={"message": "hi", "provider": "deepseek", "model": "deepseek-chat"},
+    )
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "7"
+    assert client.get("/api/v1/agent/scheduler").json()["max_waiting"] >= 0
+
+
+def _stub_agent_usage(monkeypatch, captured: dict) -> None:
+    from app.services.agent import service as service_mod
+    from app.services.agent.usage import TokenUsage
+
+    async def fake_invoke(self, agent, message, message_history):  # type: ignore[no-untyped-def]
+        captured["token_limit"] = self.token_limit
+        self.usage = TokenUsage(requests=2, input_tokens=100, output_tokens=20)
+        yield {"type": "final", "content": "ok"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+
+
+def test_session_stats_accumulate_token_usage(client, monkeypatch):
+    captured: dict = {}
+    _stub_agent_usage(monkeypatch, captured)
+    sid = client.post("/api/v1/agent/sessions", json={"document": "x"}).json()["session_id"]
+    for _ in range(2):
+        frames = _sse_frames(
+            client.post(
+                f"/api/v1/agent/sessions/{sid}/messages",
+                json={"message": "hi", "provider": "deepseek", "model": "deepseek-chat"},
+            ).text
+        )
+    # The service's own final event (after the stub's) carries the run's usage.
+    final = [data for _, data in frames if data["type"] == "final"][-1]
+    assert final["usage"]["total_tokens"] == 120
+
+    stats = client.get(f"/api/v1/agent/sessions/{sid}/stats").json()
+    assert stats["turns"] == 2
+    assert stats["usage"]["requests"] == 4
+    assert stats["usage"]["total_tokens"] == 240
+    assert stats["token_budget"] is None
+    assert captured["token_limit"] is None
+
+
+def test_session_token_budget_caps_and_refuses_turns(client, monkeypatch):
+    from app.api.v1 import agent as agent_mod
+
+    captured: dict = {}
+    _stub_agent_usage(monkeypatch, captured)
+    monkeypatch.setattr(agent_mod._settings, "agent_session_token_budget", 150)
+    sid = client.post("/api/v1/agent/sessions", json={"document": "x"}).json()["session_id"]
+    body = {"message": "hi", "provider": "deepseek", "model": "deepseek-chat"}
+
+    client.post(f"/api/v1/agent/sessions/{sid}/messages", json=body)
+    assert captured["token_limit"] == 150
+    client.post(f"/api/v1/agent/sessions/{sid}/messages", json=body)
+    assert captured["token_limit"] == 30
+
+    assert client.get(f"/api/v1/agent/sessions/{sid}/stats").json()["token_budget_remaining"] == 0
+    resp = client.post(f"/api/v1/agent/sessions/{sid}/messages", json=body)
+    assert resp.status_code == 429
+
+
+def test_failed_message_build_releases_slot_and_ends_turn(client, monkeypatch):
+    from app.api.v1 import agent as agent_mod
+    from app.services.agent import scheduler as scheduler_mod
+
+    async def broken(sess, req):
+        raise RuntimeError("offload pool broken")
+
+    monkeypatch.setattr(scheduler_mod, "_scheduler", scheduler_mod.AgentScheduler({"deepseek": 1}))
+    monkeypatch.setattr(agent_mod, "_build_user_message", broken)
+    sid = client.post("/api/v1/agent/sessions", json={"document": "x"}).json()["session_id"]
+    body = {"message": "hi", "provider": "deepseek", "model": "deepseek-chat"}
+    frames = _sse_frames(client.post(f"/api/v1/agent/sessions/{sid}/messages", json=body).text)
+
+    assert [data["type"] for _, data in frames] == ["turn_started", "error", "done"]
+    assert frames[1][1]["error"] == "offload pool broken"
+    assert session_mod._sessions.get(sid).status == "failed"
+    assert scheduler_mod.get_scheduler().stats()["deepseek"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stop_before_a_turn_starts_skips_its_run(monkeypatch):
+    from app.api.v1 import agent as agent_mod
+    from app.schemas.agent import SendMessageRequest
+    from app.services.agent import service as service_mod
+
+    runs: list[str] = []
+
+    async def fake_invoke(self, agent, message, message_history):  # type: ignore[no-untyped-def]
+        runs.append(message)
+        yield {"type": "final", "content": "ok"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    monkeypatch.setattr(agent_mod._settings, "deepseek_api_key", "sk-test")
+    sess = session_mod.get_session_manager().create(document="x")
+    req = SendMessageRequest(message="hi", provider="deepseek", model="deepseek-chat")
+
+    _, turn_id, _ = await agent_mod._start_turn(sess, req)
+    sess.stop()
+    await sess.run_task
+
+    assert runs == []
+    assert sess.status == "stopped"
+    kinds = [e["type"] for _, e in sess.events.since(0)]
+    assert kinds == ["turn_started", "stopped", "done"]
@@ -24,6 +24,7 @@ import pytest
 from app.services.agent.service import AgentService
 from app.services.agent.translator import translate_event
 from app.services.workspace.workspace import Workspace
+from tests._fakes import FakeAgent, FakeEvent, FakeEventStream, FakePart, event
 
 
 def _make_service(workspace: Workspace | None = None, stop_event=None) -> AgentService:
@@ -37,55 +38,6 @@ def _make_service(workspace: Workspace | None = None, stop_event=None) -> AgentS
     )
 
 
-class _FakePart:
-    def __init__(self, **kw: Any) -> None:
-        for k, v in kw.items():
-            setattr(self, k, v)
-
-
-class _FakeEvent:
-    """Stand-in for a PydanticAI AgentStreamEvent. Subclass and name it to
-    match the kind the translator dispatches on."""
-
-    def __init__(self, part=None, delta=None, index=0) -> None:
-        self.part = part
-        self.delta = delta
-        self.index = index
-
-
-def _event(kind: str, **kw: Any) -> _FakeEvent:
-    """Create a _FakeEvent whose class name equals `kind`."""
-    cls = type(kind, (_FakeEvent,), {})
-    return cls(**kw)
-
-
-class _FakeEventStream:
-    """Async context manager + async iterator mimicking agent.run_stream_events."""
-
-    def __init__(self, events: list) -> None:
-        self._events = events
-
-    async def __aenter__(self):
-        return self._iter()
-
-    async def __aexit__(self, *exc) -> None:
-        return None
-
-    async def _iter(self):
-        for e in self._events:
-            yield e
-
-
-class _FakeAgent:
-    """Captures the call and returns the scripted event stream."""
-
-    def __init__(self, events: list) -> None:
-        self._events = events
-
-    def run_stream_events(self, message, **kw):  # sync: returns an async ctx mgr
-        return _FakeEventStream(self._events)
-
-
 # ---------------------------------------------------------------------------
 # document_patch: one per edit, even under parallel tool calls
 # ---------------------------------------------------------------------------
@@ -113,17 +65,17 @@ async def test_patch_emitted_once_per_edit_parallel():
 
     # First, a read-only tool result event (no version change).
     events.append(
-        _event(
+        event(
             "FunctionToolResultEvent",
-            part=_FakePart(tool_name="get_section", outcome="success", content="..."),
+            part=FakePart(tool_name="get_section", outcome="success", content="..."),
         )
     )
 
     # We interleave edits by wrapping the fake agent so that after it yields the
     # first event, we perform two edits before yielding the next.
-    class _EditingAgent(_FakeAgent):
+    class _EditingAgent(FakeAgent):
         def run_stream_events(self, message, **kw):  # sync: returns ctx mgr
-            return _EditingStream(_FakeEventStream(self._events), ws)
+            return _EditingStream(FakeEventStream(self._events), ws)
 
     class _EditingStream:
         def __init__(self, inner, ws: Workspace) -> None:
@@ -160,6 +112,9 @@ async def test_patch_emitted_once_per_edit_parallel():
 
     patches = [e for e in collected if e.get("type") == "document_patch"]
     assert [p["version"] for p in patches] == [1, 2], collected
+    # Each patch carries the range its own edit wrote (appends at the end).
+    assert patches[0]["ranges"] == [[6, 11]]
+    assert patches[1]["ranges"] == [[11, 17]]
 
 
 @pytest.mark.asyncio
@@ -167,12 +122,12 @@ async def test_no_patch_when_document_unchanged():
     ws = Workspace(content="# Doc\n")
     svc = _make_service(ws)
     events = [
-        _event(
+        event(
             "FunctionToolResultEvent",
-            part=_FakePart(tool_name="get_section", outcome="success", content="..."),
+            part=FakePart(tool_name="get_section", outcome="success", content="..."),
         )
     ]
-    agent = _FakeAgent(events)
+    agent = FakeAgent(events)
     collected = [e async for e in svc._invoke_agent_run(agent, "hi", None)]  # type: ignore[arg-type]
     assert not [e for e in collected if e.get("type") == "document_patch"]
 
@@ -190,9 +145,9 @@ async def test_stop_event_interrupts_run_loop():
 
     # Script: first event is fine; before the second event the stop is set, so
     # the loop must bail out with a `stopped` event and skip the rest.
-    class _StoppingAgent(_FakeAgent):
+    class _StoppingAgent(FakeAgent):
         def run_stream_events(self, message, **kw):  # sync: returns ctx mgr
-            return _StoppingStream(_FakeEventStream(self._events), stop_event)
+            return _StoppingStream(FakeEventStream(self._events), stop_event)
 
     class _StoppingStream:
         def __init__(self, inner, stop_event) -> None:
@@ -218,17 +173,17 @@ async def test_stop_event_interrupts_run_loop():
             return nxt
 
     events = [
-        _event(
+        event(
             "FunctionToolResultEvent",
-            part=_FakePart(tool_name="get_section", outcome="success", content="a"),
+            part=FakePart(tool_name="get_section", outcome="success", content="a"),
         ),
-        _event(
+        event(
             "FunctionToolResultEvent",
-            part=_FakePart(tool_name="get_section", outcome="success", content="b"),
+            part=FakePart(tool_name="get_section", outcome="success", content="b"),
         ),
-        _event(
+        event(
             "FunctionToolResultEvent",
-            part=_FakePart(tool_name="get_section", outcome="success", content="c"),
+            part=FakePart(tool_name="get_section", outcome="success", content="c"),
         ),
     ]
     agent = _StoppingAgent(events)
@@ -242,6 +197,116 @@ async def test_stop_event_interrupts_run_loop():
     ], after
 
 
+@pytest.mark.asyncio
+async def test_stop_cancels_run_blocked_on_provider():
+    """/stop must not wait for the next stream event: a run whose provider has
+    stalled mid-generation is cancelled directly and its stream is closed."""
+    ws = Workspace(content="# Doc\n")
+    stop_event = asyncio.Event()
+    svc = _make_service(ws, stop_event=stop_event)
+    closed = asyncio.Event()
+
+    async def fake_invoke(agent, message, message_history):
+        try:
+            yield {"type": "thought", "content": "thinking"}
+            await asyncio.sleep(3600)  # provider stalls
+            yield {"type": "thought", "content": "never"}
+        finally:
+            closed.set()
+
+    svc._invoke_agent_run = fake_invoke  # type: ignore[assignment]
+
+    collected: list = []
+
+    async def consume():
+        async for e in svc.run("hi"):
+            collected.append(e)
+            if e.get("type") == "thought":
+                stop_event.set()
+
+    await asyncio.wait_for(consume(), timeout=2)
+    assert collected[-1] == {"type": "stopped", "content": ""}
+    assert {"type": "thought", "content": "never"} not in collected
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_closing_run_generator_cancels_pump():
+    """Dropping the run generator (client gone) must cancel the in-flight run."""
+    svc = _make_service()
+    closed = asyncio.Event()
+
+    async def fake_invoke(agent, message, message_history):
+        try:
+            yield {"type": "thought", "content": "a"}
+            await asyncio.sleep(3600)
+        finally:
+            closed.set()
+
+    svc._invoke_agent_run = fake_invoke  # type: ignore[assignment]
+    gen = svc.run("hi")
+    assert (await gen.__anext__())["type"] == "thought"
+    await gen.aclose()
+    assert closed.is_set()
+
+
+# ---------------------------------------------------------------------------
+# run deadline / model request timeout
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_run_deadline_ends_hung_run_with_timed_error(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_run_timeout", 0.05)
+    ws = Workspace(content="# Doc\n")
+    svc = _make_service(ws)
+
+    async def fake_invoke(agent, message, message_history):
+        await ws.insert_text("edit")
+        yield {"type": "document_patch", "version": 1, "summary": "document edited"}
+        await asyncio.sleep(3600)  # provider hangs
+        yield {}
+
+    svc._invoke_agent_run = fake_invoke  # type: ignore[assignment]
+    events = await asyncio.wait_for(_collect(svc.run("hi")), timeout=2)
+    errs = [e for e in events if e.get("type") == "error"]
+    assert len(errs) == 1
+    assert "运行超时" in errs[0]["error"]
+    assert errs[0]["timeout"] == 0.05
+    assert errs[0]["elapsed"] >= 0.05
+    assert events[-1] == {"type": "done", "content": ""}
+    # The edit made before the deadline stays committed and consistent.
+    assert ws.version == 1 and ws.content.endswith("edit")
+
+
+@pytest.mark.asyncio
+async def test_model_request_timeout_becomes_timed_error():
+    import httpx
+    from pydantic_ai.exceptions import ModelAPIError
+
+    svc = _make_service()
+
+    async def fake_invoke(agent, message, message_history):
+        try:
+            raise httpx.ReadTimeout("read timed out")
+        except httpx.ReadTimeout as e:
+            raise ModelAPIError(model_name="deepseek-chat", message="Request timed out.") from e
+        yield {}  # noqa — async generator marker
+
+    svc._invoke_agent_run = fake_invoke  # type: ignore[assignment]
+    events = [e async for e in svc.run("hi")]
+    errs = [e for e in events if e.get("type") == "error"]
+    assert len(errs) == 1
+    assert "模型请求超时" in errs[0]["error"]
+    assert "elapsed" in errs[0]
+
+
+async def _collect(gen) -> list:
+    return [e async for e in gen]
+
+
 # ---------------------------------------------------------------------------
 # UsageLimitExceeded surfaced as error (run() wrapper)
 # ---------------------------------------------------------------------------
@@ -279,14 +344,118 @@ async def test_run_always_ends_with_done():
     assert events[-1] == {"type": "done", "content": ""}
 
 
+# ---------------------------------------------------------------------------
+# tool-failure budget
+# ---------------------------------------------------------------------------
+
+
+def _tool_result(content: str, name: str = "get_section") -> FakeEvent:
+    return event(
+        "FunctionToolResultEvent",
+        part=FakePart(tool_name=name, outcome="success", content=content),
+    )
+
+
+@pytest.mark.asyncio
+async def test_consecutive_tool_failures_abort_run(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_max_tool_failures", 3)
+    svc = _make_service()
+    bad = "[tool error] ValueError: heading not found: 'x'"
+    agent = FakeAgent([_tool_result(bad)] * 3 + [_tool_result("never reached")])
+    svc._agent = agent  # type: ignore[assignment]
+
+    events = [e async for e in svc.run("hi")]
+    results = [e for e in events if e.get("type") == "tool_result"]
+    assert len(results) == 3
+    assert all(not r["ok"] for r in results)
+    errs = [e for e in events if e.get("type") == "error"]
+    assert len(errs) == 1
+    assert "连续 3 轮工具调用全部失败" in errs[0]["error"]
+    assert errs[0]["tool_failures"] == 3
+    assert events[-1] == {"type": "done", "content": ""}
+
+
+@pytest.mark.asyncio
+async def test_successful_tool_resets_consecutive_failures(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_max_tool_failures", 2)
+    svc = _make_service()
+    bad = "[tool error] ValueError: boom"
+    svc._agent = FakeAgent(  # type: ignore[assignment]
+        [_tool_result(bad), _tool_result("ok"), _tool_result(bad), _tool_result("ok")]
+    )
+
+    events = [e async for e in svc.run("hi")]
+    assert not [e for e in events if e.get("type") == "error"]
+    final = [e for e in events if e.get("type") == "final"][0]
+    assert final["tool_failures"] == 2
+
+
+def _tool_call(call_id: str, name: str = "get_section") -> FakeEvent:
+    return event(
+        "FunctionToolCallEvent", part=FakePart(tool_name=name, tool_call_id=call_id, args={})
+    )
+
+
+def _call_result(call_id: str, content: str, name: str = "get_section") -> FakeEvent:
+    return event(
+        "FunctionToolResultEvent",
+        part=FakePart(
+            tool_name=name, tool_call_id=call_id, outcome="success", content=content
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_parallel_failed_calls_of_one_response_count_once(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_max_tool_failures", 2)
+    svc = _make_service()
+    bad = "[tool error] ValueError: heading not found: 'x'; did you mean: 'X'"
+    svc._agent = FakeAgent(  # type: ignore[assignment]
+        [_tool_call("a"), _tool_call("b"), _tool_call("c")]
+        + [_call_result(i, bad) for i in "abc"]
+        + [_tool_call("d"), _tool_call("e"), _call_result("d", "ok"), _call_result("e", bad)]
+    )
+
+    events = [e async for e in svc.run("hi")]
+
+    assert not [e for e in events if e.get("type") == "error"]
+    final = [e for e in events if e.get("type") == "final"][0]
+    assert final["tool_failures"] == 4
+
+
+@pytest.mark.asyncio
+async def test_responses_whose_calls_all_fail_abort_the_run(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_max_tool_failures", 2)
+    svc = _make_service()
+    bad = "[tool error] ValueError: boom"
+    svc._agent = FakeAgent(  # type: ignore[assignment]
+        [_tool_call("a"), _tool_call("b"), _call_result("a", bad), _call_result("b", bad)]
+        + [_tool_call("c"), _call_result("c", bad), _tool_call("d"), _call_result("d", "ok")]
+    )
+
+    events = [e async for e in svc.run("hi")]
+
+    errs = [e for e in events if e.get("type") == "error"]
+    assert len(errs) == 1 and "连续 2 轮" in errs[0]["error"]
+    assert errs[0]["tool_failures"] == 3
+
+
 # ---------------------------------------------------------------------------
 # translator: outcome field respected, tool name carried
 # ---------------------------------------------------------------------------
 
 
 def test_translator_tool_result_uses_outcome_field():
-    part = _FakePart(tool_name="replace_section", outcome="failed", content="boom")
-    evt = _event("FunctionToolResultEvent", part=part)
+    part = FakePart(tool_name="replace_section", outcome="failed", content="boom")
+    evt = event("FunctionToolResultEvent", part=part)
     evt.content = "boom"
     out = translate_event(evt)
     assert out is not None
@@ -296,17 +465,23 @@ def test_translator_tool_result_uses_outcome_field():
 
 
 def test_translator_tool_result_carries_tool_name():
-    part = _FakePart(tool_name="find_replace", outcome="success", content="replaced 3")
-    evt = _event("FunctionToolResultEvent", part=part)
+    part = FakePart(tool_name="find_replace", outcome="success", content="replaced 3")
+    evt = event("FunctionToolResultEvent", part=part)
     evt.content = "replaced 3"
     out = translate_event(evt)
     assert out["name"] == "find_replace"
     assert out["ok"] is True
 
 
+def test_translator_marks_tool_error_results_as_failed():
+    part = FakePart(tool_name="get_section", outcome="success", content="[tool error] boom")
+    out = translate_event(event("FunctionToolResultEvent", part=part))
+    assert out["ok"] is False
+
+
 def test_translator_part_delta_yields_thought():
-    delta = _FakePart(content_delta="hi")
-    evt = _event("PartDeltaEvent", delta=delta, index=0)
+    delta = FakePart(content_delta="hi")
+    evt = event("PartDeltaEvent", delta=delta, index=0)
     out = translate_event(evt)
     assert out == {"type": "thought", "content": "hi"}
 
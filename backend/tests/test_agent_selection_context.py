@@ -32,6 +32,14 @@ def reset_sessions():
     session_mod._sessions._sessions.clear()
 
 
+@pytest.fixture(autouse=True)
+def restore_agent_run(monkeypatch):
+    """Undo the class-level stub installed by _stub_agent_to_capture_message."""
+    monkeypatch.setattr(
+        service_mod.AgentService, "_invoke_agent_run", service_mod.AgentService._invoke_agent_run
+    )
+
+
 def _stub_agent_to_capture_message(captured: dict) -> None:
     """Patch AgentService._invoke_agent_run so the endpoint's instance records
     the message it was called with, without contacting any LLM."""
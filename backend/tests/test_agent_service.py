@@ -43,8 +43,10 @@ def test_workspace_tools_are_registered(workspace):
     expected = {
         "get_document_outline",
         "get_section",
+        "search_document",
         "insert_text",
         "replace_section",
+        "replace_snippet",
         "replace_document",
         "find_replace",
         "set_title",
@@ -115,3 +117,204 @@ async def test_run_catches_errors_and_emits_error_event(workspace):
     events = [e async for e in svc.run("hi")]
     assert any(e.get("type") == "error" and "boom" in e.get("error", "") for e in events)
     assert events[-1] == {"type": "done", "content": ""}
+
+
+@pytest.mark.asyncio
+async def test_run_reports_exceeded_token_limit_as_budget_error(workspace):
+    from pydantic_ai.exceptions import UsageLimitExceeded
+
+    svc = AgentService(
+        workspace=workspace,
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="https://api.deepseek.com/v1",
+    )
+
+    async def fake_invoke(agent, message, message_history):
+        raise UsageLimitExceeded("Exceeded the total_tokens_limit of 50 (total_tokens=61)")
+        yield {}  # noqa  — makes this an async generator
+
+    svc._invoke_agent_run = fake_invoke
+    events = [e async for e in svc.run("hi", token_limit=50)]
+    assert "token 预算" in events[0]["error"]
+    assert events[-1] == {"type": "done", "content": ""}
+
+
+def test_page_caps_tool_output_with_continuation_notice(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_tool_output_max_chars", 10)
+    text = "x" * 25
+    first = service_mod._page(text, 0, None, "get_section(heading='{A}', offset={offset})")
+    assert first.startswith("x" * 10)
+    assert "[truncated: showing chars 0-10 of 25" in first
+    assert "get_section(heading='{A}', offset=10)" in first
+    # An explicit limit cannot exceed the configured cap.
+    assert "chars 10-20 of 25" in service_mod._page(text, 10, 1000, "r({offset})")
+    assert service_mod._page(text, 20, None, "r({offset})").endswith("[end: showing chars 20-25 of 25]")
+    assert service_mod._page("short", 0, None, "r({offset})") == "short"
+
+
+@pytest.mark.asyncio
+async def test_fan_out_runs_parts_concurrently_and_merges_one_version(monkeypatch):
+    import asyncio
+
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_fanout_concurrency", 2)
+    ws = Workspace(content="preamble\n# A\nalpha\n## A1\nsub\n# B\nbeta\n# C\ngamma\n")
+    svc = AgentService(
+        workspace=ws,
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="https://api.deepseek.com/v1",
+    )
+    running = 0
+    peak = 0
+
+    async def fake_invoke(self, agent, message, message_history):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if "section 'C'" not in message:  # leave part C unchanged
+            await self.workspace.replace_document(self.workspace.content.upper())
+        yield {"type": "tool_result", "name": "replace_document", "ok": True, "summary": ""}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    events = [e async for e in svc.run("upper-case it", fan_out=True)]
+
+    assert ws.content == "PREAMBLE\n# A\nALPHA\n## A1\nSUB\n# B\nBETA\n# C\ngamma\n"
+    assert ws.version == 1
+    assert peak == 2
+    progress = [e for e in events if e["type"] == "section_progress"]
+    assert {e["heading"] for e in progress} == {None, "A", "B", "C"}
+    assert {e["status"] for e in progress if e["heading"] == "C"} == {"running", "unchanged"}
+    patches = [e for e in events if e["type"] == "document_patch"]
+    assert len(patches) == 1 and patches[0]["version"] == 1
+    assert len(patches[0]["ranges"]) == 3
+    assert events[-2]["type"] == "final" and events[-1]["type"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_fan_out_parts_each_hold_a_provider_slot(monkeypatch):
+    import asyncio
+
+    from app.services.agent import scheduler as scheduler_mod
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_fanout_concurrency", 4)
+    monkeypatch.setattr(scheduler_mod, "_scheduler", scheduler_mod.AgentScheduler({"ollama": 2}))
+    ws = Workspace(content="# A\na\n# B\nb\n# C\nc\n# D\nd\n")
+    svc = AgentService(
+        workspace=ws,
+        provider="ollama",
+        model="m",
+        api_key="sk-test",
+        base_url="http://localhost",
+    )
+    running = 0
+    peak = 0
+
+    async def fake_invoke(self, agent, message, message_history):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    events = [e async for e in svc.run("go", fan_out=True)]
+
+    assert events[-2]["type"] == "final"
+    assert peak == 2
+    assert scheduler_mod.get_scheduler().stats()["ollama"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_fan_out_shares_the_token_limit_among_parts(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_fanout_concurrency", 1)
+    ws = Workspace(content="# A\na\n# B\nb\n# C\nc\n# D\nd\n")
+    svc = AgentService(
+        workspace=ws,
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="https://api.deepseek.com/v1",
+    )
+    limits = []
+
+    async def fake_invoke(self, agent, message, message_history):
+        limits.append(self.token_limit)
+        self.usage.input_tokens = 40 if "section 'A'" in message else 10
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    events = [e async for e in svc.run("go", fan_out=True, token_limit=400)]
+
+    # Each part gets an equal slice of what is left, so unused budget flows on.
+    assert limits == [100, 120, 175, 340]
+    assert svc.usage.input_tokens == 70
+    final = next(e for e in events if e["type"] == "final")
+    assert final["usage"]["total_tokens"] == 70
+
+
+@pytest.mark.asyncio
+async def test_fan_out_parts_without_budget_left_are_not_run(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    monkeypatch.setattr(service_mod._settings, "agent_fanout_concurrency", 1)
+    ws = Workspace(content="# A\na\n# B\nb\n")
+    svc = AgentService(
+        workspace=ws,
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="https://api.deepseek.com/v1",
+    )
+    calls = []
+
+    async def fake_invoke(self, agent, message, message_history):
+        calls.append(message)
+        self.usage.input_tokens = 500
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    events = [e async for e in svc.run("go", fan_out=True, token_limit=100)]
+
+    assert len(calls) == 1
+    failed = [e for e in events if e["type"] == "section_progress" and e["status"] == "failed"]
+    assert [e["heading"] for e in failed] == ["B"]
+    assert "token 预算" in failed[0]["error"]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_batch_rejected_if_document_moved(monkeypatch):
+    from app.services.agent import service as service_mod
+
+    ws = Workspace(content="# A\nalpha\n# B\nbeta\n")
+    svc = AgentService(
+        workspace=ws,
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="https://api.deepseek.com/v1",
+    )
+
+    async def fake_invoke(self, agent, message, message_history):
+        await self.workspace.replace_document(self.workspace.content + "!")
+        if "section 'B'" in message:
+            await ws.set_title("concurrent edit")  # shared doc moves on
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    events = [e async for e in svc.run("go", fan_out=True)]
+    errs = [e for e in events if e["type"] == "error"]
+    assert errs and "batch discarded" in errs[0]["error"]
+    assert ws.content == "# A\nalpha\n# B\nbeta\n"
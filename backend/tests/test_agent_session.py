@@ -1,4 +1,9 @@
 """Tests for in-memory AgentSession management."""
+import asyncio
+
+import pytest
+
+from app.services.agent import session as session_mod
 from app.services.agent.session import SessionManager, AgentSession
 
 
@@ -40,3 +45,115 @@ def test_agent_session_status_transitions():
     assert sess.status == "idle"
     sess.status = "running"
     assert sess.status == "running"
+
+
+@pytest.mark.asyncio
+async def test_detached_run_is_stopped_after_grace_period(monkeypatch):
+    monkeypatch.setattr(session_mod._settings, "agent_detach_grace_seconds", 0.05)
+    sess = AgentSession.create(document="x", title="t")
+    sess.status = "running"
+    detach = sess.attach()
+    detach()
+    detach()  # idempotent
+    assert sess.subscribers == 0
+    assert not sess.stop_event.is_set()
+    await asyncio.sleep(0.1)
+    assert sess.stop_event.is_set()
+
+
+@pytest.mark.asyncio
+async def test_reattaching_within_grace_period_keeps_run_alive(monkeypatch):
+    monkeypatch.setattr(session_mod._settings, "agent_detach_grace_seconds", 0.05)
+    sess = AgentSession.create(document="x", title="t")
+    sess.status = "running"
+    sess.attach()()
+    sess.attach()
+    await asyncio.sleep(0.1)
+    assert not sess.stop_event.is_set()
+
+
+def test_deleting_session_stops_its_run():
+    mgr = SessionManager()
+    sess = mgr.create(document="x", title="t")
+    mgr.delete(sess.session_id)
+    assert sess.stop_event.is_set()
+
+
+def _turn(sess, turn_id, order, gate=None):
+    async def run():
+        if gate is not None:
+            await gate.wait()
+        order.append(turn_id)
+        sess.status = "done"
+        sess.publish({"type": "done", "content": "", "turn_id": turn_id})
+
+    return session_mod.PendingTurn(turn_id=turn_id, run=run)
+
+
+@pytest.mark.asyncio
+async def test_submitted_turns_run_in_order_and_report_positions(monkeypatch):
+    monkeypatch.setattr(session_mod._settings, "agent_max_queued_messages", 2)
+    sess = AgentSession.create(document="x", title="t")
+    order: list[str] = []
+    gate = asyncio.Event()
+    assert sess.submit(_turn(sess, "a", order, gate)) == 0
+    assert sess.submit(_turn(sess, "b", order)) == 1
+    assert sess.submit(_turn(sess, "c", order)) == 2
+    with pytest.raises(session_mod.MessageQueueFull):
+        sess.submit(_turn(sess, "d", order))
+    gate.set()
+    await sess.run_task
+    assert order == ["a", "b", "c"]
+    queued = [
+        (e["turn_id"], e["position"]) for _, e in sess.events.since(0) if e["type"] == "queued"
+    ]
+    assert queued == [("b", 1), ("c", 2), ("c", 1)]
+
+
+@pytest.mark.asyncio
+async def test_stop_drops_queued_turns():
+    sess = AgentSession.create(document="x", title="t")
+    order: list[str] = []
+    gate = asyncio.Event()
+    sess.submit(_turn(sess, "a", order, gate))
+    sess.submit(_turn(sess, "b", order))
+    sess.stop()
+    gate.set()
+    await sess.run_task
+    assert order == ["a"]
+    dropped = [e["type"] for _, e in sess.events.since(0) if e.get("turn_id") == "b"]
+    assert dropped == ["queued", "stopped", "done"]
+
+
+def _flag_turn(sess, turn_id, seen, gate=None):
+    async def run():
+        if gate is not None:
+            await gate.wait()
+        seen[turn_id] = sess.stop_event.is_set()
+        sess.status = "done"
+
+    return session_mod.PendingTurn(turn_id=turn_id, run=run)
+
+
+@pytest.mark.asyncio
+async def test_stop_before_the_turn_task_runs_is_kept():
+    sess = AgentSession.create(document="x", title="t")
+    sess.stop_event.set()  # left over from an earlier turn
+    seen: dict[str, bool] = {}
+    sess.submit(_flag_turn(sess, "a", seen))
+    sess.stop()
+    await sess.run_task
+    assert seen == {"a": True}
+
+
+@pytest.mark.asyncio
+async def test_turn_queued_after_a_stop_starts_with_a_clean_flag():
+    sess = AgentSession.create(document="x", title="t")
+    seen: dict[str, bool] = {}
+    gate = asyncio.Event()
+    sess.submit(_flag_turn(sess, "a", seen, gate))
+    sess.stop()
+    sess.submit(_flag_turn(sess, "b", seen))
+    gate.set()
+    await sess.run_task
+    assert seen == {"a": True, "b": False}
@@ -0,0 +1,121 @@
+"""Tests for the agent WebSocket channel."""
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.api.v1 import agent as agent_api
+from app.main import app
+from app.services.agent import service as service_mod
+from app.services.agent import session as session_mod
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def reset_sessions():
+    session_mod._sessions._sessions.clear()
+    yield
+    session_mod._sessions._sessions.clear()
+
+
+@pytest.fixture
+def deepseek_key(monkeypatch):
+    """Message frames need a provider key, whatever the environment sets."""
+    monkeypatch.setattr(agent_api._settings, "deepseek_api_key", "sk-test")
+
+
+def _create(client, document: str = "hello") -> str:
+    return client.post("/api/v1/agent/sessions", json={"document": document}).json()[
+        "session_id"
+    ]
+
+
+def test_unknown_session_is_rejected(client):
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/api/v1/agent/sessions/nope/ws") as ws:
+            ws.receive_json()
+    assert exc.value.code == 4404
+
+
+def test_delta_sync_and_conflict(client):
+    sid = _create(client)
+    with client.websocket_connect(f"/api/v1/agent/sessions/{sid}/ws") as ws:
+        ws.send_json(
+            {
+                "type": "sync",
+                "id": 1,
+                "base_version": 0,
+                "edits": [{"start": 5, "end": 5, "text": " world"}],
+            }
+        )
+        reply = ws.receive_json()
+        assert reply == {
+            "type": "sync_result",
+            "status": "ok",
+            "version": 1,
+            "title": "Untitled",
+            "reply_to": 1,
+        }
+        ws.send_json({"type": "sync", "base_version": 0, "content": "stale"})
+        reply = ws.receive_json()
+        assert reply["status"] == "conflict"
+        assert reply["content"] == "hello world"
+    assert session_mod._sessions.get(sid).workspace.last_edit_ranges == [(5, 11)]
+
+
+def test_bad_frames_get_request_errors(client):
+    sid = _create(client)
+    with client.websocket_connect(f"/api/v1/agent/sessions/{sid}/ws") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "bogus"})
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "sync", "base_version": 0, "edits": [{"start": 9, "end": 2}]})
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "message"})
+        assert ws.receive_json()["status"] == 422
+        ws.send_json({"type": "ping", "id": "p"})
+        assert ws.receive_json() == {"type": "pong", "reply_to": "p"}
+
+
+def test_message_streams_run_events_with_seq(client, monkeypatch, deepseek_key):
+    async def fake_invoke(self, agent, message, message_history):  # type: ignore[no-untyped-def]
+        yield {"type": "thought", "content": "hi"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+    sid = _create(client)
+    with client.websocket_connect(f"/api/v1/agent/sessions/{sid}/ws") as ws:
+        ws.send_json({"type": "message", "message": "go", "model": "deepseek-chat"})
+        frames = []
+        for _ in range(20):
+            frames.append(ws.receive_json())
+            if frames[-1]["type"] in ("done", "error", "request_error"):
+                break
+    assert frames[-1]["type"] == "done", frames
+    kinds = [f["type"] for f in frames]
+    assert "accepted" in kinds
+    events = [f for f in frames if "seq" in f]
+    assert [e["type"] for e in events][:2] == ["turn_started", "thought"]
+    assert [e["seq"] for e in events] == list(range(1, len(events) + 1))
+
+
+def test_control_frames_are_answered_while_a_message_waits_for_a_slot(
+    client, monkeypatch, deepseek_key
+):
+    from app.services.agent import scheduler as scheduler_mod
+
+    busy = scheduler_mod.AgentScheduler({"deepseek": 1}, max_wait=0.5)
+    busy._state("deepseek").active = 1  # the only slot is taken
+    monkeypatch.setattr(scheduler_mod, "_scheduler", busy)
+    sid = _create(client)
+    with client.websocket_connect(f"/api/v1/agent/sessions/{sid}/ws") as ws:
+        ws.send_json({"type": "message", "id": 1, "message": "go", "model": "deepseek-chat"})
+        ws.send_json({"type": "ping", "id": 2})
+        assert ws.receive_json() == {"type": "pong", "reply_to": 2}
+        reply = ws.receive_json()
+    assert reply["reply_to"] == 1
+    assert reply["type"] == "request_error" and reply["status"] == 503
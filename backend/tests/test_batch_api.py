@@ -0,0 +1,170 @@
+"""Tests for batch agent jobs over stored documents (/api/v1/agent/batch)."""
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.v1 import documents as documents_mod
+from app.main import app
+from app.services.agent import batch as batch_mod
+from app.services.agent import scheduler as scheduler_mod
+from app.services.agent import service as service_mod
+from app.services.agent.events import EventBuffer
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    documents_mod._documents.clear()
+    batch_mod._jobs._jobs.clear()
+    scheduler_mod._scheduler = scheduler_mod.AgentScheduler.from_settings()
+    yield
+    documents_mod._documents.clear()
+    batch_mod._jobs._jobs.clear()
+    scheduler_mod._scheduler = scheduler_mod.AgentScheduler.from_settings()
+
+
+@pytest.fixture
+def upper_case_agent(monkeypatch):
+    """Fake agent turn: upper-cases documents whose title doesn't contain 'skip'."""
+
+    async def fake_invoke(self, agent, message, message_history):
+        if "SKIP" not in self.workspace.title.upper():
+            await self.workspace.replace_document(self.workspace.content.upper())
+        yield {"type": "thought", "content": "ok"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", fake_invoke)
+
+
+def _create_doc(client, title: str, content: str) -> str:
+    return client.post("/api/v1/documents", json={"title": title, "content": content}).json()["id"]
+
+
+def _wait_done(client, job_id: str) -> dict:
+    for _ in range(200):
+        job = client.get(f"/api/v1/agent/batch/{job_id}").json()
+        if job["status"] != "running":
+            return job
+        time.sleep(0.01)
+    raise AssertionError("batch job did not finish")
+
+
+def test_batch_job_applies_instruction_and_writes_back(client, upper_case_agent):
+    a = _create_doc(client, "Report A", "# a\n")
+    b = _create_doc(client, "Report B skip", "# b\n")
+    other = _create_doc(client, "Notes", "# n\n")
+
+    resp = client.post(
+        "/api/v1/agent/batch",
+        json={
+            "instruction": "upper",
+            "model": "deepseek-chat",
+            "filter": {"title_contains": "report"},
+        },
+    )
+    assert resp.status_code == 202
+    job = _wait_done(client, resp.json()["job_id"])
+
+    assert job["status"] == "done"
+    assert job["counts"] == {"done": 1, "unchanged": 1}
+    assert client.get(f"/api/v1/documents/{a}").json()["content"] == "# A\n"
+    assert client.get(f"/api/v1/documents/{b}").json()["content"] == "# b\n"
+    assert client.get(f"/api/v1/documents/{other}").json()["content"] == "# n\n"
+
+
+def test_rename_during_the_job_is_not_overwritten(client, monkeypatch):
+    from app.schemas.document import DocumentUpdate
+
+    async def rename_midway(self, agent, message, message_history):
+        await self.workspace.replace_document("# changed\n")
+        await documents_mod.update_document(doc_id, DocumentUpdate(title="Renamed"))
+        yield {"type": "thought", "content": "ok"}
+
+    monkeypatch.setattr(service_mod.AgentService, "_invoke_agent_run", rename_midway)
+    doc_id = _create_doc(client, "Original", "# a\n")
+    job_id = client.post(
+        "/api/v1/agent/batch", json={"instruction": "edit", "model": "deepseek-chat"}
+    ).json()["job_id"]
+    job = _wait_done(client, job_id)
+
+    assert job["counts"] == {"failed": 1}
+    doc = client.get(f"/api/v1/documents/{doc_id}").json()
+    assert (doc["title"], doc["content"]) == ("Renamed", "# a\n")
+
+
+def test_batch_job_events_stream_progress(client, upper_case_agent):
+    _create_doc(client, "One", "x")
+    job_id = client.post(
+        "/api/v1/agent/batch", json={"instruction": "upper", "model": "deepseek-chat"}
+    ).json()["job_id"]
+    _wait_done(client, job_id)
+
+    body = client.get(f"/api/v1/agent/batch/{job_id}/events").text
+    events = [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: ")]
+    assert [e["type"] for e in events] == ["batch_item", "batch_item", "batch_done", "done"]
+    assert events[1]["status"] == "done"
+
+
+def test_batch_job_with_no_matching_documents_is_404(client):
+    resp = client.post(
+        "/api/v1/agent/batch",
+        json={"instruction": "x", "model": "deepseek-chat", "filter": {"document_ids": ["nope"]}},
+    )
+    assert resp.status_code == 404
+
+
+def test_unknown_batch_job_is_404(client):
+    assert client.get("/api/v1/agent/batch/nope").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_event_buffer_replays_and_follows():
+    buf = EventBuffer(maxlen=3)
+    for i in range(4):
+        buf.append({"n": i})
+    # Oldest event evicted; replay resumes at the oldest retained one.
+    assert [seq for seq, _ in buf.since(0)] == [2, 3, 4]
+
+    seen: list = []
+
+    async def reader():
+        async for seq, evt in buf.subscribe(after=3):
+            seen.append((seq, evt["n"]))
+
+    task = asyncio.create_task(reader())
+    await asyncio.sleep(0)
+    buf.append({"n": 4})
+    buf.close()
+    await asyncio.wait_for(task, timeout=1)
+    assert seen == [(4, 3), (5, 4)]
+
+
+@pytest.mark.asyncio
+async def test_cancel_does_not_wait_for_provider_slots():
+    busy = scheduler_mod.AgentScheduler({"deepseek": 1})
+    busy._state("deepseek").active = 1  # held elsewhere for the whole test
+    scheduler_mod._scheduler = busy
+    store = {f"d{i}": {"content": "x", "title": f"t{i}"} for i in range(5)}
+    job = batch_mod.BatchJob(
+        job_id="j",
+        instruction="go",
+        provider="deepseek",
+        model="deepseek-chat",
+        items=[batch_mod.BatchItem(document_id=d) for d in store],
+    )
+    task = asyncio.create_task(batch_mod.run_batch_job(job, store, "sk-test", "http://x"))
+    await asyncio.sleep(0.01)
+
+    job.cancel()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert job.status == "cancelled"
+    assert job.counts() == {"cancelled": 5}
+    assert busy.stats()["deepseek"]["waiting"] == 0
@@ -0,0 +1,56 @@
+"""Tests for the ASGI request logging middleware."""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.middleware.logging import LoggingMiddleware, logger
+
+
+@pytest.fixture
+def records(capture_log):
+    return capture_log(logger)
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(LoggingMiddleware)
+
+    @app.get("/plain")
+    async def plain():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            for i in range(3):
+                yield f"data: {i}\n\n"
+
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    return app
+
+
+def test_adds_process_time_header_and_logs(records):
+    resp = TestClient(_app()).get("/plain")
+    assert resp.status_code == 200
+    assert float(resp.headers["X-Process-Time"]) >= 0
+    assert records[-1].getMessage().startswith("[GET] /plain - 200 - ttfb ")
+
+
+def test_streaming_body_passes_through_unbuffered(records):
+    resp = TestClient(_app()).get("/stream")
+    assert resp.text == "data: 0\n\ndata: 1\n\ndata: 2\n\n"
+    assert "X-Process-Time" in resp.headers
+    assert "/stream - 200" in records[-1].getMessage()
+
+
+def test_unhandled_error_is_logged_as_500(records):
+    client = TestClient(_app(), raise_server_exceptions=False)
+    assert client.get("/boom").status_code == 500
+    assert "/boom - 500" in records[-1].getMessage()
@@ -0,0 +1,64 @@
+"""Tests for the event-loop lag monitor and blocked-loop detector."""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.loop_monitor import LoopMonitor, logger
+from app.main import app
+
+
+@pytest.fixture
+def records(capture_log):
+    return capture_log(logger)
+
+
+def _blocking_call() -> None:
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_blocked_loop_is_reported_with_its_stack(records):
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+    stalls_before = metrics.EVENT_LOOP_STALLS.value()
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        _blocking_call()
+        await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    assert monitor.stalls == 1
+    assert metrics.EVENT_LOOP_STALLS.value() == stalls_before + 1
+    message = records[-1].getMessage()
+    assert message.startswith("event loop blocked for ")
+    assert "_blocking_call" in message
+    assert metrics.EVENT_LOOP_LAG.count() > 0
+
+
+@pytest.mark.asyncio
+async def test_idle_loop_reports_no_stall(records):
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+    monitor.start()
+    await asyncio.sleep(0.1)
+    await monitor.stop()
+
+    assert monitor.stalls == 0
+    assert records == []
+
+
+@pytest.mark.asyncio
+async def test_disabled_monitor_starts_nothing():
+    monitor = LoopMonitor(interval=0)
+    monitor.start()
+    assert monitor._task is None
+    await monitor.stop()
+
+
+def test_lifespan_starts_and_stops_monitor():
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
@@ -0,0 +1,139 @@
+"""Tests for the Prometheus-style metrics registry and the /metrics endpoint."""
+
+from __future__ import annotations
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.main import app
+from app.services.agent import session as session_mod
+from app.services.agent.service import AgentService
+from app.services.workspace.workspace import Workspace
+from tests._fakes import FakeAgent, FakePart, event
+
+
+@pytest.fixture
+def client():
+    session_mod._sessions._sessions.clear()
+    yield TestClient(app)
+    session_mod._sessions._sessions.clear()
+
+
+def test_counter_and_gauge_render_with_labels():
+    c = metrics.Counter("t_total", "A counter.", ("kind",))
+    c.inc(kind="a")
+    c.inc(2, kind='b"q')
+    g = metrics.Gauge("t_gauge", "A gauge.")
+    g.set_function(lambda: {(): 7})
+
+    assert c.render().splitlines() == [
+        "# HELP t_total A counter.",
+        "# TYPE t_total counter",
+        't_total{kind="a"} 1',
+        't_total{kind="b\\"q"} 2',
+    ]
+    assert g.render().splitlines()[-1] == "t_gauge 7"
+
+
+def test_counter_rejects_wrong_labels():
+    c = metrics.Counter("t_total", "A counter.", ("kind",))
+    with pytest.raises(ValueError):
+        c.inc(other="x")
+
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("t_seconds", "A histogram.", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v)
+
+    lines = h.render().splitlines()[2:]
+    assert lines == [
+        't_seconds_bucket{le="0.1"} 2',
+        't_seconds_bucket{le="1"} 3',
+        't_seconds_bucket{le="+Inf"} 4',
+        "t_seconds_sum 3.65",
+        "t_seconds_count 4",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_records_ttft_tool_and_run_metrics():
+    svc = AgentService(
+        workspace=Workspace(content="# Doc\n"),
+        provider="metrics-test",
+        model="m",
+        api_key="sk-test",
+        base_url="http://localhost",
+    )
+    svc._agent = FakeAgent(
+        [
+            event("PartStartEvent"),
+            event(
+                "FunctionToolCallEvent",
+                part=FakePart(tool_name="get_section", tool_call_id="c1", args={}),
+            ),
+            event(
+                "FunctionToolResultEvent",
+                part=FakePart(
+                    tool_name="get_section", tool_call_id="c1", outcome="success", content="x"
+                ),
+            ),
+            event("PartDeltaEvent", delta=FakePart(content_delta="ok")),
+        ]
+    )
+    tool_calls = metrics.TOOL_CALLS.value(tool="get_section", outcome="ok")
+    tool_timings = metrics.TOOL_DURATION.count(tool="get_section")
+
+    events = [evt async for evt in svc.run("hi")]
+
+    assert events[-2]["type"] == "final"
+    assert svc.model_responses == 2
+    assert metrics.LLM_TIME_TO_FIRST_TOKEN.count(provider="metrics-test") == 2
+    assert metrics.AGENT_ITERATIONS.count(provider="metrics-test") == 1
+    assert metrics.AGENT_EVENTS.count(provider="metrics-test") == 1
+    assert metrics.AGENT_RUNS.value(provider="metrics-test", outcome="final") == 1
+    assert metrics.TOOL_CALLS.value(tool="get_section", outcome="ok") == tool_calls + 1
+    assert metrics.TOOL_DURATION.count(tool="get_section") == tool_timings + 1
+
+
+def test_metrics_endpoint_exposes_sessions_and_request_routes(client):
+    sid = client.post("/api/v1/agent/sessions", json={"document": "# A\n"}).json()["session_id"]
+    client.get(f"/api/v1/agent/sessions/{sid}/document")
+
+    resp = client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = resp.text
+    assert 'mdmaker_sessions{status="idle"} 1' in body
+    assert "mdmaker_workspace_bytes " in body
+    # Route templates, not concrete paths, label request durations.
+    assert 'route="/api/v1/agent/sessions/{session_id}/document"' in body
+    assert sid not in body
+
+
+@pytest.mark.asyncio
+async def test_fan_out_counts_each_token_once(monkeypatch):
+    async def fake_invoke(self, agent, message, message_history):
+        self.usage.input_tokens = 100
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(AgentService, "_invoke_agent_run", fake_invoke)
+    svc = AgentService(
+        workspace=Workspace(content="# A\na\n# B\nb\n"),
+        provider="fanout-test",
+        model="m",
+        api_key="sk-test",
+        base_url="http://localhost",
+    )
+
+    events = [evt async for evt in svc.run("go", fan_out=True)]
+
+    assert events[-2]["type"] == "final"
+    assert metrics.LLM_TOKENS.value(provider="fanout-test", kind="input") == 200
+    # The turn is one run; its parts are not runs of their own.
+    assert metrics.AGENT_RUNS.value(provider="fanout-test", outcome="final") == 1
+    assert metrics.AGENT_RUN_DURATION.count(provider="fanout-test") == 1
+    assert metrics.AGENT_EVENTS.count(provider="fanout-test") == 1
+    assert metrics.AGENT_RUN_INPUT_TOKENS.count(provider="fanout-test") == 1
@@ -0,0 +1,108 @@
+"""Tests for running large-document work in the offload worker pool."""
+
+import threading
+
+import pytest
+
+from app.api.v1 import agent as agent_api
+from app.core import offload
+from app.schemas.agent import ContextItem, SendMessageRequest
+from app.services.workspace import tools
+from app.services.workspace import workspace as workspace_mod
+from app.services.workspace.workspace import Workspace
+
+
+@pytest.fixture
+def threshold(monkeypatch):
+    """Offload inputs of at least 100 chars; the pool is torn down afterwards."""
+    monkeypatch.setattr(offload._settings, "offload_threshold_chars", 100)
+    yield
+    offload.shutdown()
+
+
+def _thread_name(*_args, **_kwargs) -> str:
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_small_inputs_run_inline(threshold):
+    assert await offload.run_cpu(99, _thread_name) == threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_large_inputs_run_in_the_pool(threshold):
+    assert (await offload.run_cpu(100, _thread_name)).startswith("offload")
+
+
+@pytest.mark.asyncio
+async def test_zero_threshold_disables_offloading(monkeypatch):
+    monkeypatch.setattr(offload._settings, "offload_threshold_chars", 0)
+    assert await offload.run_cpu(10**9, _thread_name) == threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_from_the_pool(threshold):
+    with pytest.raises(ValueError, match="pattern must be non-empty"):
+        await offload.run_cpu(1000, tools.find_replace, "x" * 1000, "", "y")
+
+
+@pytest.mark.asyncio
+async def test_large_workspace_parses_and_edits_off_the_loop(threshold, monkeypatch):
+    body = "filler line\n" * 20
+    ws = Workspace(content=f"# A\n\n{body}\n## B\n\nfoo bar\n")
+    threads = []
+    real = workspace_mod.parse_outline
+    monkeypatch.setattr(
+        workspace_mod, "parse_outline", lambda c: threads.append(_thread_name()) or real(c)
+    )
+
+    assert await ws.get_section("B") == "## B\n\nfoo bar\n"
+    assert await ws.find_replace("foo", "qux", heading="B") == 1
+    result = await ws.search_document("qux")
+
+    assert ws.content.endswith("## B\n\nqux bar\n")
+    assert result["total"] == 1 and result["hits"][0]["heading"] == "B"
+    assert threads and all(name.startswith("offload") for name in threads)
+
+
+@pytest.mark.asyncio
+async def test_process_pool_runs_document_tools(threshold, monkeypatch):
+    monkeypatch.setattr(offload._settings, "offload_executor", "process")
+    offload.shutdown()
+    ws = Workspace(content="# A\n\n" + "alpha beta\n" * 20)
+
+    assert await ws.find_replace("beta", "gamma", count=2) == 2
+    outline = await ws.get_document_outline()
+    # The index cache must survive a result that is a copy of the content.
+    await ws.search_document("alpha")
+    index = ws._search_index[1]
+    await ws.search_document("gamma")
+
+    assert ws.content.count("gamma") == 2
+    assert [s["heading"] for s in outline] == ["A"]
+    assert ws._search_index[1] is index
+
+
+@pytest.mark.asyncio
+async def test_context_expansion_is_offloaded_for_large_documents(threshold, monkeypatch):
+    class _Session:
+        workspace = Workspace(content="# Doc\n\n" + "text\n" * 50)
+
+    threads = []
+    real = agent_api.expand_context_references
+
+    def expand(*args):
+        threads.append(_thread_name())
+        return real(*args)
+
+    monkeypatch.setattr(agent_api, "expand_context_references", expand)
+    req = SendMessageRequest(
+        message="see @document and @c1",
+        model="deepseek-chat",
+        contexts=[ContextItem(ref="c1", label="片段", content="snippet")],
+    )
+
+    message = await agent_api._build_user_message(_Session(), req)
+
+    assert "文档全文" in message and "snippet" in message
+    assert threads[0].startswith("offload")
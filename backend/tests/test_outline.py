@@ -1,5 +1,12 @@
 """Tests for document outline parsing."""
-from app.services.workspace.outline import parse_outline, OutlineSection
+import pytest
+
+from app.services.workspace.outline import (
+    OutlineSection,
+    normalize_heading,
+    parse_outline,
+    resolve_heading,
+)
 
 
 def test_parse_outline_extracts_headings():
@@ -77,3 +84,73 @@ def test_outline_section_char_range():
     assert s0.line_start == 0
     assert doc[s0.char_start:s0.char_end].startswith("# A")
     assert "# B" not in doc[s0.char_start:s0.char_end]
+
+
+def test_normalize_heading_folds_markup_width_case_and_punctuation():
+    assert normalize_heading("## 下周计划：") == normalize_heading("下周计划")
+    assert normalize_heading("**Next  Steps**!") == "next steps"
+    assert normalize_heading("ＡＰＩ　Ｄｅｓｉｇｎ") == "api design"
+    assert normalize_heading("Setup ##") == "setup"
+
+
+def test_resolve_heading_prefers_exact_then_normalized():
+    sections = parse_outline("# Intro\n\n## 下周计划\n\n## Usage\n")
+    assert resolve_heading(sections, "Usage").heading == "Usage"
+    assert resolve_heading(sections, "## 下周计划").heading == "下周计划"
+    assert resolve_heading(sections, "usage.").heading == "Usage"
+
+
+def test_resolve_heading_accepts_unique_close_match():
+    sections = parse_outline("# Intro\n\n## Installation Guide\n\n## Usage\n")
+    assert resolve_heading(sections, "Instalation Guide").heading == "Installation Guide"
+
+
+def test_resolve_heading_never_guesses_a_different_number():
+    sections = parse_outline("# Plan\n\n## Week 2\n\n## 2023 Budget\n\n## Summary\n")
+    with pytest.raises(ValueError, match="did you mean: 'Week 2'"):
+        resolve_heading(sections, "Week 1")
+    with pytest.raises(ValueError, match="did you mean: '2023 Budget'"):
+        resolve_heading(sections, "2024 Budget")
+    assert resolve_heading(sections, "Weeek 2").heading == "Week 2"
+
+
+def test_resolve_heading_ambiguous_normalized_match_raises():
+    sections = parse_outline("# Notes\n\n## notes\n")
+    with pytest.raises(ValueError, match="heading ambiguous"):
+        resolve_heading(sections, "NOTES:")
+
+
+def test_resolve_heading_not_found_suggests_candidates():
+    sections = parse_outline("# Intro\n\n## Setup Steps\n\n## Usage\n")
+    with pytest.raises(ValueError, match="did you mean: 'Setup Steps'"):
+        resolve_heading(sections, "Setup")
+    with pytest.raises(ValueError, match="available headings: 'Intro', 'Setup Steps'"):
+        resolve_heading(sections, "完全无关")
+
+
+def test_top_level_chunks_cover_document_without_overlap():
+    from app.services.workspace.outline import top_level_chunks
+
+    doc = "intro\n## A\na\n### A1\nx\n## B\nb\n"
+    chunks = top_level_chunks(doc, parse_outline(doc))
+    assert [h for _, _, h in chunks] == [None, "A", "B"]
+    assert "".join(doc[s:e] for s, e, _ in chunks) == doc
+    assert top_level_chunks("plain", []) == [(0, 5, None)]
+
+
+def test_top_level_chunks_split_below_a_single_title():
+    from app.services.workspace.outline import top_level_chunks
+
+    doc = "# Title\nintro\n## A\na\n## B\nb\n### B1\nx\n## C\nc\n"
+    chunks = top_level_chunks(doc, parse_outline(doc))
+    assert [h for _, _, h in chunks] == ["Title", "A", "B", "C"]
+    assert doc[chunks[0][0] : chunks[0][1]] == "# Title\nintro\n"
+    assert "".join(doc[s:e] for s, e, _ in chunks) == doc
+
+    doc = "# Title\n## Only\n### a\n### b\n"
+    chunks = top_level_chunks(doc, parse_outline(doc))
+    assert [h for _, _, h in chunks] == ["Title", "Only", "a", "b"]
+    assert "".join(doc[s:e] for s, e, _ in chunks) == doc
+    assert top_level_chunks("# Title\ntext\n", parse_outline("# Title\ntext\n")) == [
+        (0, 13, "Title")
+    ]
@@ -0,0 +1,86 @@
+"""Tests for the per-session live event broadcaster."""
+
+from __future__ import annotations
+
+import pytest
+
+from app.services.agent.pubsub import Broadcaster
+from app.services.agent.session import AgentSession
+
+
+async def _drain(sub) -> list[dict]:
+    sub.close()
+    return [evt async for evt in sub]
+
+
+@pytest.mark.asyncio
+async def test_every_subscriber_receives_published_events():
+    b = Broadcaster(queue_size=8)
+    first, second = b.subscribe(), b.subscribe()
+    b.publish({"type": "tool_call", "name": "insert_text"})
+    assert await _drain(first) == [{"type": "tool_call", "name": "insert_text"}]
+    assert await _drain(second) == [{"type": "tool_call", "name": "insert_text"}]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_merges_thoughts_and_collapses_patches():
+    b = Broadcaster(queue_size=4)
+    sub = b.subscribe()
+    b.publish({"type": "thought", "content": "a"})
+    b.publish({"type": "document_patch", "version": 1, "summary": "s", "ranges": [[0, 1]]})
+    b.publish({"type": "thought", "content": "b"})
+    b.publish({"type": "document_patch", "version": 2, "summary": "s", "ranges": [[2, 3]]})
+    b.publish({"type": "thought", "content": "c"})  # queue full -> compact
+    events = await _drain(sub)
+    assert events == [
+        {"type": "thought", "content": "ab"},
+        {"type": "document_patch", "version": 2, "summary": "s"},
+        {"type": "thought", "content": "c"},
+    ]
+    assert sub.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_overflow_drops_oldest_and_reports_lag():
+    b = Broadcaster(queue_size=4)
+    sub = b.subscribe()
+    for i in range(6):
+        b.publish({"type": "tool_call", "name": f"t{i}"})
+    events = await _drain(sub)
+    assert events[0] == {"type": "lagged", "dropped": sub.dropped}
+    # The close marker still fits without losing the lag notice.
+    assert [e["name"] for e in events[1:]] == ["t4", "t5"]
+    assert sub.dropped == 4
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_does_not_affect_others():
+    b = Broadcaster(queue_size=4)
+    slow, fast = b.subscribe(), b.subscribe()
+    b.publish({"type": "tool_call", "name": "a"})
+    assert await _drain(fast) == [{"type": "tool_call", "name": "a"}]
+    for name in "bcdef":
+        b.publish({"type": "tool_call", "name": name})
+    events = await _drain(slow)
+    assert events[0]["type"] == "lagged"
+    assert events[-1] == {"type": "tool_call", "name": "f"}
+
+
+@pytest.mark.asyncio
+async def test_closed_broadcaster_ends_new_subscriptions():
+    b = Broadcaster()
+    b.close()
+    assert [evt async for evt in b.subscribe()] == []
+
+
+@pytest.mark.asyncio
+async def test_session_broadcasts_workspace_edits_from_any_source():
+    sess = AgentSession.create(document="hello", title="t")
+    sub = sess.broadcaster.subscribe()
+    await sess.workspace.apply_client_edit(0, "hello world")
+    sess.publish({"type": "document_patch", "version": 1, "summary": "dup"})
+    sess.publish({"type": "final", "content": "ok"})
+    events = await _drain(sub)
+    assert [e["type"] for e in events] == ["document_patch", "final"]
+    assert events[0]["version"] == 1
+    assert sess.events.last_seq == 2
@@ -0,0 +1,138 @@
+"""Tests for the token-bucket rate limiter."""
+
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import rate_limit as rate_limit_mod
+from app.core.exceptions import RateLimitException
+from app.core.rate_limit import MemoryTokenBucket, SQLiteTokenBucket, check_rate_limit
+from app.main import app
+
+
+def test_memory_bucket_allows_burst_then_reports_wait(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limit_mod.time, "monotonic", lambda: now[0])
+    bucket = MemoryTokenBucket(rate_per_minute=60, burst=2)
+    assert bucket.take("a") == 0
+    assert bucket.take("a") == 0
+    assert bucket.take("a") == pytest.approx(1.0)
+    assert bucket.take("b") == 0  # keys are independent
+    now[0] += 1.0
+    assert bucket.take("a") == 0
+
+
+def test_memory_bucket_prunes_refilled_keys(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(rate_limit_mod.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limit_mod, "_MAX_MEMORY_KEYS", 2)
+    bucket = MemoryTokenBucket(rate_per_minute=60, burst=1)
+    bucket.take("a")
+    bucket.take("b")
+    now[0] += 5.0
+    bucket.take("c")
+    assert set(bucket._buckets) == {"c"}
+
+
+def test_sqlite_bucket_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "rl.db")
+    first = SQLiteTokenBucket(path, rate_per_minute=1, burst=1)
+    second = SQLiteTokenBucket(path, rate_per_minute=1, burst=1)
+    assert first.take("k") == 0
+    assert second.take("k") > 0
+
+
+def test_sqlite_bucket_fails_open_while_another_worker_holds_the_lock(tmp_path):
+    path = str(tmp_path / "rl.db")
+    bucket = SQLiteTokenBucket(path, rate_per_minute=1, burst=1, busy_timeout=0.05)
+    bucket.take("k")
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert bucket.take("k") == 0
+    finally:
+        other.execute("ROLLBACK")
+    assert bucket.take("k") > 0
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_is_checked_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_backend", "sqlite")
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_sqlite_path", str(tmp_path / "rl.db"))
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_per_minute", 1)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_burst", 0)
+    threads = []
+    real = SQLiteTokenBucket.take
+    monkeypatch.setattr(
+        SQLiteTokenBucket,
+        "take",
+        lambda self, key: threads.append(threading.current_thread()) or real(self, key),
+    )
+
+    await check_rate_limit("1.2.3.4", "ollama")
+    with pytest.raises(RateLimitException):
+        await check_rate_limit("1.2.3.4", "ollama")
+    assert threads and threading.current_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_check_rate_limit_raises_with_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_per_minute", 1)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_burst", 0)
+    await check_rate_limit("1.2.3.4", "ollama")
+    await check_rate_limit("1.2.3.4", "deepseek")  # separate bucket per provider
+    with pytest.raises(RateLimitException) as exc:
+        await check_rate_limit("1.2.3.4", "OLLAMA")
+    assert exc.value.headers == {"Retry-After": str(exc.value.retry_after)}
+
+
+@pytest.mark.asyncio
+async def test_provider_bucket_limits_across_clients(monkeypatch):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_provider_per_minute", 1)
+    await check_rate_limit("1.1.1.1", "ollama")
+    with pytest.raises(RateLimitException):
+        await check_rate_limit("2.2.2.2", "ollama")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+async def test_provider_refusal_refunds_the_client_token(monkeypatch, tmp_path, backend):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_backend", backend)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_sqlite_path", str(tmp_path / "rl.db"))
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_per_minute", 2)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_provider_per_minute", 1)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_burst", 0)
+    await check_rate_limit("1.1.1.1", "ollama")
+    for _ in range(3):  # retries while the provider is saturated
+        with pytest.raises(RateLimitException):
+            await check_rate_limit("2.2.2.2", "ollama")
+    client_bucket, _ = rate_limit_mod._buckets()
+    # The client's burst of 2 is still whole.
+    assert client_bucket.take("client:2.2.2.2:ollama") == 0
+    assert client_bucket.take("client:2.2.2.2:ollama") == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_limit_never_refuses(monkeypatch):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_per_minute", 0)
+    for _ in range(100):
+        await check_rate_limit("1.1.1.1", "ollama")
+
+
+def test_chat_endpoint_returns_429(monkeypatch):
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_per_minute", 1)
+    monkeypatch.setattr(rate_limit_mod._settings, "rate_limit_burst", 0)
+    asyncio.run(rate_limit_mod.check_rate_limit("testclient", "ollama"))
+    resp = TestClient(app).post(
+        "/api/v1/ai/chat",
+        json={
+            "messages": [{"role": "user", "content": "hi"}],
+            "provider": "ollama",
+            "model": "llama3",
+        },
+    )
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
@@ -0,0 +1,83 @@
+"""Tests for agent run admission control."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app.core.exceptions import AgentOverloadedException
+from app.services.agent.scheduler import (
+    PRIORITY_BATCH,
+    AgentScheduler,
+    parse_provider_limits,
+)
+
+
+def test_parse_provider_limits():
+    assert parse_provider_limits("deepseek=8, Ollama=2,,bad") == {"deepseek": 8, "ollama": 2}
+
+
+@pytest.mark.asyncio
+async def test_slots_are_limited_per_provider():
+    sched = AgentScheduler({"ollama": 1}, max_wait=0.05)
+    lease = await sched.acquire("ollama")
+    other = await sched.acquire("deepseek")  # separate provider, separate slots
+    with pytest.raises(AgentOverloadedException) as exc:
+        await sched.acquire("ollama")
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"].isdigit()
+    lease.release()
+    lease.release()  # idempotent
+    other.release()
+    (await sched.acquire("ollama")).release()
+    stats = sched.stats()["ollama"]
+    assert stats["active"] == 0 and stats["waiting"] == 0 and stats["timed_out"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_wait_queue_is_refused_immediately():
+    sched = AgentScheduler({"ollama": 1}, max_waiting=1, max_wait=5)
+    lease = await sched.acquire("ollama")
+    waiter = asyncio.create_task(sched.acquire("ollama"))
+    await asyncio.sleep(0)
+    with pytest.raises(AgentOverloadedException) as exc:
+        await sched.acquire("ollama")
+    assert exc.value.status_code == 429
+    lease.release()
+    (await waiter).release()
+    assert sched.stats()["ollama"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_interactive_waiters_go_before_batch():
+    sched = AgentScheduler({"ollama": 1}, max_wait=5)
+    order: list[str] = []
+
+    async def run(name: str, **kw) -> None:
+        async with sched.slot("ollama", **kw):
+            order.append(name)
+
+    lease = await sched.acquire("ollama")
+    batch = asyncio.create_task(run("batch", priority=PRIORITY_BATCH, wait=False))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(run("interactive"))
+    await asyncio.sleep(0)
+    assert sched.stats()["ollama"]["waiting"] == 2
+    lease.release()
+    await asyncio.gather(batch, interactive)
+    assert order == ["interactive", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    sched = AgentScheduler({"ollama": 1}, max_wait=5)
+    lease = await sched.acquire("ollama")
+    waiter = asyncio.create_task(sched.acquire("ollama"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert sched.stats()["ollama"]["waiting"] == 0
+    lease.release()
+    assert sched.stats()["ollama"]["active"] == 0
@@ -0,0 +1,130 @@
+"""Tests for the SSE streaming helpers."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from app.services import streaming
+from app.services.streaming import create_sse_stream, dumps_json, format_sse_chunk
+
+
+def _payloads(frames: list[str]) -> list[dict]:
+    return [json.loads(f.removeprefix("data: ").strip()) for f in frames]
+
+
+async def _collect(gen) -> list[str]:
+    return [frame async for frame in gen]
+
+
+def test_format_sse_chunk_with_and_without_id():
+    assert format_sse_chunk({"a": "é"}) == 'data: {"a":"é"}\n\n'
+    assert format_sse_chunk({"a": 1}, event_id=7) == 'id: 7\ndata: {"a":1}\n\n'
+
+
+def test_orjson_fast_path_is_used():
+    orjson = pytest.importorskip("orjson")
+    data = {"type": "content", "content": "中文", "n": [1, 2.5]}
+    assert streaming.orjson is orjson
+    expected = '{"type":"content","content":"中文","n":[1,2.5]}'
+    assert dumps_json(data) == orjson.dumps(data).decode() == expected
+
+
+def test_stdlib_fallback_matches_orjson(monkeypatch):
+    data = {"type": "content", "content": "中文 \"q\"\n", "error": None, "n": [1, 2.5]}
+    fast = dumps_json(data)
+    monkeypatch.setattr(streaming, "orjson", None)
+    assert json.loads(dumps_json(data)) == json.loads(fast) == data
+
+
+@pytest.mark.asyncio
+async def test_tokens_within_window_share_one_frame():
+    async def tokens():
+        for t in ["Hel", "lo", " wor", "ld"]:
+            yield t
+
+    frames = _payloads(await _collect(create_sse_stream(tokens(), coalesce_window=0.01)))
+    assert frames == [
+        {"type": "content", "content": "Hello world", "error": None},
+        {"type": "done", "content": "", "error": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_slow_tokens_are_sent_separately():
+    async def tokens():
+        for t in ["a", "b"]:
+            await asyncio.sleep(0.02)
+            yield t
+
+    frames = _payloads(await _collect(create_sse_stream(tokens(), coalesce_window=0)))
+    assert [f["content"] for f in frames] == ["a", "b", ""]
+
+
+@pytest.mark.asyncio
+async def test_error_after_content_flushes_content_first():
+    async def tokens():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    frames = _payloads(await _collect(create_sse_stream(tokens(), coalesce_window=0)))
+    assert frames == [
+        {"type": "content", "content": "partial", "error": None},
+        {"type": "error", "content": "", "error": "boom"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_closing_stream_cancels_producer():
+    cancelled = asyncio.Event()
+
+    async def tokens():
+        try:
+            yield "x"
+            await asyncio.sleep(10)
+        finally:
+            cancelled.set()
+
+    stream = create_sse_stream(tokens(), coalesce_window=0)
+    await stream.__anext__()
+    await stream.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_idle_stream_sends_heartbeat_comments(monkeypatch):
+    monkeypatch.setattr(streaming._settings, "sse_heartbeat_interval", 0.01)
+
+    async def events():
+        await asyncio.sleep(0.05)
+        yield 1, {"type": "final", "content": "ok"}
+
+    frames = await _collect(streaming.create_sequenced_sse_stream(events()))
+    assert frames[0] == streaming.HEARTBEAT_FRAME
+    assert frames[-2] == 'id: 1\ndata: {"type":"final","content":"ok"}\n\n'
+    assert json.loads(frames[-1].removeprefix("data: "))["type"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_lagging_client_gets_thoughts_merged_in_one_write(monkeypatch):
+    monkeypatch.setattr(streaming._settings, "sse_stream_queue_size", 3)
+    produced: list[int] = []
+
+    async def events():
+        for seq in range(1, 11):
+            produced.append(seq)
+            yield seq, {"type": "thought", "content": str(seq)}
+
+    stream = streaming.create_sequenced_sse_stream(events())
+    first = await stream.__anext__()
+    # The producer is held back by the bounded queue while we don't read.
+    await asyncio.sleep(0.01)
+    assert len(produced) < 10
+    rest = [frame async for frame in stream]
+    frames = (first + "".join(rest)).strip().split("\n\n")
+    thoughts = [f for f in frames if '"thought"' in f]
+    assert "".join(json.loads(f.split("data: ")[1])["content"] for f in thoughts) == "12345678910"
+    assert len(thoughts) < 10
+    assert thoughts[-1].startswith("id: 10\n")
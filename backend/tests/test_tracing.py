@@ -0,0 +1,170 @@
+"""Tests for per-run span timelines (app.core.tracing) and their export."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from app.core import tracing
+from app.core.tracing import RunTrace, current_trace
+from app.services.agent.service import AgentService
+from app.services.workspace.workspace import Workspace
+from tests._fakes import FakeAgent, FakePart, event
+
+
+class _FakeResult:
+    def __init__(self, usages: list[tuple[int, int]]) -> None:
+        self._usages = usages
+
+    def new_messages(self):
+        return [
+            FakePart(
+                kind="response",
+                usage=FakePart(input_tokens=i, output_tokens=o, cache_read_tokens=0),
+            )
+            for i, o in self._usages
+        ]
+
+
+def _service() -> AgentService:
+    svc = AgentService(
+        workspace=Workspace(content="# Doc\n"),
+        provider="deepseek",
+        model="deepseek-chat",
+        api_key="sk-test",
+        base_url="http://localhost",
+    )
+    svc._agent = FakeAgent(
+        [
+            event("PartStartEvent"),
+            event(
+                "FunctionToolCallEvent",
+                part=FakePart(tool_name="get_section", tool_call_id="c1", args='{"h":"A"}'),
+            ),
+            event(
+                "FunctionToolResultEvent",
+                part=FakePart(
+                    tool_name="get_section", tool_call_id="c1", outcome="success", content="body"
+                ),
+            ),
+            event("PartDeltaEvent", delta=FakePart(content_delta="ok")),
+            event("AgentRunResultEvent", result=_FakeResult([(100, 10), (150, 20)])),
+        ]
+    )
+    return svc
+
+
+@pytest.mark.asyncio
+async def test_final_event_carries_trace_when_requested():
+    svc = _service()
+
+    events = [evt async for evt in svc.run("hi", trace=True)]
+
+    final = next(e for e in events if e["type"] == "final")
+    spans = final["trace"]["spans"]
+    assert [s["kind"] for s in spans] == ["model", "tool", "model"]
+    first_model, tool, second_model = spans
+    assert first_model["attributes"]["input_tokens"] == 100
+    assert second_model["attributes"]["output_tokens"] == 20
+    assert "ttft_ms" in first_model["attributes"]
+    assert tool["name"] == "tool get_section"
+    assert tool["attributes"] == {
+        "tool": "get_section",
+        "args_bytes": 9,
+        "ok": True,
+        "result_bytes": 4,
+    }
+
+
+@pytest.mark.asyncio
+async def test_final_event_has_no_trace_by_default():
+    svc = _service()
+
+    events = [evt async for evt in svc.run("hi")]
+
+    final = next(e for e in events if e["type"] == "final")
+    assert "trace" not in final
+    assert svc.trace.root.attributes["outcome"] == "final"
+
+
+@pytest.mark.asyncio
+async def test_contended_workspace_lock_is_recorded_on_current_trace():
+    ws = Workspace(content="# Doc\n")
+    trace = RunTrace()
+    current_trace.set(trace)
+    try:
+        async with ws._lock:
+            edit = asyncio.create_task(ws.set_title("New"))
+            await asyncio.sleep(0.01)
+        await edit
+    finally:
+        current_trace.set(None)
+
+    assert [s.name for s in trace.spans] == ["workspace.lock_wait"]
+    assert trace.spans[0].end - trace.spans[0].start >= 0.005
+
+
+@pytest.mark.asyncio
+async def test_uncontended_lock_adds_no_span():
+    ws = Workspace(content="# Doc\n")
+    trace = RunTrace()
+    current_trace.set(trace)
+    try:
+        await ws.set_title("New")
+    finally:
+        current_trace.set(None)
+
+    assert trace.spans == []
+
+
+@pytest.mark.asyncio
+async def test_fan_out_exports_one_trace_with_parts_nested(monkeypatch):
+    exported = []
+    monkeypatch.setattr("app.services.agent.service.export_trace", exported.append)
+
+    async def fake_invoke(self, agent, message, message_history):
+        span = self.trace.start_span("model.request", "model")
+        self.trace.end_span(span)
+        yield {"type": "thought", "content": "x"}
+
+    monkeypatch.setattr(AgentService, "_invoke_agent_run", fake_invoke)
+    svc = _service()
+    svc.workspace = Workspace(content="# A\na\n# B\nb\n")
+
+    events = [evt async for evt in svc.run("go", fan_out=True, trace=True)]
+
+    assert exported == [svc.trace]
+    spans = next(e for e in events if e["type"] == "final")["trace"]["spans"]
+    parts = [s for s in spans if s["kind"] == "part"]
+    assert [p["attributes"]["heading"] for p in parts] == ["A", "B"]
+    for part in parts:
+        (sub_root,) = [s for s in spans if s["parent_id"] == part["span_id"]]
+        (model,) = [s for s in spans if s["parent_id"] == sub_root["span_id"]]
+        assert sub_root["kind"] == "run" and model["kind"] == "model"
+        assert part["start_ms"] <= model["start_ms"]
+    otlp = svc.trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(otlp) == 1 + len(spans)
+    assert {s["traceId"] for s in otlp} == {svc.trace.trace_id}
+
+
+def test_export_trace_appends_otlp_json_lines(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing._settings, "agent_trace_file", str(path))
+    monkeypatch.setattr(tracing, "_exporter", None)
+    trace = RunTrace(provider="deepseek")
+    span = trace.start_span("tool get_section", "tool", tool="get_section")
+    trace.end_span(span, ok=True)
+    trace.finish(outcome="final")
+
+    tracing.export_trace(trace)
+    tracing._exporter.shutdown()
+
+    (line,) = path.read_text(encoding="utf-8").splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert root["traceId"] == child["traceId"] == trace.trace_id
+    assert child["parentSpanId"] == root["spanId"]
+    assert {"key": "ok", "value": {"boolValue": True}} in child["attributes"]
+    assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
@@ -86,6 +86,154 @@ async def test_replace_section_not_found_raises(ws):
         await ws.replace_section("Nonexistent", "x")
 
 
+@pytest.mark.asyncio
+async def test_heading_tools_accept_sloppy_heading_text(ws):
+    assert "body A" in await ws.get_section("## section a:")
+    await ws.insert_text("AFTER\n", after_heading="Section A ")
+    assert ws.content.endswith("AFTER\n")
+    await ws.replace_section("＃＃ Section A", "## Section A\n\nNEW\n")
+    assert "NEW" in ws.content and "body A" not in ws.content
+
+
+@pytest.mark.asyncio
+async def test_outline_is_cached_until_content_changes(ws, monkeypatch):
+    from app.services.workspace import workspace as workspace_mod
+
+    calls = []
+    real = workspace_mod.parse_outline
+    monkeypatch.setattr(
+        workspace_mod, "parse_outline", lambda c: calls.append(1) or real(c)
+    )
+    await ws.get_document_outline()
+    await ws.get_section("Section A")
+    assert len(calls) == 1
+    await ws.insert_text("more")
+    await ws.get_document_outline()
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_replace_snippet_edits_only_the_unique_match(ws):
+    v0 = ws.version
+    await ws.replace_snippet("intro text", "opening words")
+    assert "Some opening words." in ws.content
+    assert ws.version == v0 + 1
+
+
+@pytest.mark.asyncio
+async def test_replace_snippet_ambiguous_requires_occurrence():
+    ws = Workspace(content="# A\n\nfoo bar\n\n## B\n\nfoo baz\n")
+    with pytest.raises(ValueError, match="occurs 2 times"):
+        await ws.replace_snippet("foo", "qux")
+    await ws.replace_snippet("foo", "qux", occurrence=2)
+    assert ws.content == "# A\n\nfoo bar\n\n## B\n\nqux baz\n"
+    with pytest.raises(ValueError, match="out of range"):
+        await ws.replace_snippet("foo", "qux", occurrence=2)
+
+
+@pytest.mark.asyncio
+async def test_replace_snippet_scoped_to_heading():
+    ws = Workspace(content="# A\n\nfoo bar\n\n# B\n\nfoo baz\n")
+    await ws.replace_snippet("foo", "qux", heading="B")
+    assert ws.content == "# A\n\nfoo bar\n\n# B\n\nqux baz\n"
+    with pytest.raises(ValueError, match="snippet not found in section 'B'"):
+        await ws.replace_snippet("bar", "x", heading="B")
+
+
+@pytest.mark.asyncio
+async def test_search_document_reports_line_heading_and_snippet(ws):
+    result = await ws.search_document("BODY")
+    assert result["total"] == 1
+    hit = result["hits"][0]
+    assert hit["offset"] == ws.content.index("body A")
+    assert hit["line"] == 6
+    assert hit["heading"] == "Section A"
+    assert "body A" in hit["snippet"]
+
+
+@pytest.mark.asyncio
+async def test_search_document_regex_and_max_hits():
+    ws = Workspace(content="a1 a2 a3\n# H\na4\n")
+    result = await ws.search_document(r"a\d", regex=True, max_hits=2)
+    assert result["total"] == 4
+    assert [h["offset"] for h in result["hits"]] == [0, 3]
+    assert result["hits"][0]["heading"] is None
+    with pytest.raises(ValueError, match="invalid regex"):
+        await ws.search_document("(", regex=True)
+
+
+@pytest.mark.asyncio
+async def test_search_index_rebuilt_after_edit(ws):
+    assert (await ws.search_document("NEWWORD"))["total"] == 0
+    await ws.insert_text("NEWWORD\n")
+    assert (await ws.search_document("NEWWORD", case_sensitive=True))["total"] == 1
+
+
+def test_page_text_windows_and_snaps_to_line_ends():
+    from app.services.workspace.tools import page_text
+
+    text = "line one\nline two\nline three\n"
+    chunk, nxt = page_text(text, 0, 15)
+    assert chunk == "line one\n" and nxt == 9
+    chunk, nxt = page_text(text, nxt, 100)
+    assert chunk == "line two\nline three\n" and nxt is None
+    assert page_text(text) == (text, None)
+    with pytest.raises(ValueError, match="offset out of bounds"):
+        page_text(text, 999)
+
+
+def test_find_replace_single_pass_returns_new_spans():
+    from app.services.workspace.tools import find_replace
+
+    new, spans = find_replace("a-b-a", "a", "xyz")
+    assert new == "xyz-b-xyz"
+    assert spans == [(0, 3), (6, 9)]
+    assert [new[s:e] for s, e in spans] == ["xyz", "xyz"]
+    assert find_replace("a-b-a", "a", "x", count=1) == ("x-b-a", [(0, 1)])
+
+
+def test_find_replace_regex_whole_word_and_case():
+    from app.services.workspace.tools import find_replace
+
+    new, spans = find_replace("v1.2 and v3.4", r"v(\d)\.(\d)", r"\1_\2", regex=True)
+    assert new == "1_2 and 3_4" and len(spans) == 2
+    new, spans = find_replace("cat catalog Cat", "cat", "dog", whole_word=True, ignore_case=True)
+    assert new == "dog catalog dog"
+    with pytest.raises(ValueError, match="invalid regex"):
+        find_replace("x", "(", "y", regex=True)
+
+
+def test_find_replace_scoped_to_heading_or_range():
+    from app.services.workspace.tools import find_replace
+
+    doc = "# A\nfoo\n# B\nfoo\n"
+    assert find_replace(doc, "foo", "bar", heading="B")[0] == "# A\nfoo\n# B\nbar\n"
+    assert find_replace(doc, "foo", "bar", char_range=(0, 8))[0] == "# A\nbar\n# B\nfoo\n"
+    with pytest.raises(ValueError, match="char_range out of bounds"):
+        find_replace(doc, "foo", "bar", char_range=(0, 999))
+
+
+def test_compile_pattern_is_memoized():
+    from app.services.workspace.tools import compile_pattern
+
+    assert compile_pattern("x+", True) is compile_pattern("x+", True)
+
+
+@pytest.mark.asyncio
+async def test_find_replace_without_matches_does_not_commit(ws):
+    v0 = ws.version
+    assert await ws.find_replace("no such text", "x") == 0
+    assert ws.version == v0
+
+
+@pytest.mark.asyncio
+async def test_edits_record_last_edit_ranges(ws):
+    await ws.find_replace("Section", "Part")
+    assert ws.last_edit_ranges == [(ws.content.index("Part"), ws.content.index("Part") + 4)]
+    await ws.insert_text("END", position=len(ws.content))
+    assert ws.last_edit_ranges == [(len(ws.content) - 3, len(ws.content))]
+
+
 @pytest.mark.asyncio
 async def test_find_replace_empty_pattern_raises(ws):
     with pytest.raises(ValueError, match="pattern must be non-empty"):
@@ -158,9 +306,51 @@ async def test_apply_client_edit_conflict_returns_authoritative(ws):
     assert "AGENT" in res["content"]
 
 
+@pytest.mark.asyncio
+async def test_apply_client_delta_splices_and_records_ranges():
+    fresh = Workspace(content="abcdef")
+    res = await fresh.apply_client_delta(0, [(4, 6, "XY Z"), (0, 1, "")])
+    assert res == {"status": "ok", "content": "bcdXY Z", "version": 1}
+    assert fresh.last_edit_ranges == [(0, 0), (3, 7)]
+
+
+@pytest.mark.asyncio
+async def test_apply_client_delta_rejects_overlap_and_stale_base():
+    fresh = Workspace(content="abcdef")
+    with pytest.raises(ValueError):
+        await fresh.apply_client_delta(0, [(0, 3, "x"), (2, 4, "y")])
+    assert fresh.version == 0
+    await fresh.insert_text("!")
+    res = await fresh.apply_client_delta(0, [(0, 1, "z")])
+    assert res["status"] == "conflict"
+
+
 @pytest.mark.asyncio
 async def test_version_increments_on_each_write(ws):
     v0 = ws.version
     await ws.insert_text("a")
     await ws.insert_text("b")
     assert ws.version == v0 + 2
+
+
+@pytest.mark.asyncio
+async def test_write_tools_refuse_a_heading_with_a_different_number():
+    ws = Workspace(content="# Plan\n\n## Week 2\n\nold\n\n## Summary\n\nend\n")
+    with pytest.raises(ValueError, match="did you mean: 'Week 2'"):
+        await ws.replace_section("Week 1", "## Week 1\n\nnew\n")
+    assert "old" in ws.content and ws.version == 0
+
+
+@pytest.mark.asyncio
+async def test_write_tools_report_the_heading_actually_resolved():
+    ws = Workspace(content="# Plan\n\n## Installation Guide\n\nold\n\n## Summary\n\nend\n")
+    result = await ws.replace_section("Instalation Guide", "## Installation Guide\n\nnew\n\n")
+    assert result.startswith(
+        "replaced section 'Installation Guide' (requested 'Instalation Guide')"
+    )
+    result = await ws.insert_text("more\n", after_heading="summary")
+    assert "after section 'Summary' (requested 'summary')" in result
+    assert (await ws.replace_section("Summary", "## Summary\n\nfin\n")).startswith(
+        "replaced section 'Summary' (version"
+    )
+    assert await ws.resolve_heading("## installation guide") == "Installation Guide"
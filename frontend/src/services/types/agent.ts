@@ -6,10 +6,15 @@ export type AgentEventType =
   | 'tool_call'
   | 'tool_result'
   | 'document_patch'
+  | 'section_progress'
   | 'final'
   | 'stopped'
   | 'error'
-  | 'done';
+  | 'done'
+  | 'snapshot'
+  | 'lagged'
+  | 'turn_started'
+  | 'queued';
 
 export interface ThoughtEvent {
   type: 'thought';
@@ -33,11 +38,55 @@ export interface DocumentPatchEvent {
   type: 'document_patch';
   version: number;
   summary: string;
+  /** [start, end) char ranges written by this edit in the new version, when known. */
+  ranges?: [number, number][];
+}
+
+/** Fan-out mode: progress of one document part processed by a sub-agent. */
+export interface SectionProgressEvent {
+  type: 'section_progress';
+  index: number;
+  total: number;
+  heading: string | null;
+  status: 'running' | 'done' | 'unchanged' | 'failed';
+  error?: string;
+}
+
+/** One span of a run trace; offsets and durations are in milliseconds. */
+export interface TraceSpan {
+  name: string;
+  /** 'part' covers one fan-out part; its sub-run's spans ('run' and below) nest under it. */
+  kind: 'model' | 'tool' | 'lock' | 'part' | 'run';
+  span_id: string;
+  /** null for spans directly under the run. */
+  parent_id: string | null;
+  start_ms: number;
+  duration_ms: number;
+  attributes: Record<string, unknown>;
+}
+
+export interface RunTrace {
+  trace_id: string;
+  duration_ms: number;
+  spans: TraceSpan[];
+}
+
+/** Provider-reported token counts of a run or a whole session. */
+export interface TokenUsage {
+  requests: number;
+  input_tokens: number;
+  output_tokens: number;
+  cache_read_tokens: number;
+  cache_write_tokens: number;
+  total_tokens: number;
 }
 
 export interface FinalEvent {
   type: 'final';
   content: string;
+  usage?: TokenUsage;
+  /** Present when the message was sent with `trace: true`. */
+  trace?: RunTrace;
 }
 
 export interface StoppedEvent {
@@ -53,6 +102,34 @@ export interface ErrorEvent {
 export interface DoneEvent {
   type: 'done';
   content: string;
+  turn_id?: string;
+}
+
+/** First event of every agent turn. */
+export interface TurnStartedEvent {
+  type: 'turn_started';
+  turn_id: string;
+}
+
+/** A message waiting behind the running turn; position 1 runs next. */
+export interface QueuedEvent {
+  type: 'queued';
+  turn_id: string;
+  position: number;
+}
+
+/** Subscribe-only stream: current state sent first on connect. */
+export interface SnapshotEvent {
+  type: 'snapshot';
+  version: number;
+  title: string;
+  status: string;
+}
+
+/** Subscribe-only stream: events were dropped for a slow reader; refetch the document. */
+export interface LaggedEvent {
+  type: 'lagged';
+  dropped: number;
 }
 
 export type AgentEvent =
@@ -60,10 +137,29 @@ export type AgentEvent =
   | ToolCallEvent
   | ToolResultEvent
   | DocumentPatchEvent
+  | SectionProgressEvent
   | FinalEvent
   | StoppedEvent
   | ErrorEvent
-  | DoneEvent;
+  | DoneEvent
+  | SnapshotEvent
+  | LaggedEvent
+  | TurnStartedEvent
+  | QueuedEvent;
+
+/** GET /sessions/{id}/stats */
+export interface SessionStats {
+  status: string;
+  turns: number;
+  queued: number;
+  usage: TokenUsage;
+  /** null when no per-session budget is configured. */
+  token_budget: number | null;
+  token_budget_remaining: number | null;
+  message_history_messages: number;
+  workspace_version: number;
+  workspace_bytes: number;
+}
 
 // Request types
 export interface CreateSessionRequest {
@@ -95,11 +191,24 @@ export interface SendMessageRequest {
   cursor_position?: number;
   /** Named context snippets; the backend expands `@<ref>` mentions. */
   contexts?: ContextItem[];
+  /** `fan_out` applies the message to each top-level section in parallel. */
+  mode?: 'default' | 'fan_out';
+  /** Attach the run's span timeline to its final event. */
+  trace?: boolean;
 }
 
+/** One splice of a delta sync: replace [start, end) of the base version. */
+export interface TextEdit {
+  start: number;
+  end: number;
+  text: string;
+}
+
+/** Exactly one of `content` (full document) or `edits` must be set. */
 export interface ClientSyncRequest {
   base_version: number;
-  content: string;
+  content?: string;
+  edits?: TextEdit[];
 }
 
 export interface ClientSyncResponse {